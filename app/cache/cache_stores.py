@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+
+from app.cache.caching_functions import save_dict_to_cache, retrieve_dict_from_cache, delete_key
+from app.logging.log import get_logger
+
+
+class RedisCacheStore:
+    """
+    Stores string dictionaries as redis hashes. Each key is prefixed so that entries belonging
+    to different caches cannot collide with each other, or with the flood severity/postcode keys.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+
+
+    def get(self, key: str) -> dict[str, str] | None:
+        entry: dict | None = retrieve_dict_from_cache(self.prefix + key)
+        if not entry:
+            return None
+        return entry
+
+
+    def set(self, key: str, entry: dict[str, str]) -> None:
+        save_dict_to_cache(self.prefix + key, entry)
+
+
+    def delete(self, key: str) -> None:
+        delete_key(self.prefix + key)
+
+
+class FileCacheStore:
+    """
+    Stores string dictionaries as JSON files inside a local directory.
+    File names are derived from a hash of the key, so any string (such as a URL) can be used as a key.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = os.path.expanduser(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+
+    def get(self, key: str) -> dict[str, str] | None:
+        try:
+            with open(self.path_for(key), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            get_logger().warning(f"Could not read cache entry for {key}: {e}")
+            return None
+
+
+    def set(self, key: str, entry: dict[str, str]) -> None:
+        path = self.path_for(key)
+        temporary_path = path + ".tmp"
+        try:
+            with open(temporary_path, "w", encoding="utf-8") as file:
+                json.dump(entry, file)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            get_logger().warning(f"Could not write cache entry for {key}: {e}")
+
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
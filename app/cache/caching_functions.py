@@ -80,4 +80,10 @@ def persist_key(key: str) -> None:
     try:
         redis.persist(key)
     except ConnectionError as e:
-        get_logger().warning(f"Redis connection error: {e}")
\ No newline at end of file
+        get_logger().warning(f"Redis connection error: {e}")
+
+def delete_key(key: str) -> None:
+    try:
+        redis.delete(key)
+    except ConnectionError as e:
+        get_logger().warning(f"Redis connection error: {e}")
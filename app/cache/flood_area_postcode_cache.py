@@ -0,0 +1,120 @@
+import json
+
+from app.cache.cache_stores import RedisCacheStore, FileCacheStore
+from app.env_vars import flood_area_postcode_directory
+from app.logging.log import get_logger
+
+FLOOD_AREA_POSTCODE_KEY_PREFIX = "flood_area_postcodes:"
+
+
+class FloodAreaPostcodeStats:
+    """
+    Counters which show how often a flood area's postcodes could be looked up rather than matched.
+    Invalidations are lookups which found an entry for the flood area, but for a different polygon.
+    They are also counted as misses.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.misses
+
+
+    @property
+    def hit_rate(self) -> float:
+        if self.lookups == 0:
+            return 0.0
+        return self.hits / self.lookups
+
+
+    def reset(self) -> None:
+        self.__init__()
+
+
+    def __repr__(self) -> str:
+        return (f"FloodAreaPostcodeStats(lookups={self.lookups}, hits={self.hits}, misses={self.misses}, "
+                f"invalidations={self.invalidations}, hit_rate={self.hit_rate:.2%})")
+
+
+class FloodAreaPostcodeCache:
+    """
+    Persistent mapping of every flood area in the Environment Agency's catalogue to the postcodes it covers.
+
+    There is one entry per flood area, which records a digest of the flood area polygon the postcodes were matched
+    against. An entry is only used while the digest still matches, so a flood area whose polygon has changed is
+    matched again. The mapping is built ahead of time by flood_area_catalogue_service, and kept up to date with
+    the postcodes of any flood area which has to be matched during a run.
+    """
+
+    def __init__(self, store: RedisCacheStore | FileCacheStore):
+        self.store = store
+        self.stats = FloodAreaPostcodeStats()
+
+
+    def get_digest(self, flood_area_id: str) -> str | None:
+        """
+        @param flood_area_id: the ID of the flood area
+        @return: the digest of the polygon the flood area's postcodes were matched against, or None if it has
+        not been matched
+        """
+        entry: dict[str, str] | None = self.store.get(flood_area_id)
+        return entry.get("polygonDigest") if entry is not None else None
+
+
+    def get(self, flood_area_id: str, polygon_digest: str) -> set[str] | None:
+        """
+        @param flood_area_id: the ID of the flood area
+        @param polygon_digest: a digest of the flood area polygon
+        @return: the postcodes the flood area covers, or None if they are not in the mapping
+        """
+        entry: dict[str, str] | None = self.store.get(flood_area_id)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        if entry.get("polygonDigest") != polygon_digest:
+            self.stats.invalidations += 1
+            self.stats.misses += 1
+            return None
+        try:
+            postcodes: set[str] = set(json.loads(entry["postcodes"]))
+        except (KeyError, ValueError, TypeError) as e:
+            get_logger().warning(f"Discarding malformed flood area postcode entry for {flood_area_id}: {e}")
+            self.store.delete(flood_area_id)
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return postcodes
+
+
+    def put(self, flood_area_id: str, polygon_digest: str, postcodes: set[str]) -> None:
+        """
+        Records the postcodes a flood area covers, replacing any entry it already had.
+        """
+        self.store.delete(flood_area_id)
+        self.store.set(flood_area_id, {
+            "polygonDigest": polygon_digest,
+            "postcodes": json.dumps(sorted(postcodes), separators=(",", ":"))
+        })
+
+
+__flood_area_postcode_cache: FloodAreaPostcodeCache | None = None
+
+
+def get_flood_area_postcode_cache() -> FloodAreaPostcodeCache:
+    """
+    Returns the process-wide flood area postcode mapping. Entries are stored in the directory given by
+    FLOOD_AREA_POSTCODE_DIRECTORY if it is set, and in redis otherwise.
+    """
+    global __flood_area_postcode_cache
+    if __flood_area_postcode_cache is None:
+        if flood_area_postcode_directory:
+            store = FileCacheStore(flood_area_postcode_directory)
+        else:
+            store = RedisCacheStore(FLOOD_AREA_POSTCODE_KEY_PREFIX)
+        __flood_area_postcode_cache = FloodAreaPostcodeCache(store)
+    return __flood_area_postcode_cache
@@ -0,0 +1,55 @@
+import hashlib
+
+from app.cache.caching_functions import save_dict_to_cache, retrieve_dict_from_cache, delete_key
+from app.models.pydantic_models.flood_warning import FloodWarning
+
+FLOOD_SNAPSHOT_KEY = "flood_snapshot"
+
+
+def fingerprint_flood(flood: FloodWarning) -> str:
+    """
+    Creates a fingerprint of the parts of a flood warning which change whenever
+    the warning itself changes.
+
+    @param flood: a FloodWarning object
+    @return: the fingerprint as a hex digest
+    """
+    fingerprint_fields = (flood.floodAreaID,
+                          str(flood.severityLevel),
+                          flood.timeMessageChanged,
+                          flood.timeSeverityChanged)
+    return hashlib.sha1("|".join(fingerprint_fields).encode()).hexdigest()
+
+
+def get_flood_snapshot() -> dict[str, str]:
+    """
+    @return: the previous run's snapshot, mapping each flood area ID to its fingerprint.
+    If there is no snapshot, or the cache is unavailable, the snapshot is empty.
+    """
+    return retrieve_dict_from_cache(FLOOD_SNAPSHOT_KEY) or {}
+
+
+def save_flood_snapshot(floods: list[FloodWarning]) -> None:
+    """
+    Replaces the previous run's snapshot with the fingerprints of the given floods.
+    Floods which are no longer in the feed are dropped from the snapshot.
+
+    @param floods: every flood in the latest flood update
+    """
+    delete_key(FLOOD_SNAPSHOT_KEY)
+    snapshot: dict[str, str] = {flood.floodAreaID: fingerprint_flood(flood) for flood in floods}
+    if len(snapshot) > 0:
+        save_dict_to_cache(FLOOD_SNAPSHOT_KEY, snapshot)
+
+
+def get_changed_floods(floods: list[FloodWarning]) -> list[FloodWarning]:
+    """
+    Drops every flood which is unchanged since the previous run, so that no geometry work
+    or database queries are spent on it.
+
+    @param floods: every flood in the latest flood update
+    @return: a list of the floods which are new, or have changed since the previous run
+    """
+    snapshot: dict[str, str] = get_flood_snapshot()
+    return [flood for flood in floods
+            if snapshot.get(flood.floodAreaID) != fingerprint_flood(flood)]
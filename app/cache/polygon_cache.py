@@ -0,0 +1,179 @@
+import time
+from collections import OrderedDict
+
+
+from app.cache.cache_stores import RedisCacheStore, FileCacheStore
+from app.env_vars import polygon_cache_directory
+from app.logging.log import get_logger
+from app.models.objects.flood_area_polygon import FloodAreaPolygon
+
+POLYGON_CACHE_KEY_PREFIX = "polygon_cache:"
+POLYGON_CACHE_MAX_AGE_SECONDS = 86400
+PARSED_POLYGON_LIMIT = 512
+
+
+class CachedPolygon:
+    """
+    A flood area polygon response body along with the validators needed to revalidate it.
+    """
+
+    def __init__(self, body: str, etag: str | None, last_modified: str | None, fetched_at: float):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+
+    def is_fresh(self, max_age: float) -> bool:
+        return time.time() - self.fetched_at < max_age
+
+
+    def conditional_headers(self) -> dict[str, str]:
+        """
+        @return: the If-None-Match/If-Modified-Since headers to revalidate this entry with.
+        """
+        headers: dict[str, str] = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+    def to_dict(self) -> dict[str, str]:
+        return {
+            "body": self.body,
+            "etag": self.etag or "",
+            "lastModified": self.last_modified or "",
+            "fetchedAt": str(self.fetched_at)
+        }
+
+
+    @staticmethod
+    def from_dict(entry: dict[str, str]):
+        return CachedPolygon(entry["body"],
+                             entry.get("etag") or None,
+                             entry.get("lastModified") or None,
+                             float(entry.get("fetchedAt", 0)))
+
+
+class PolygonCacheStats:
+    """
+    Counters which show how much downloading the polygon cache has saved.
+    Fresh hits are served without a request being made, revalidations are requests answered with a
+    304 Not Modified, and misses are full downloads.
+    """
+
+    def __init__(self):
+        self.fresh_hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+
+    @property
+    def requests(self) -> int:
+        return self.fresh_hits + self.revalidations + self.misses
+
+
+    @property
+    def hit_rate(self) -> float:
+        if self.requests == 0:
+            return 0.0
+        return (self.fresh_hits + self.revalidations) / self.requests
+
+
+    def reset(self) -> None:
+        self.__init__()
+
+
+    def __repr__(self) -> str:
+        return (f"PolygonCacheStats(requests={self.requests}, fresh_hits={self.fresh_hits}, "
+                f"revalidations={self.revalidations}, misses={self.misses}, "
+                f"hit_rate={self.hit_rate:.2%}, bytes_saved={self.bytes_saved})")
+
+
+class PolygonCache:
+    """
+    Persistent cache of flood area polygons keyed by the polygon URL.
+
+    Entries are kept in redis, or in a local directory, along with their ETag/Last-Modified validators.
+    Deserialized polygons are also kept in memory, so a fresh entry or a 304 Not Modified response
+    does not need to be parsed again for as long as the process is running. Every caller is given its own copy
+    of a kept polygon, so that nothing one run does to it is seen by the next.
+    """
+
+    def __init__(self, store: RedisCacheStore | FileCacheStore, max_age: float = POLYGON_CACHE_MAX_AGE_SECONDS):
+        self.store = store
+        self.max_age = max_age
+        self.stats = PolygonCacheStats()
+        self.parsed_polygons: OrderedDict[str, tuple[float, FloodAreaPolygon]] = OrderedDict()
+
+
+    def get(self, url: str) -> CachedPolygon | None:
+        entry: dict[str, str] | None = self.store.get(url)
+        if entry is None:
+            return None
+        try:
+            return CachedPolygon.from_dict(entry)
+        except (KeyError, ValueError) as e:
+            get_logger().warning(f"Discarding malformed polygon cache entry for {url}: {e}")
+            self.store.delete(url)
+            return None
+
+
+    def put(self, url: str, body: str, etag: str | None, last_modified: str | None,
+            polygon: FloodAreaPolygon) -> None:
+        cached_polygon = CachedPolygon(body, etag, last_modified, time.time())
+        self.store.set(url, cached_polygon.to_dict())
+        self.remember(url, cached_polygon, polygon.copy())
+
+
+    def refresh(self, url: str, cached_polygon: CachedPolygon) -> None:
+        """
+        Marks a revalidated entry as fresh again.
+        """
+        parsed = self.parsed_polygons.pop(url, None)
+        cached_polygon.fetched_at = time.time()
+        self.store.set(url, cached_polygon.to_dict())
+        if parsed is not None:
+            self.remember(url, cached_polygon, parsed[1])
+
+
+    def get_parsed_polygon(self, url: str, cached_polygon: CachedPolygon) -> FloodAreaPolygon:
+        """
+        Returns a copy of the deserialized polygon for a cache entry, only parsing the stored body
+        if it has not already been parsed by this process.
+        """
+        parsed = self.parsed_polygons.get(url)
+        if parsed is not None and parsed[0] == cached_polygon.fetched_at:
+            self.parsed_polygons.move_to_end(url)
+            return parsed[1].copy()
+        polygon: FloodAreaPolygon = FloodAreaPolygon.from_body(cached_polygon.body)
+        self.remember(url, cached_polygon, polygon)
+        return polygon.copy()
+
+
+    def remember(self, url: str, cached_polygon: CachedPolygon, polygon: FloodAreaPolygon) -> None:
+        self.parsed_polygons[url] = (cached_polygon.fetched_at, polygon)
+        self.parsed_polygons.move_to_end(url)
+        while len(self.parsed_polygons) > PARSED_POLYGON_LIMIT:
+            self.parsed_polygons.popitem(last=False)
+
+
+__polygon_cache: PolygonCache | None = None
+
+
+def get_polygon_cache() -> PolygonCache:
+    """
+    Returns the process-wide polygon cache. Entries are stored in the directory given by
+    POLYGON_CACHE_DIRECTORY if it is set, and in redis otherwise.
+    """
+    global __polygon_cache
+    if __polygon_cache is None:
+        if polygon_cache_directory:
+            store = FileCacheStore(polygon_cache_directory)
+        else:
+            store = RedisCacheStore(POLYGON_CACHE_KEY_PREFIX)
+        __polygon_cache = PolygonCache(store)
+    return __polygon_cache
@@ -0,0 +1,152 @@
+import asyncio
+import time
+from typing import Any
+
+from azure.cosmos.aio import CosmosClient
+from azure.cosmos.exceptions import CosmosHttpResponseError
+
+from app.cosmos.cosmos_functions import async_get_shard_keys, async_get_area_geometries
+from app.logging.log import get_logger
+from app.models.objects.postcode_shard import PostcodeShard, Bounds
+from app.services.geometry_subdivision_service import get_geojson_bounds
+
+SHARD_MAP_MAX_AGE_SECONDS = 3600
+
+
+class ShardMapStats:
+    """
+    Counters which show how often the shard map was reused, and how many shards were skipped because
+    none of their areas could intersect the flood geometry being matched.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.refreshes = 0
+        self.extents_read = 0
+        self.shards_matched = 0
+        self.shards_skipped = 0
+
+
+    @property
+    def skip_rate(self) -> float:
+        shards: int = self.shards_matched + self.shards_skipped
+        if shards == 0:
+            return 0.0
+        return self.shards_skipped / shards
+
+
+    def reset(self) -> None:
+        self.__init__()
+
+
+    def __repr__(self) -> str:
+        return (f"ShardMapStats(hits={self.hits}, refreshes={self.refreshes}, extents_read={self.extents_read}, "
+                f"shards_matched={self.shards_matched}, shards_skipped={self.shards_skipped}, "
+                f"skip_rate={self.skip_rate:.2%})")
+
+
+class ShardMapCache:
+    """
+    In-memory cache of the shard map, along with the extent of every shard's postcode areas.
+
+    Rather than reading the shard map for every geometry matched, it is read once and kept for max_age seconds.
+    The first time a shard is seen, its area geometries are read too, so that shards which cannot intersect a
+    flood geometry can be skipped without querying them. Only the bounding boxes of the areas are kept, and
+    since postcode areas do not move, they are kept across refreshes of the shard map: a refresh only reads the
+    area geometries of shards which are new, or whose extent could not be read before. Concurrent callers which
+    ask for the shard map while it is being read all wait for the same read.
+    """
+
+    def __init__(self, max_age: float = SHARD_MAP_MAX_AGE_SECONDS):
+        self.max_age = max_age
+        self.shards: list[PostcodeShard] | None = None
+        self.area_bounds: dict[str, list[Bounds]] = {}
+        self.fetched_at = 0.0
+        self.lock: asyncio.Lock | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.stats = ShardMapStats()
+
+
+    def is_fresh(self) -> bool:
+        return self.shards is not None and time.time() - self.fetched_at < self.max_age
+
+
+    def invalidate(self) -> None:
+        self.shards = None
+        self.area_bounds = {}
+
+
+    async def get_shards(self, client: CosmosClient) -> list[PostcodeShard]:
+        """
+        @param client: Cosmos DB client
+        @return: every shard in the shard map, read from Cosmos DB if the cached shard map has expired
+        """
+        if self.is_fresh():
+            self.stats.hits += 1
+            return self.shards
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.is_fresh():
+                self.stats.hits += 1
+                return self.shards
+            shard_keys: list[dict[str, Any]] = [shard_key async for shard_key in async_get_shard_keys(client)]
+            shards: list[PostcodeShard] = [PostcodeShard(shard_key["databaseName"],
+                                                         self.area_bounds.get(shard_key["databaseName"]))
+                                           for shard_key in shard_keys]
+            unknown_shards: list[PostcodeShard] = [shard for shard in shards if shard.get_area_bounds() is None]
+            await asyncio.gather(*[self.load_area_bounds(client, shard) for shard in unknown_shards])
+            self.stats.extents_read += len(unknown_shards)
+            self.area_bounds = {shard.get_database_name(): shard.get_area_bounds()
+                                for shard in shards if shard.get_area_bounds() is not None}
+            self.shards = shards
+            self.fetched_at = time.time()
+            self.stats.refreshes += 1
+            get_logger().info(f"Read shard map of {len(shards)} shards, "
+                              f"{sum(shard.get_area_bounds() is None for shard in shards)} without a known extent")
+        return self.shards
+
+
+    @staticmethod
+    async def load_area_bounds(client: CosmosClient, shard: PostcodeShard) -> None:
+        """
+        Reads the bounding box of each of a shard's areas. If they cannot be read, the shard's extent is left
+        unknown, so that it is never skipped.
+        """
+        try:
+            area_bounds: list[Bounds] = []
+            async for area in async_get_area_geometries(client, shard.get_database_name(), shard.get_partition_key()):
+                if area.get("geometry") is not None:
+                    area_bounds.append(get_geojson_bounds(area["geometry"]))
+            shard.set_area_bounds(area_bounds)
+        except (CosmosHttpResponseError, KeyError, TypeError, ValueError) as e:
+            get_logger().warning(f"Could not read the extent of shard {shard.get_database_name()}, "
+                                 f"so it will never be skipped: {e!r}")
+
+
+    async def get_intersecting_shards(self, client: CosmosClient, bounds: Bounds) -> list[PostcodeShard]:
+        """
+        @param client: Cosmos DB client
+        @param bounds: the bounding box of a flood geometry
+        @return: every shard with an area which could intersect the flood geometry
+        """
+        shards: list[PostcodeShard] = await self.get_shards(client)
+        intersecting_shards: list[PostcodeShard] = [shard for shard in shards if shard.intersects(bounds)]
+        self.stats.shards_matched += len(intersecting_shards)
+        self.stats.shards_skipped += len(shards) - len(intersecting_shards)
+        return intersecting_shards
+
+
+__shard_map_cache: ShardMapCache | None = None
+
+
+def get_shard_map_cache() -> ShardMapCache:
+    """
+    Returns the process-wide shard map cache.
+    """
+    global __shard_map_cache
+    if __shard_map_cache is None:
+        __shard_map_cache = ShardMapCache()
+    return __shard_map_cache
@@ -0,0 +1,154 @@
+import json
+import time
+
+from app.cache.cache_stores import RedisCacheStore, FileCacheStore
+from app.env_vars import subdivision_cache_directory
+from app.logging.log import get_logger
+
+SUBDIVISION_CACHE_KEY_PREFIX = "subdivision_cache:"
+SUBDIVISION_CACHE_INDEX_KEY = "__index__"
+SUBDIVISION_CACHE_MAX_ENTRIES = 2000
+
+
+class SubdivisionCacheStats:
+    """
+    Counters which show how often a flood's subdivided geometries could be reused.
+    Invalidations are lookups which found an entry for the flood area, but for a different
+    polygon or different subdivision parameters. They are also counted as misses.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.misses
+
+
+    @property
+    def hit_rate(self) -> float:
+        if self.lookups == 0:
+            return 0.0
+        return self.hits / self.lookups
+
+
+    def reset(self) -> None:
+        self.__init__()
+
+
+    def __repr__(self) -> str:
+        return (f"SubdivisionCacheStats(lookups={self.lookups}, hits={self.hits}, misses={self.misses}, "
+                f"invalidations={self.invalidations}, evictions={self.evictions}, hit_rate={self.hit_rate:.2%})")
+
+
+class SubdivisionCache:
+    """
+    Persistent cache of the geometries each flood area was subdivided into.
+
+    There is one entry per flood area, which records a digest of the flood area polygon and the parameters
+    (mode, threshold or budget, and preparation settings) it was subdivided with. An entry is only used if both
+    still match, and is replaced as soon as either changes.
+
+    The cache holds at most max_entries flood areas. An index of when each entry was last used is kept alongside
+    the entries, and the least recently used entries are evicted once the cache is full. The index is only written
+    back to the store by flush(), which should be called once every flood has been looked up.
+    """
+
+    def __init__(self, store: RedisCacheStore | FileCacheStore, max_entries: int = SUBDIVISION_CACHE_MAX_ENTRIES):
+        self.store = store
+        self.max_entries = max_entries
+        self.stats = SubdivisionCacheStats()
+        self.index: dict[str, float] | None = None
+
+
+    def get_index(self) -> dict[str, float]:
+        if self.index is None:
+            entry: dict[str, str] | None = self.store.get(SUBDIVISION_CACHE_INDEX_KEY)
+            self.index = {}
+            for flood_area_id, used_at in (entry or {}).items():
+                try:
+                    self.index[flood_area_id] = float(used_at)
+                except ValueError:
+                    pass
+        return self.index
+
+
+    def get(self, flood_area_id: str, geometry_digest: str, parameters: str) -> list[dict] | None:
+        """
+        @param flood_area_id: the ID of the flood area
+        @param geometry_digest: a digest of the flood area polygon
+        @param parameters: the parameters the flood area polygon is to be subdivided with
+        @return: the subdivided geometries, or None if they are not in the cache
+        """
+        entry: dict[str, str] | None = self.store.get(flood_area_id)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        if entry.get("geometryDigest") != geometry_digest or entry.get("parameters") != parameters:
+            self.stats.invalidations += 1
+            self.stats.misses += 1
+            return None
+        try:
+            geometries: list[dict] = json.loads(entry["geometries"])
+        except (KeyError, ValueError) as e:
+            get_logger().warning(f"Discarding malformed subdivision cache entry for {flood_area_id}: {e}")
+            self.store.delete(flood_area_id)
+            self.get_index().pop(flood_area_id, None)
+            self.stats.misses += 1
+            return None
+        self.get_index()[flood_area_id] = time.time()
+        self.stats.hits += 1
+        return geometries
+
+
+    def put(self, flood_area_id: str, geometry_digest: str, parameters: str, geometries: list[dict]) -> None:
+        """
+        Caches a flood area's subdivided geometries, replacing any entry it already had,
+        and evicts the least recently used entries if the cache is full.
+        """
+        self.store.set(flood_area_id, {
+            "geometryDigest": geometry_digest,
+            "parameters": parameters,
+            "geometries": json.dumps(geometries, separators=(",", ":"))
+        })
+        index: dict[str, float] = self.get_index()
+        index[flood_area_id] = time.time()
+        while len(index) > self.max_entries:
+            least_recently_used: str = min(index, key=index.get)
+            self.store.delete(least_recently_used)
+            del index[least_recently_used]
+            self.stats.evictions += 1
+
+
+    def flush(self) -> None:
+        """
+        Writes the index of when each entry was last used back to the store.
+        """
+        if self.index is None:
+            return
+        self.store.delete(SUBDIVISION_CACHE_INDEX_KEY)
+        if len(self.index) > 0:
+            self.store.set(SUBDIVISION_CACHE_INDEX_KEY,
+                           {flood_area_id: str(used_at) for flood_area_id, used_at in self.index.items()})
+
+
+__subdivision_cache: SubdivisionCache | None = None
+
+
+def get_subdivision_cache() -> SubdivisionCache:
+    """
+    Returns the process-wide subdivision cache. Entries are stored in the directory given by
+    SUBDIVISION_CACHE_DIRECTORY if it is set, and in redis otherwise.
+    """
+    global __subdivision_cache
+    if __subdivision_cache is None:
+        if subdivision_cache_directory:
+            store = FileCacheStore(subdivision_cache_directory)
+        else:
+            store = RedisCacheStore(SUBDIVISION_CACHE_KEY_PREFIX)
+        __subdivision_cache = SubdivisionCache(store)
+    return __subdivision_cache
@@ -1,3 +1,9 @@
+import asyncio
+from weakref import WeakKeyDictionary
+
+from aiohttp import ClientSession, TCPConnector, DummyCookieJar
+from azure.core.pipeline.transport import AioHttpTransport
+
 from app.env_vars import *
 from azure.common import AzureMissingResourceHttpError
 from azure.cosmos.container import ContainerProxy
@@ -6,8 +12,143 @@ from azure.identity import DefaultAzureCredential
 
 from app.logging.log import get_logger
 
+MAX_CONNECTIONS = 50
+KEEPALIVE_TIMEOUT_SECONDS = 60
+
 credential: DefaultAzureCredential = DefaultAzureCredential()
 
+__container_proxies: WeakKeyDictionary[CosmosClient, dict[tuple[str, str], ContainerProxy]] = WeakKeyDictionary()
+
+
+class CosmosClientManager:
+    """
+    Owns the single asynchronous Cosmos DB client shared by every concurrent match in the process.
+
+    Opening a client negotiates a TLS session, exchanges an AAD token and reads the database account, so the
+    client is opened once, on first use, and kept open with a keep-alive connection pool until it is closed on
+    shutdown. Concurrent callers which ask for the client while it is being opened all wait for the same client.
+    """
+
+    def __init__(self, endpoint: str | None = None, max_connections: int = MAX_CONNECTIONS):
+        self.endpoint = endpoint
+        self.max_connections = max_connections
+        self.client: CosmosClient | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.lock: asyncio.Lock | None = None
+
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+    async def open(self) -> CosmosClient:
+        """
+        Opens the shared client, unless it is already open.
+
+        @return: the shared CosmosClient
+        """
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # a client (and its lock) can only be used on the event loop it was opened on
+            stale_client, stale_loop = self.client, self.loop
+            self.client = None
+            self.loop = loop
+            self.lock = asyncio.Lock()
+            if stale_client is not None:
+                await self.close_stale_client(stale_client, stale_loop)
+        async with self.lock:
+            if self.client is None:
+                session: ClientSession = ClientSession(
+                    connector=TCPConnector(limit=self.max_connections, keepalive_timeout=KEEPALIVE_TIMEOUT_SECONDS),
+                    cookie_jar=DummyCookieJar(),
+                    auto_decompress=False,
+                    trust_env=True)
+                client: CosmosClient = CosmosClient(self.endpoint or cosmos_endpoint, credential,
+                                                    transport=AioHttpTransport(session=session))
+                try:
+                    await client.__aenter__()
+                except BaseException:
+                    await session.close()
+                    raise
+                self.client = client
+                get_logger().info("Opened shared Cosmos DB client")
+        return self.client
+
+
+    @staticmethod
+    async def close_stale_client(client: CosmosClient, loop: asyncio.AbstractEventLoop | None) -> None:
+        """
+        Closes a client opened on another event loop, so that its connection pool is not leaked. If that loop is
+        still running (in another thread), the client is closed on it. Otherwise it is closed here, which closes
+        its session even though the connections of a closed loop can no longer be shut down cleanly.
+
+        @param client: the client opened on the other event loop
+        @param loop: the event loop the client was opened on
+        """
+        try:
+            if loop is not None and loop.is_running() and not loop.is_closed():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(client.close(), loop))
+            else:
+                await client.close()
+            get_logger().info("Closed shared Cosmos DB client opened on another event loop")
+        except Exception as e:
+            get_logger().warning(f"Could not close the Cosmos DB client opened on another event loop: {e!r}")
+
+
+    async def get_client(self) -> CosmosClient:
+        """
+        @return: the shared CosmosClient, which is opened if it is not already
+        """
+        if self.client is not None and self.loop is asyncio.get_running_loop():
+            return self.client
+        return await self.open()
+
+
+    async def close(self) -> None:
+        """
+        Closes the shared client and its connection pool.
+        """
+        client: CosmosClient | None = self.client
+        self.client = None
+        if client is not None:
+            await client.close()
+            get_logger().info("Closed shared Cosmos DB client")
+
+
+__cosmos_client_manager: CosmosClientManager | None = None
+
+
+def get_cosmos_client_manager() -> CosmosClientManager:
+    """
+    Returns the process-wide Cosmos DB client manager.
+    """
+    global __cosmos_client_manager
+    if __cosmos_client_manager is None:
+        __cosmos_client_manager = CosmosClientManager()
+    return __cosmos_client_manager
+
+
+def get_container(client: CosmosClient, database_name: str, container_name: str) -> ContainerProxy:
+    """
+    Gets a container proxy from a client, reusing the proxy if the client has been asked for it before.
+
+    @param client: Cosmos DB client
+    @param database_name: Name of the database
+    @param container_name: Name of the container
+    @return ContainerProxy: this is the container object which is used to make queries to.
+    """
+    container_proxies: dict[tuple[str, str], ContainerProxy] = __container_proxies.setdefault(client, {})
+    container: ContainerProxy | None = container_proxies.get((database_name, container_name))
+    if container is None:
+        container = client.get_database_client(database_name).get_container_client(container_name)
+        container_proxies[(database_name, container_name)] = container
+    return container
+
 
 def get_shard_map_container(client : CosmosClient) -> ContainerProxy:
     """
@@ -18,10 +159,7 @@ def get_shard_map_container(client : CosmosClient) -> ContainerProxy:
     @param client: Cosmos DB client - the connection object which is used to interface with the Cosmos DB instance.
     """
     try:
-        return (client
-                .get_database_client(shard_map_database)
-                .get_container_client(shard_map_container)
-                )
+        return get_container(client, shard_map_database, shard_map_container)
     except AzureMissingResourceHttpError as e:
         get_logger().fatal(f"Cosmos DB client is missing a required resource: {e}")
         raise e
@@ -39,10 +177,7 @@ def get_postcodes_area_container(client: CosmosClient, database_name: str) -> Co
     """
     try:
         prefix = database_name.split("-")[0]
-        return (client
-                .get_database_client(database_name)
-                .get_container_client(prefix + area_container_suffix)
-                )
+        return get_container(client, database_name, prefix + area_container_suffix)
     except AzureMissingResourceHttpError as e:
         get_logger().fatal(f"Cosmos DB client is missing a required resource: {e}")
         raise e
@@ -58,10 +193,7 @@ def get_postcodes_district_container(client: CosmosClient, area_code: str) -> Co
     @throws AzureMissingResourceHttpError: If no container, or postcode database exists, this error is thrown.
     """
     try:
-        return (client
-                .get_database_client(area_code + postcode_database_suffix)
-                .get_container_client(area_code + district_container_suffix)
-                )
+        return get_container(client, area_code + postcode_database_suffix, area_code + district_container_suffix)
     except AzureMissingResourceHttpError as e:
         get_logger().fatal(f"Cosmos DB client is missing a required resource: {e}")
         raise e
@@ -77,10 +209,8 @@ def get_full_postcodes_container(client: CosmosClient, area_code: str) -> Contai
     @throws AzureMissingResourceHttpError: - If no container, or postcode database exists, this error is thrown.
     """
     try:
-        return (client
-                .get_database_client(area_code + postcode_database_suffix)
-                .get_container_client(area_code + full_postcode_container_suffix)
-                )
+        return get_container(client, area_code + postcode_database_suffix,
+                             area_code + full_postcode_container_suffix)
     except AzureMissingResourceHttpError as e:
         get_logger().fatal(f"Cosmos DB client is missing a required resource: {e}")
         raise e
\ No newline at end of file
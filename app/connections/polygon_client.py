@@ -0,0 +1,182 @@
+import asyncio
+from json import JSONDecodeError
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, ClientError, ClientResponseError
+from multidict import CIMultiDictProxy
+
+from app.cache.polygon_cache import PolygonCache, CachedPolygon
+from app.logging.log import get_logger
+from app.models.objects.flood_area_polygon import FloodAreaPolygon
+
+MAX_CONNECTIONS = 20
+MAX_CONCURRENT_REQUESTS = 20
+REQUEST_TIMEOUT_SECONDS = 30
+KEEPALIVE_TIMEOUT_SECONDS = 60
+MAX_RETRY_COUNT = 3
+FEED_MAX_RETRY_COUNT = 1
+RETRY_BACKOFF_SECONDS = 1
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class PolygonClient:
+    """
+    Asynchronous HTTP client which downloads flood area polygons from the Environmental Agency API.
+
+    A single keep-alive connection pool is shared by every request made through the client, and
+    the number of requests in flight at any one time is bounded. Each request has its own timeout,
+    and failed requests are retried with an exponentially increasing delay.
+
+    If a PolygonCache is given, fresh cached polygons are returned without a request being made,
+    and stale ones are revalidated with a conditional request. The flood feed is requested through the same
+    connection pool with get_feed, which never uses the polygon cache.
+
+    The client should be used as an async context manager, or opened and closed explicitly
+    when it needs to outlive a single flood update run.
+    """
+
+    def __init__(self,
+                 max_connections: int = MAX_CONNECTIONS,
+                 max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS,
+                 request_timeout: float = REQUEST_TIMEOUT_SECONDS,
+                 max_retry_count: int = MAX_RETRY_COUNT,
+                 retry_backoff: float = RETRY_BACKOFF_SECONDS,
+                 cache: PolygonCache | None = None):
+        self.max_connections = max_connections
+        self.max_concurrent_requests = max_concurrent_requests
+        self.request_timeout = request_timeout
+        self.max_retry_count = max_retry_count
+        self.retry_backoff = retry_backoff
+        self.cache = cache
+        self.session: ClientSession | None = None
+        self.semaphore: asyncio.Semaphore | None = None
+
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+    async def open(self) -> None:
+        """
+        Creates the underlying connection pool. Calling this on an already open client does nothing.
+        """
+        if self.session is not None and not self.session.closed:
+            return
+        connector: TCPConnector = TCPConnector(limit=self.max_connections,
+                                               keepalive_timeout=KEEPALIVE_TIMEOUT_SECONDS)
+        self.session = ClientSession(connector=connector,
+                                     timeout=ClientTimeout(total=self.request_timeout))
+        self.semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+
+
+    async def close(self) -> None:
+        """
+        Closes the underlying connection pool.
+        """
+        if self.session is not None:
+            await self.session.close()
+        self.session = None
+        self.semaphore = None
+
+
+    async def get_polygon(self, url: str) -> FloodAreaPolygon:
+        """
+        Downloads and deserializes a single flood area polygon, using the cache if there is one.
+
+        @param url: the URL of the flood area polygon
+        @return: the flood area polygon as a FloodAreaPolygon object
+        @throws ClientError: if the polygon could not be downloaded after every retry attempt
+        @throws JSONDecodeError: if the downloaded polygon is not valid geojson
+        """
+        if self.cache is None:
+            status, body, headers = await self.get(url)
+            return self.deserialize(url, body)
+        cached_polygon: CachedPolygon | None = self.cache.get(url)
+        if cached_polygon is not None and cached_polygon.is_fresh(self.cache.max_age):
+            self.cache.stats.fresh_hits += 1
+            self.cache.stats.bytes_saved += len(cached_polygon.body)
+            return self.cache.get_parsed_polygon(url, cached_polygon)
+        request_headers = cached_polygon.conditional_headers() if cached_polygon is not None else None
+        status, body, headers = await self.get(url, request_headers)
+        if status == 304 and cached_polygon is not None:
+            self.cache.stats.revalidations += 1
+            self.cache.stats.bytes_saved += len(cached_polygon.body)
+            self.cache.refresh(url, cached_polygon)
+            return self.cache.get_parsed_polygon(url, cached_polygon)
+        self.cache.stats.misses += 1
+        polygon: FloodAreaPolygon = self.deserialize(url, body)
+        self.cache.put(url, body.decode("utf-8"), headers.get("ETag"), headers.get("Last-Modified"), polygon)
+        return polygon
+
+
+    @staticmethod
+    def deserialize(url: str, body: bytes) -> FloodAreaPolygon:
+        try:
+            return FloodAreaPolygon.from_body(body)
+        except JSONDecodeError as e:
+            get_logger().error(f"Could not deserialize flood area polygon from {url}: {e}")
+            raise e
+
+
+    async def get_polygons(self, urls: list[str]) -> list[FloodAreaPolygon]:
+        """
+        Concurrently downloads and deserializes several flood area polygons.
+
+        @param urls: a list of flood area polygon URLs
+        @return: a list of FloodAreaPolygon objects, in the same order as the given URLs
+        """
+        return await asyncio.gather(*[self.get_polygon(url) for url in urls])
+
+
+    async def get_feed(self, url: str, headers: dict[str, str] | None = None) \
+            -> tuple[int, bytes, CIMultiDictProxy[str]]:
+        """
+        Requests the live flood feed. The feed is never served from, or stored in, the polygon cache, and a
+        failed request is retried fewer times than a polygon download, since a failed poll is simply
+        retried at the next poll.
+
+        @param url: the URL of the flood feed
+        @param headers: the conditional request headers of the feed's last acknowledged version
+        @return: a tuple of the response status, body and headers
+        @throws ClientError: if the feed could not be requested after every retry attempt
+        """
+        return await self.get(url, headers, FEED_MAX_RETRY_COUNT)
+
+
+    async def get(self, url: str, headers: dict[str, str] | None = None, max_retry_count: int | None = None) \
+            -> tuple[int, bytes, CIMultiDictProxy[str]]:
+        """
+        Performs a GET request through the shared connection pool, retrying on connection errors,
+        timeouts and retryable status codes.
+
+        @param url: the URL to request
+        @param headers: any additional request headers, such as conditional request headers
+        @param max_retry_count: the number of times to retry the request. If left blank, the client's own
+        max_retry_count is used.
+        @return: a tuple of the response status, body and headers
+        @throws ClientError: if the request did not succeed after every retry attempt
+        """
+        if self.session is None:
+            raise RuntimeError("PolygonClient must be opened before any requests are made.")
+        max_retry_count = max_retry_count if max_retry_count is not None else self.max_retry_count
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                async with self.semaphore:
+                    async with self.session.get(url, headers=headers) as response:
+                        response.raise_for_status()
+                        return response.status, await response.read(), response.headers
+            except (ClientError, asyncio.TimeoutError) as e:
+                retryable = not isinstance(e, ClientResponseError) or e.status in RETRYABLE_STATUS_CODES
+                if not retryable or attempts > max_retry_count:
+                    get_logger().error(f"Failed to get {url} after {attempts} attempt(s): {e!r}")
+                    raise e
+                sleep_for = self.retry_backoff * 2 ** (attempts - 1)
+                get_logger().warning(f"Request to {url} failed: retrying in {sleep_for}s "
+                                     f"(attempt #{attempts} of {max_retry_count}): {e!r}")
+                await asyncio.sleep(sleep_for)
@@ -5,7 +5,17 @@ from azure.cosmos.exceptions import CosmosHttpResponseError
 from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
 
 from app.connections import cosmosdb_client
-from app.cosmos.cosmos_queries import match_areas_to_geometry_query, match_districts_to_geometry_query
+from app.cosmos.cosmos_queries import (match_areas_to_geometry_query,
+                                      match_districts_to_geometry_query,
+                                      match_full_postcodes_to_geometry_query,
+                                      match_area_codes_to_geometries_query,
+                                      match_district_names_to_geometries_query,
+                                      match_postcodes_to_geometries_query,
+                                      get_area_geometries_query,
+                                      get_district_geometries_query,
+                                      get_any_district_query,
+                                      get_postcode_geometries_query,
+                                      get_postcode_geometries_by_postcode_query)
 
 
 def async_get_shard_keys(client: AsyncCosmosClient) -> AsyncItemPaged[dict[str, Any]]:
@@ -20,6 +30,117 @@ def async_get_shard_keys(client: AsyncCosmosClient) -> AsyncItemPaged[dict[str,
         raise e
 
 
+def async_get_area_geometries(client: AsyncCosmosClient,
+                               database_name: str,
+                               partition_key: str) -> AsyncItemPaged[dict[str, Any]]:
+    """
+    Asynchronously obtains the geometry of every postcode area in a shard
+
+    @param client: Cosmos DB client
+    @param database_name: Database name
+    @param partition_key: Partition key to search on
+    @return AsyncItemPaged: object which contains the area code and geometry of every area in the shard.
+    @throws CosmosHttpResponseError: If an error occurred while attempting to execute the query.
+    """
+    area_container = cosmosdb_client.get_postcodes_area_container(client, database_name)
+    try:
+        areas: AsyncItemPaged[dict[str, Any]] = area_container.query_items(query=get_area_geometries_query(),
+                                                                           partition_key=partition_key)
+        return areas
+    except CosmosHttpResponseError as e:
+        raise e
+
+
+def async_get_district_geometries(client: AsyncCosmosClient,
+                                  area_code: str,
+                                  max_item_count: int | None = None) -> AsyncItemPaged[dict[str, Any]]:
+    """
+    Asynchronously obtains the geometry of every postcode district in an area
+
+    @param client: Cosmos DB client
+    @param area_code: Area code - used as a reference to obtain the correct district container
+    @param max_item_count: The number of districts to read in each page. If left blank, Cosmos DB decides.
+    @return AsyncItemPaged: object which contains the name and geometry of every district in the area.
+    @throws CosmosHttpResponseError: If an error occurred while attempting to execute the query.
+    """
+    district_container = cosmosdb_client.get_postcodes_district_container(client, area_code)
+    try:
+        districts: AsyncItemPaged[dict[str, Any]] = \
+            district_container.query_items(query=get_district_geometries_query(),
+                                           max_item_count=max_item_count)
+        return districts
+    except CosmosHttpResponseError as e:
+        raise e
+
+
+def async_get_any_district(client: AsyncCosmosClient,
+                           area_code: str,
+                           partition_key: str) -> AsyncItemPaged[dict[str, Any]]:
+    """
+    Asynchronously obtains the name of at most one district from a partition of an area's district container
+
+    @param client: Cosmos DB client
+    @param area_code: Area code - used as a reference to obtain the correct district container
+    @param partition_key: Partition key to search on
+    @return AsyncItemPaged: object which contains the name of a district in the partition, if it holds any.
+    @throws CosmosHttpResponseError: If an error occurred while attempting to execute the query.
+    """
+    district_container = cosmosdb_client.get_postcodes_district_container(client, area_code)
+    try:
+        districts: AsyncItemPaged[dict[str, Any]] = district_container.query_items(query=get_any_district_query(),
+                                                                                   partition_key=partition_key)
+        return districts
+    except CosmosHttpResponseError as e:
+        raise e
+
+
+def async_get_postcode_geometries(client: AsyncCosmosClient,
+                                  area_code: str,
+                                  max_item_count: int | None = None) -> AsyncItemPaged[dict[str, Any]]:
+    """
+    Asynchronously obtains the geometry of every full postcode in an area
+
+    @param client: Cosmos DB client
+    @param area_code: Area code - used as a reference to obtain the correct full postcode container
+    @param max_item_count: The number of postcodes to read in each page. If left blank, Cosmos DB decides.
+    @return AsyncItemPaged: object which contains the postcode and geometry of every postcode in the area.
+    @throws CosmosHttpResponseError: If an error occurred while attempting to execute the query.
+    """
+    postcode_container = cosmosdb_client.get_full_postcodes_container(client, area_code)
+    try:
+        postcodes: AsyncItemPaged[dict[str, Any]] = \
+            postcode_container.query_items(query=get_postcode_geometries_query(),
+                                           max_item_count=max_item_count)
+        return postcodes
+    except CosmosHttpResponseError as e:
+        raise e
+
+
+def async_get_postcode_geometries_by_postcode(client: AsyncCosmosClient,
+                                             area_code: str,
+                                             partition_key: str,
+                                             postcodes: list[str]) -> AsyncItemPaged[dict[str, Any]]:
+    """
+    Asynchronously obtains the geometry of each of a list of full postcodes
+
+    @param client: Cosmos DB client
+    @param area_code: Area code - used as a reference to obtain the correct full postcode container
+    @param partition_key: Partition key to search on
+    @param postcodes: the postcodes to obtain the geometries of
+    @return AsyncItemPaged: object which contains the postcode and geometry of every postcode found.
+    @throws CosmosHttpResponseError: If an error occurred while attempting to execute the query.
+    """
+    postcode_container = cosmosdb_client.get_full_postcodes_container(client, area_code)
+    try:
+        postcode_geometries: AsyncItemPaged[dict[str, Any]] = \
+            postcode_container.query_items(query=get_postcode_geometries_by_postcode_query(),
+                                           parameters=[dict(name="@postcodes", value=postcodes)],
+                                           partition_key=partition_key)
+        return postcode_geometries
+    except CosmosHttpResponseError as e:
+        raise e
+
+
 def async_match_area_to_flood_geometry(client: AsyncCosmosClient,
                                        database_name: str,
                                        partition_key: str,
@@ -27,11 +148,15 @@ def async_match_area_to_flood_geometry(client: AsyncCosmosClient,
     """
     Asynchronously obtains every intersection with a postcode area and a given flood geometry
 
+    Legacy: postcode matching uses async_match_area_codes_to_flood_geometries, which returns only area codes.
+    This is kept for callers which need the areas' boundaries.
+
     @param client: Cosmos DB client
     @param database_name: Database name
     @param partition_key: Partition key to search on
     @param parameters: Parameters which contain the flood geometry details. These will be passed to the query.
-    @return AsyncItemPaged: object which contains a dictionary of all intersecting areas and their associated geojson.
+    @return AsyncItemPaged: object which contains a dictionary of all intersecting areas and their associated
+    geojson.
     @throws CosmosHttpResponseError: If an error occurred while attempting to execute the query.
     """
     area_container = cosmosdb_client.get_postcodes_area_container(client, database_name)
@@ -50,10 +175,14 @@ def async_match_districts_to_geometry(client: AsyncCosmosClient,
     """
     Asynchronously obtains every intersection with a postcode district and a given flood geometry
 
+    Legacy: postcode matching uses async_match_district_names_to_geometries, which returns only district names.
+    This is kept for callers which need the districts' boundaries.
+
     @param client: Cosmos DB client
     @param area_code: Area code - used as a reference to obtain the correct district container
     @param parameters: Parameters which contain the flood geometry. These will be passed to the query.
-    @return AsyncItemPaged: object which contains a dictionary of all intersecting districts and their associated geojson.
+    @return AsyncItemPaged: object which contains a dictionary of all intersecting districts and their associated
+    geojson.
     @throws CosmosHttpResponseError: If an error occurred while attempting to execute the query.
     """
     district_container = cosmosdb_client.get_postcodes_district_container(client, area_code)
@@ -73,17 +202,102 @@ def async_match_full_postcode_to_geometry(client: AsyncCosmosClient,
     """
     Asynchronously obtains every intersection with a postcode and a given flood geometry
 
+    Legacy: postcode matching uses async_match_postcodes_to_geometries, which returns only postcodes.
+    This is kept for callers which need the postcodes' boundaries.
+
     @param client: Cosmos DB client
     @param area_code: Area code - used as a reference to obtain the correct district container
     @param partition_key: Partition key to search on
     @param parameters: Parameters which contain the flood geometry. These will be passed to the query.
-    @return AsyncItemPaged: object which contains a dictionary of all intersecting postcodes and their associated geojson.
+    @return AsyncItemPaged: object which contains a dictionary of all intersecting postcodes and their associated
+    geojson.
+    @throws CosmosHttpResponseError: If an error occurred while attempting to execute the query.
+    """
+    postcode_container = cosmosdb_client.get_full_postcodes_container(client, area_code)
+    try:
+        postcodes: AsyncItemPaged[dict[str, Any]] = \
+            postcode_container.query_items(query=match_full_postcodes_to_geometry_query(),
+                                           parameters=parameters,
+                                           partition_key=partition_key)
+        return postcodes
+    except CosmosHttpResponseError as e:
+        raise e
+
+
+def async_match_area_codes_to_flood_geometries(client: AsyncCosmosClient,
+                                               database_name: str,
+                                               partition_key: str,
+                                               parameters: list[dict[str, Any]]) -> AsyncItemPaged[dict[str, Any]]:
+    """
+    Asynchronously obtains the area code of every postcode area which intersects with any of several flood geometries
+
+    @param client: Cosmos DB client
+    @param database_name: Database name
+    @param partition_key: Partition key to search on
+    @param parameters: Parameters which contain each flood geometry (see get_geometries_parameters).
+    These will be passed to the query.
+    @return AsyncItemPaged: object which contains the area code of every intersecting area, and which of the
+    flood geometries it intersects.
+    @throws CosmosHttpResponseError: If an error occurred while attempting to execute the query.
+    """
+    area_container = cosmosdb_client.get_postcodes_area_container(client, database_name)
+    try:
+        areas: AsyncItemPaged[dict[str, Any]] = \
+            area_container.query_items(query=match_area_codes_to_geometries_query(len(parameters)),
+                                       parameters=parameters,
+                                       partition_key=partition_key)
+        return areas
+    except CosmosHttpResponseError as e:
+        raise e
+
+
+def async_match_district_names_to_geometries(client: AsyncCosmosClient,
+                                             area_code: str,
+                                             parameters: list[dict[str, Any]],
+                                             partition_key: str | None = None) -> AsyncItemPaged[dict[str, Any]]:
+    """
+    Asynchronously obtains the name of every postcode district which intersects with any of several flood geometries
+
+    @param client: Cosmos DB client
+    @param area_code: Area code - used as a reference to obtain the correct district container
+    @param parameters: Parameters which contain each flood geometry (see get_geometries_parameters).
+    These will be passed to the query.
+    @param partition_key: Partition key to search on. If left blank, every partition is searched.
+    @return AsyncItemPaged: object which contains the name of every intersecting district, which of the flood
+    geometries it intersects, and which of them cover it entirely.
+    @throws CosmosHttpResponseError: If an error occurred while attempting to execute the query.
+    """
+    district_container = cosmosdb_client.get_postcodes_district_container(client, area_code)
+    try:
+        districts: AsyncItemPaged[dict[str, Any]] = \
+            district_container.query_items(query=match_district_names_to_geometries_query(len(parameters)),
+                                           parameters=parameters,
+                                           partition_key=partition_key)
+        return districts
+    except CosmosHttpResponseError as e:
+        raise e
+
+
+def async_match_postcodes_to_geometries(client: AsyncCosmosClient,
+                                        area_code: str,
+                                        partition_key: str,
+                                        parameters: list[dict[str, Any]]) -> AsyncItemPaged[dict[str, Any]]:
+    """
+    Asynchronously obtains every postcode which intersects with any of several flood geometries
+
+    @param client: Cosmos DB client
+    @param area_code: Area code - used as a reference to obtain the correct full postcode container
+    @param partition_key: Partition key to search on
+    @param parameters: Parameters which contain each flood geometry (see get_geometries_parameters).
+    These will be passed to the query.
+    @return AsyncItemPaged: object which contains every intersecting postcode, and which of the flood geometries
+    it intersects.
     @throws CosmosHttpResponseError: If an error occurred while attempting to execute the query.
     """
     postcode_container = cosmosdb_client.get_full_postcodes_container(client, area_code)
     try:
         postcodes: AsyncItemPaged[dict[str, Any]] = \
-            postcode_container.query_items(query=match_districts_to_geometry_query(),
+            postcode_container.query_items(query=match_postcodes_to_geometries_query(len(parameters)),
                                            parameters=parameters,
                                            partition_key=partition_key)
         return postcodes
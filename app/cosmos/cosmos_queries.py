@@ -7,6 +7,32 @@ def match_areas_to_geometry_query():
                 where intersects = true"""
 
 
+def get_area_geometries_query():
+    return """select c.areaCode, c.features[0].geometry as geometry
+    from c"""
+
+
+def get_district_geometries_query():
+    return """select c.district, c.features[0].geometry as geometry
+    from c"""
+
+
+def get_any_district_query():
+    return """select top 1 c.district
+    from c"""
+
+
+def get_postcode_geometries_query():
+    return """select c.features[0].properties.mapit_code as postcode, c.features[0].geometry as geometry
+    from c"""
+
+
+def get_postcode_geometries_by_postcode_query():
+    return """select c.features[0].properties.mapit_code as postcode, c.features[0].geometry as geometry
+    from c
+    where ARRAY_CONTAINS(@postcodes, c.features[0].properties.mapit_code)"""
+
+
 def get_all_documents():
     return """select c.id, c.district, c.features
     from c"""
@@ -16,4 +42,47 @@ def match_districts_to_geometry_query():
     return """select c.id, c.district, c.features
               from c
                        join (SELECT VALUE ST_INTERSECTS(@geometry, c.features[0].geometry)) intersects
-           where intersects = true"""
\ No newline at end of file
+           where intersects = true"""
+
+
+def match_full_postcodes_to_geometry_query():
+    return """select c.id, c.district, c.features
+              from c
+                       join (SELECT VALUE ST_INTERSECTS(c.features[0].geometry, @geometry)) intersects
+           where intersects = true"""
+
+
+def get_geometries_parameters(geometries: list[dict]) -> list[dict]:
+    """
+    @return: the parameters which pass each geometry to a multi-geometry query, as @geometry0, @geometry1 and so on
+    """
+    return [dict(name=f"@geometry{index}", value=geometry) for index, geometry in enumerate(geometries)]
+
+
+def each_geometry(spatial_function: str, geometry_count: int) -> str:
+    """
+    @return: an array of the result of a spatial function between the document's geometry and each geometry
+    """
+    return "[" + ", ".join(f"{spatial_function}(c.features[0].geometry, @geometry{index})"
+                           for index in range(geometry_count)) + "]"
+
+
+def match_area_codes_to_geometries_query(geometry_count: int = 1):
+    return f"""select c.areaCode, intersects as geometries
+                from c
+                join (SELECT VALUE {each_geometry("ST_INTERSECTS", geometry_count)}) intersects
+                where ARRAY_CONTAINS(intersects, true)"""
+
+
+def match_district_names_to_geometries_query(geometry_count: int = 1):
+    return f"""select c.district, intersects as geometries, {each_geometry("ST_WITHIN", geometry_count)} as covered
+              from c
+                       join (SELECT VALUE {each_geometry("ST_INTERSECTS", geometry_count)}) intersects
+           where ARRAY_CONTAINS(intersects, true)"""
+
+
+def match_postcodes_to_geometries_query(geometry_count: int = 1):
+    return f"""select c.features[0].properties.mapit_code as postcode, intersects as geometries
+              from c
+                       join (SELECT VALUE {each_geometry("ST_INTERSECTS", geometry_count)}) intersects
+           where ARRAY_CONTAINS(intersects, true)"""
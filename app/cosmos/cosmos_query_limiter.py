@@ -0,0 +1,57 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from app.env_vars import cosmos_max_concurrent_queries, cosmos_max_concurrent_queries_per_level
+
+AREA_QUERIES = "areas"
+DISTRICT_QUERIES = "districts"
+POSTCODE_QUERIES = "postcodes"
+QUERY_LEVELS = (AREA_QUERIES, DISTRICT_QUERIES, POSTCODE_QUERIES)
+MAX_CONCURRENT_QUERIES: int = int(cosmos_max_concurrent_queries) if cosmos_max_concurrent_queries else 64
+MAX_CONCURRENT_QUERIES_PER_LEVEL: int = \
+    int(cosmos_max_concurrent_queries_per_level) if cosmos_max_concurrent_queries_per_level else 32
+
+
+class CosmosQueryLimiter:
+    """
+    Bounds how many Cosmos DB queries are in flight at once, both overall and at each level of the
+    area, district and full postcode cascade.
+
+    A query only holds its permits while it runs and its results are read. Queries which follow on from its
+    results are started afterwards, so a query never waits on a permit while holding another.
+    """
+
+    def __init__(self, max_concurrent_queries: int = MAX_CONCURRENT_QUERIES,
+                 max_concurrent_queries_per_level: int | dict[str, int] = MAX_CONCURRENT_QUERIES_PER_LEVEL):
+        if isinstance(max_concurrent_queries_per_level, int):
+            max_concurrent_queries_per_level = {level: max_concurrent_queries_per_level for level in QUERY_LEVELS}
+        self.overall = asyncio.Semaphore(max_concurrent_queries)
+        self.levels: dict[str, asyncio.Semaphore] = {level: asyncio.Semaphore(max_concurrent_queries_per_level[level])
+                                                     for level in QUERY_LEVELS}
+
+
+    @asynccontextmanager
+    async def acquire(self, level: str) -> AsyncIterator[None]:
+        """
+        Waits until a query at the given level may run.
+
+        @param level: AREA_QUERIES, DISTRICT_QUERIES or POSTCODE_QUERIES
+        """
+        async with self.levels[level]:
+            async with self.overall:
+                yield
+
+
+__query_limiters: dict[asyncio.AbstractEventLoop, CosmosQueryLimiter] = {}
+
+
+def get_cosmos_query_limiter() -> CosmosQueryLimiter:
+    """
+    Returns the query limiter shared by every match running on the current event loop.
+    """
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    if loop not in __query_limiters:
+        __query_limiters.clear()
+        __query_limiters[loop] = CosmosQueryLimiter()
+    return __query_limiters[loop]
@@ -18,6 +18,17 @@ try:
     rabbitmq_port = getenv("RABBITMQ_PORT")
     rabbitmq_user = getenv("RABBITMQ_USER")
     rabbitmq_password = getenv("RABBITMQ_PASSWORD")
+    polygon_cache_directory = getenv("POLYGON_CACHE_DIRECTORY")
+    subdivision_mode = getenv("SUBDIVISION_MODE")
+    geometry_coordinate_precision = getenv("GEOMETRY_COORDINATE_PRECISION")
+    geometry_simplification_tolerance = getenv("GEOMETRY_SIMPLIFICATION_TOLERANCE")
+    subdivision_cache_directory = getenv("SUBDIVISION_CACHE_DIRECTORY")
+    subdivision_workers = getenv("SUBDIVISION_WORKERS")
+    cosmos_max_concurrent_queries = getenv("COSMOS_MAX_CONCURRENT_QUERIES")
+    cosmos_max_concurrent_queries_per_level = getenv("COSMOS_MAX_CONCURRENT_QUERIES_PER_LEVEL")
+    postcode_matching_backend = getenv("POSTCODE_MATCHING_BACKEND")
+    postcode_boundary_snapshot = getenv("POSTCODE_BOUNDARY_SNAPSHOT")
+    flood_area_postcode_directory = getenv("FLOOD_AREA_POSTCODE_DIRECTORY")
     LOG_FILE_LOCATION = getenv("LOG_FILE_LOCATION")
     BUILD = getenv("BUILD")
 except KeyError:
@@ -36,5 +47,16 @@ except KeyError:
     rabbitmq_port = "RABBITMQ_PORT"
     rabbitmq_user = "RABBITMQ_USER"
     rabbitmq_password = "RABBITMQ_PASSWORD"
+    polygon_cache_directory = None
+    subdivision_mode = None
+    geometry_coordinate_precision = None
+    geometry_simplification_tolerance = None
+    subdivision_cache_directory = None
+    subdivision_workers = None
+    cosmos_max_concurrent_queries = None
+    cosmos_max_concurrent_queries_per_level = None
+    postcode_matching_backend = None
+    postcode_boundary_snapshot = None
+    flood_area_postcode_directory = None
     LOG_FILE_LOCATION = "LOG_FILE_LOCATION"
     BUILD = "BUILD"
\ No newline at end of file
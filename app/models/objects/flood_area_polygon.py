@@ -0,0 +1,103 @@
+import hashlib
+import json
+
+from geojson import FeatureCollection
+
+JSON_WHITESPACE = " \t\n\r"
+
+
+class FloodAreaPolygon:
+    """
+    A flood area polygon downloaded from the Environmental Agency API.
+
+    Holds the FeatureCollection parsed from the response body, along with an upper bound on how long any of its
+    geometries will be once serialized compactly (as the Cosmos SDK does), and a digest of the body. Both are
+    measured from the response body itself, so a geometry never has to be re-encoded just to find out whether it
+    fits in a query, or whether it has changed.
+    """
+
+
+    def __init__(self, geojson: FeatureCollection, serialized_size: int, digest: str | None = None):
+        self.geojson = geojson
+        self.serialized_size = serialized_size
+        self.digest = digest
+
+
+    def get_geojson(self):
+        return self.geojson
+
+
+    def get_serialized_size(self):
+        return self.serialized_size
+
+
+    def get_digest(self):
+        return self.digest
+
+
+    def set_geojson(self, geojson: FeatureCollection):
+        self.geojson = geojson
+
+
+    def set_serialized_size(self, serialized_size: int):
+        self.serialized_size = serialized_size
+
+
+    def set_digest(self, digest: str):
+        self.digest = digest
+
+
+    def copy(self):
+        """
+        @return: a copy of the polygon whose geojson can be changed without changing this polygon's
+        """
+        feature_collection: FeatureCollection = FeatureCollection([])
+        feature_collection.update(copy_json(dict(self.geojson)))
+        return FloodAreaPolygon(feature_collection, self.serialized_size, self.digest)
+
+
+    @staticmethod
+    def from_body(body: bytes | str):
+        """
+        Parses a flood area polygon response body in a single pass.
+
+        The body is parsed with the standard library's json parser rather than geojson.loads, which walks
+        (and copies) every coordinate of every geometry in python to validate it.
+
+        @param body: the response body
+        @return: a FloodAreaPolygon object
+        @throws JSONDecodeError: if the body is not valid json
+        """
+        feature_collection: FeatureCollection = FeatureCollection([])
+        feature_collection.update(json.loads(body))
+        digest: str = hashlib.sha256(body.encode("utf-8") if isinstance(body, str) else body).hexdigest()
+        return FloodAreaPolygon(feature_collection, compact_json_size(body), digest)
+
+
+def copy_json(value):
+    """
+    Copies a parsed json document. Only its dicts and lists are copied, since everything else in it is immutable,
+    which makes this several times faster than copy.deepcopy.
+
+    @param value: a parsed json document
+    @return: a copy of the document
+    """
+    if isinstance(value, list):
+        return [copy_json(item) for item in value]
+    if isinstance(value, dict):
+        return {key: copy_json(item) for key, item in value.items()}
+    return value
+
+
+def compact_json_size(body: bytes | str) -> int:
+    """
+    Returns the length of a serialized json document once its insignificant whitespace is removed.
+    Whitespace inside strings is removed too, so this is an upper bound on the compact length of any
+    geometry within the document (which contains no strings with whitespace), not of the document itself.
+
+    @param body: a serialized json document
+    @return: the length of the document without whitespace
+    """
+    if isinstance(body, str):
+        return len(body) - sum(body.count(whitespace) for whitespace in JSON_WHITESPACE)
+    return len(body) - sum(body.count(whitespace.encode()) for whitespace in JSON_WHITESPACE)
@@ -0,0 +1,49 @@
+Bounds = tuple[float, float, float, float]
+
+
+class PostcodeShard:
+    """
+    A sharded postcode database from the shard map, along with the extent of the postcode areas it holds.
+
+    The extent is the bounding box of each of the shard's areas. A shard whose extent is unknown is assumed
+    to intersect every flood, so that it is never wrongly skipped.
+    """
+
+
+    def __init__(self, database_name: str, area_bounds: list[Bounds] | None = None):
+        self.database_name = database_name
+        self.partition_key = database_name.split("-")[0]
+        self.area_bounds = area_bounds
+
+
+    def get_database_name(self):
+        return self.database_name
+
+
+    def get_partition_key(self):
+        return self.partition_key
+
+
+    def get_area_bounds(self):
+        return self.area_bounds
+
+
+    def set_database_name(self, database_name: str):
+        self.database_name = database_name
+        self.partition_key = database_name.split("-")[0]
+
+
+    def set_area_bounds(self, area_bounds: list[Bounds] | None):
+        self.area_bounds = area_bounds
+
+
+    def intersects(self, bounds: Bounds) -> bool:
+        """
+        @param bounds: the bounding box of a flood geometry, as (min x, min y, max x, max y)
+        @return: False if none of the shard's areas can intersect the flood geometry
+        """
+        if self.area_bounds is None:
+            return True
+        x1, y1, x2, y2 = bounds
+        return any(area_x1 <= x2 and x1 <= area_x2 and area_y1 <= y2 and y1 <= area_y2
+                   for area_x1, area_y1, area_x2, area_y2 in self.area_bounds)
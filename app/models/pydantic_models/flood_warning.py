@@ -9,6 +9,10 @@ class FloodWarning(BaseModel, arbitrary_types_allowed=True):
     eaRegionName: str | None = None
     floodArea: FloodArea
     floodAreaGeoJson: FeatureCollection | None = None
+    # Upper bound on the compact serialized length of the flood area geometries, measured when they were downloaded
+    floodAreaGeoJsonSize: int | None = Field(default=None, exclude=True)
+    # Digest of the flood area polygon as it was downloaded
+    floodAreaGeoJsonDigest: str | None = Field(default=None, exclude=True)
     floodAreaID: str
     isTidal: bool | None = None
     message: str
@@ -0,0 +1,177 @@
+import asyncio
+import signal
+import time
+from typing import Awaitable, Callable
+
+from app.cache.polygon_cache import get_polygon_cache
+from app.connections.cosmosdb_client import get_cosmos_client_manager
+from app.connections.polygon_client import PolygonClient
+from app.logging.log import get_logger
+from app.models.objects.floods_with_postcodes import FloodWithPostcodes
+from app.services.flood_update_service import get_flood_updates, get_next_poll_interval
+from app.services.geometry_subdivision_service import shutdown_subdivision_executor
+
+
+class RunReport:
+    """
+    How long a single flood update run took, compared with the interval it was scheduled on.
+    A run which was not scheduled on an interval (the first run, or a triggered one) has an interval of 0,
+    and never overruns.
+    """
+
+    def __init__(self, started_at: float, duration: float, interval: int, flood_count: int | None):
+        self.started_at = started_at
+        self.duration = duration
+        self.interval = interval
+        self.flood_count = flood_count
+
+
+    @property
+    def interval_fraction(self) -> float:
+        return self.duration / self.interval if self.interval > 0 else 0.0
+
+
+    @property
+    def overran(self) -> bool:
+        return self.duration > self.interval if self.interval > 0 else False
+
+
+    def __repr__(self) -> str:
+        return (f"RunReport(duration={self.duration:.2f}s, interval={self.interval}s, "
+                f"interval_fraction={self.interval_fraction:.1%}, flood_count={self.flood_count})")
+
+
+class FloodUpdateScheduler:
+    """
+    Runs the flood update job on a single long-lived event loop.
+
+    Clients which are expensive to set up are opened once and kept warm between runs. Runs never
+    overlap, and the interval between them is decided by the flood feed poller. A run can be
+    triggered early with trigger(), or by sending the process SIGUSR1. SIGINT/SIGTERM stop the scheduler
+    once any run in progress has finished, and a second SIGINT/SIGTERM cancels that run.
+    """
+
+    def __init__(self,
+                 job: Callable[..., Awaitable[list[FloodWithPostcodes] | None]] = get_flood_updates,
+                 next_interval: Callable[[], int] = get_next_poll_interval,
+                 polygon_client: PolygonClient | None = None):
+        self.job = job
+        self.next_interval = next_interval
+        self.polygon_client = polygon_client or PolygonClient(cache=get_polygon_cache())
+        self.run_lock = asyncio.Lock()
+        self.trigger_event = asyncio.Event()
+        self.stop_event = asyncio.Event()
+        self.current_interval: int = 0
+        self.reports: list[RunReport] = []
+        self.main_task: asyncio.Task | None = None
+
+
+    def trigger(self) -> None:
+        """
+        Starts a run as soon as the current one (if any) has finished, instead of waiting for the interval.
+        """
+        get_logger().info("Flood update run triggered manually")
+        self.trigger_event.set()
+
+
+    def stop(self) -> None:
+        """
+        Stops the scheduler once the current run (if any) has finished.
+        Calling stop a second time cancels the current run.
+        """
+        if self.stop_event.is_set():
+            get_logger().warning("Cancelling the current flood update run")
+            if self.main_task is not None:
+                self.main_task.cancel()
+            return
+        if self.run_lock.locked():
+            get_logger().info("Stopping once the current flood update run has finished")
+        self.stop_event.set()
+
+
+    async def run_once(self) -> RunReport | None:
+        """
+        Runs the flood update job once, unless a run is already in progress.
+
+        @return: a RunReport for the run, or None if it was skipped
+        """
+        if self.run_lock.locked():
+            get_logger().warning("Skipped a flood update run because the previous run is still in progress")
+            return None
+        async with self.run_lock:
+            started_at: float = time.time()
+            start: float = time.perf_counter()
+            results = await self.job(polygon_client=self.polygon_client)
+            duration: float = time.perf_counter() - start
+        report = RunReport(started_at, duration, self.current_interval,
+                           len(results) if results is not None else None)
+        self.reports.append(report)
+        if report.overran:
+            get_logger().warning(f"Flood update run took longer than its interval: {report}")
+        else:
+            get_logger().info(f"Flood update run finished: {report}")
+        return report
+
+
+    async def wait_for_next_run(self, interval: int) -> bool:
+        """
+        Waits until the interval has passed, a run has been triggered, or the scheduler has been stopped.
+
+        @return: True if a run was triggered before the interval had passed
+        """
+        waiters = [asyncio.create_task(self.trigger_event.wait()), asyncio.create_task(self.stop_event.wait())]
+        try:
+            await asyncio.wait(waiters, timeout=interval, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        triggered: bool = self.trigger_event.is_set()
+        self.trigger_event.clear()
+        return triggered
+
+
+    def add_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGINT, self.stop)
+            loop.add_signal_handler(signal.SIGTERM, self.stop)
+            loop.add_signal_handler(signal.SIGUSR1, self.trigger)
+        except (NotImplementedError, AttributeError):
+            # Signal handlers are not supported by the event loop on Windows
+            pass
+
+
+    def remove_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            for signal_number in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1):
+                loop.remove_signal_handler(signal_number)
+        except (NotImplementedError, AttributeError):
+            pass
+
+
+    async def run(self) -> None:
+        """
+        Runs the flood update job until the scheduler is stopped, then closes every client it opened.
+        """
+        self.main_task = asyncio.current_task()
+        self.add_signal_handlers()
+        await self.polygon_client.open()
+        try:
+            while not self.stop_event.is_set():
+                await self.run_once()
+                if self.stop_event.is_set():
+                    break
+                self.current_interval = self.next_interval()
+                get_logger().info(f"Next flood update in {self.current_interval}s")
+                if await self.wait_for_next_run(self.current_interval):
+                    # a triggered run was not scheduled on the interval, so it is not measured against it
+                    self.current_interval = 0
+        except asyncio.CancelledError:
+            get_logger().warning("Flood update scheduler was cancelled")
+        finally:
+            await self.polygon_client.close()
+            await get_cosmos_client_manager().close()
+            shutdown_subdivision_executor()
+            self.remove_signal_handlers()
+            get_logger().info("Flood update scheduler stopped")
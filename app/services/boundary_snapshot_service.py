@@ -0,0 +1,310 @@
+"""
+The compact postcode boundary snapshot, and the exporter which writes it from the sharded postcode databases.
+
+A snapshot file holds three levels (areas, districts and postcodes). Each level is stored as columns:
+- the identifiers, UTF-8 encoded back to back, with an array of their offsets;
+- the bounding boxes, as an (n, 4) float64 array;
+- the geometries, as WKB back to back, with an array of their offsets.
+
+The file starts with MAGIC and the length of a JSON header. The header is the offset index: for every level, its
+count and the offset and length of each of its columns. Every column starts on an 8 byte boundary, so the
+arrays can be read in place from a memory map. Opening a snapshot maps it read-only. Nothing is decoded until it
+is asked for, so startup is near-instant, and every process which opens the same file shares its pages.
+
+Export a snapshot from the repository root with:
+python -m app.services.boundary_snapshot_service <path>
+"""
+import argparse
+import asyncio
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+from typing import Any, BinaryIO
+
+import numpy as np
+from shapely import Geometry, to_wkb, from_wkb, bounds as get_bounds
+from shapely.geometry import shape
+from azure.cosmos.aio import CosmosClient
+
+from app.connections.cosmosdb_client import get_cosmos_client_manager
+from app.cosmos.cosmos_functions import (async_get_shard_keys,
+                                         async_get_area_geometries,
+                                         async_get_district_geometries,
+                                         async_get_postcode_geometries)
+from app.logging.log import get_logger
+from app.models.objects.postcode_shard import PostcodeShard
+
+MAGIC = b"PCBOUND1"
+HEADER_LENGTH_FORMAT = "<Q"
+ALIGNMENT = 8
+LEVELS = ("areas", "districts", "postcodes")
+LEVEL_KEYS = {"areas": "areaCode", "districts": "district", "postcodes": "postcode"}
+EXPORT_PAGE_SIZE = 1000
+
+
+def is_boundary_snapshot_file(path: str) -> bool:
+    """
+    @param path: the path of a snapshot
+    @return: True if the file is a compact boundary snapshot rather than a JSON one
+    """
+    with open(path, "rb") as snapshot_file:
+        return snapshot_file.read(len(MAGIC)) == MAGIC
+
+
+class BoundarySnapshotLevelWriter:
+    """
+    Collects one level of a snapshot as it is exported. The identifiers and geometries are spilled to temporary
+    files as they arrive, so that only the offsets and bounding boxes are held in memory.
+    """
+
+    def __init__(self, directory: str):
+        self.codes: BinaryIO = tempfile.TemporaryFile(dir=directory)
+        self.wkb: BinaryIO = tempfile.TemporaryFile(dir=directory)
+        self.code_offsets: array = array("Q", [0])
+        self.wkb_offsets: array = array("Q", [0])
+        self.bounds: array = array("d")
+
+
+    def __len__(self) -> int:
+        return len(self.code_offsets) - 1
+
+
+    def add(self, code: str, geom: Geometry) -> None:
+        encoded_code: bytes = code.encode("utf-8")
+        wkb: bytes = to_wkb(geom)
+        self.codes.write(encoded_code)
+        self.wkb.write(wkb)
+        self.code_offsets.append(self.code_offsets[-1] + len(encoded_code))
+        self.wkb_offsets.append(self.wkb_offsets[-1] + len(wkb))
+        self.bounds.extend(get_bounds(geom).tolist())
+
+
+    def get_columns(self) -> dict[str, tuple[int, Any]]:
+        """
+        @return: the length and contents (bytes-like, or a temporary file) of each of the level's columns
+        """
+        return {"code_offsets": (len(self.code_offsets) * 8, self.code_offsets),
+                "codes": (self.code_offsets[-1], self.codes),
+                "bounds": (len(self.bounds) * 8, self.bounds),
+                "wkb_offsets": (len(self.wkb_offsets) * 8, self.wkb_offsets),
+                "wkb": (self.wkb_offsets[-1], self.wkb)}
+
+
+    def close(self) -> None:
+        self.codes.close()
+        self.wkb.close()
+
+
+def align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+class BoundarySnapshotWriter:
+    """
+    Writes a snapshot file from the boundaries added to each of its levels.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.directory: str = os.path.dirname(os.path.abspath(path))
+        self.levels: dict[str, BoundarySnapshotLevelWriter] = {level: BoundarySnapshotLevelWriter(self.directory)
+                                                               for level in LEVELS}
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.write()
+        finally:
+            for level in self.levels.values():
+                level.close()
+
+
+    def add(self, level: str, code: str, geometry: dict | Geometry) -> None:
+        """
+        @param level: "areas", "districts" or "postcodes"
+        @param code: the area code, district or postcode
+        @param geometry: the geojson (or shapely) geometry of the boundary
+        """
+        self.levels[level].add(code, geometry if isinstance(geometry, Geometry) else shape(geometry))
+
+
+    def get_header(self, header_length: int) -> dict[str, Any]:
+        offset: int = align(len(MAGIC) + struct.calcsize(HEADER_LENGTH_FORMAT) + header_length)
+        header: dict[str, Any] = {"levels": {}}
+        for level, level_writer in self.levels.items():
+            header["levels"][level] = {"count": len(level_writer)}
+            for column, (length, _) in level_writer.get_columns().items():
+                header["levels"][level][column] = [offset, length]
+                offset = align(offset + length)
+        return header
+
+
+    def write(self) -> None:
+        """
+        Writes the snapshot to a temporary file beside its path, and moves it into place once it is complete,
+        so that a process never maps a half-written snapshot.
+        """
+        header_length: int = 0
+        while True:
+            encoded_header: bytes = json.dumps(self.get_header(header_length)).encode("utf-8")
+            if len(encoded_header) == header_length:
+                break
+            header_length = len(encoded_header)
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(descriptor, "wb") as snapshot_file:
+                snapshot_file.write(MAGIC)
+                snapshot_file.write(struct.pack(HEADER_LENGTH_FORMAT, header_length))
+                snapshot_file.write(encoded_header)
+                for level_writer in self.levels.values():
+                    for length, contents in level_writer.get_columns().values():
+                        snapshot_file.write(b"\0" * (align(snapshot_file.tell()) - snapshot_file.tell()))
+                        if isinstance(contents, array):
+                            snapshot_file.write(contents.tobytes())
+                        else:
+                            contents.seek(0)
+                            shutil.copyfileobj(contents, snapshot_file)
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+
+def write_boundary_snapshot(path: str, snapshot: dict[str, list[dict[str, Any]]]) -> None:
+    """
+    Writes a snapshot file from a JSON snapshot (see PostcodeBoundaryIndex.from_snapshot).
+
+    @param path: the path to write the snapshot to
+    @param snapshot: a dictionary of the "areas", "districts" and "postcodes" in the snapshot
+    """
+    with BoundarySnapshotWriter(path) as writer:
+        for level in LEVELS:
+            for document in snapshot[level]:
+                writer.add(level, document[LEVEL_KEYS[level]], document["geometry"])
+
+
+class BoundarySnapshotLevel:
+    """
+    One level of a memory-mapped snapshot. Its columns are numpy arrays over the memory map, so reading them
+    copies nothing until an identifier or geometry is decoded.
+    """
+
+    def __init__(self, buffer: mmap.mmap, level_header: dict[str, Any]):
+        self.buffer = buffer
+        self.count: int = level_header["count"]
+
+        def column(name: str, dtype: str) -> np.ndarray:
+            offset, length = level_header[name]
+            return np.frombuffer(buffer, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+        self.codes_offset: int = level_header["codes"][0]
+        self.wkb_offset: int = level_header["wkb"][0]
+        self.code_offsets: np.ndarray = column("code_offsets", "<u8")
+        self.wkb_offsets: np.ndarray = column("wkb_offsets", "<u8")
+        self.bounds: np.ndarray = column("bounds", "<f8").reshape(self.count, 4)
+
+
+    def __len__(self) -> int:
+        return self.count
+
+
+    def get_code(self, index: int) -> str:
+        start, end = self.code_offsets[index:index + 2].tolist()
+        return self.buffer[self.codes_offset + start:self.codes_offset + end].decode("utf-8")
+
+
+    def get_codes(self, indexes: list[int] | None = None) -> list[str]:
+        return [self.get_code(index) for index in (range(self.count) if indexes is None else indexes)]
+
+
+    def get_geoms(self, indexes: np.ndarray | list[int]) -> np.ndarray:
+        """
+        @param indexes: the indexes of the boundaries to decode
+        @return: the shapely geometries of the boundaries
+        """
+        indexes = np.asarray(indexes, dtype=np.int64)
+        starts: list[int] = self.wkb_offsets[indexes].tolist()
+        ends: list[int] = self.wkb_offsets[indexes + 1].tolist()
+        return from_wkb(np.array([self.buffer[self.wkb_offset + start:self.wkb_offset + end]
+                                  for start, end in zip(starts, ends)], dtype=object))
+
+
+class BoundarySnapshot:
+    """
+    A snapshot file, mapped read-only into memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as snapshot_file:
+            self.buffer: mmap.mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            self.buffer.close()
+            raise ValueError(f"{path} is not a postcode boundary snapshot")
+        header_start: int = len(MAGIC) + struct.calcsize(HEADER_LENGTH_FORMAT)
+        (header_length,) = struct.unpack(HEADER_LENGTH_FORMAT, self.buffer[len(MAGIC):header_start])
+        header: dict[str, Any] = json.loads(self.buffer[header_start:header_start + header_length])
+        self.levels: dict[str, BoundarySnapshotLevel] = {level: BoundarySnapshotLevel(self.buffer, level_header)
+                                                         for level, level_header in header["levels"].items()}
+
+
+    def __repr__(self) -> str:
+        return (f"BoundarySnapshot({self.path}, "
+                + ", ".join(f"{level}={len(snapshot_level)}" for level, snapshot_level in self.levels.items()) + ")")
+
+
+async def export_shard(client: CosmosClient, shard: PostcodeShard, writer: BoundarySnapshotWriter) -> None:
+    """
+    Pages through a shard's area, district and full postcode containers, adding every boundary to the snapshot.
+    """
+    area_codes: list[str] = []
+    async for area in async_get_area_geometries(client, shard.get_database_name(), shard.get_partition_key()):
+        area_codes.append(area["areaCode"])
+        writer.add("areas", area["areaCode"], area["geometry"])
+    for area_code in area_codes:
+        async for district in async_get_district_geometries(client, area_code, max_item_count=EXPORT_PAGE_SIZE):
+            writer.add("districts", district["district"], district["geometry"])
+        async for postcode in async_get_postcode_geometries(client, area_code, max_item_count=EXPORT_PAGE_SIZE):
+            writer.add("postcodes", postcode["postcode"], postcode["geometry"])
+
+
+async def export_boundary_snapshot(path: str, client: CosmosClient | None = None) -> None:
+    """
+    Exports every area, district and postcode boundary in the sharded postcode databases to a snapshot file.
+    The shards are exported one after another, so the exporter's memory does not grow with the number of
+    boundaries.
+
+    @param path: the path to write the snapshot to
+    @param client: Cosmos DB client. If left blank, the shared client is used.
+    @throws CosmosHttpResponseError: if a container could not be read. No snapshot is written.
+    """
+    client = client if client is not None else await get_cosmos_client_manager().get_client()
+    shards: list[PostcodeShard] = [PostcodeShard(shard_key["databaseName"])
+                                   async for shard_key in async_get_shard_keys(client)]
+    with BoundarySnapshotWriter(path) as writer:
+        for shard in shards:
+            await export_shard(client, shard, writer)
+            get_logger().info(f"Exported shard {shard.get_database_name()}: "
+                              + ", ".join(f"{level}={len(level_writer)}"
+                                          for level, level_writer in writer.levels.items()))
+    get_logger().info(f"Wrote postcode boundary snapshot {path}")
+
+
+async def main(path: str) -> None:
+    async with get_cosmos_client_manager():
+        await export_boundary_snapshot(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the postcode boundaries to a snapshot file")
+    parser.add_argument("path")
+    asyncio.run(main(parser.parse_args().path))
@@ -0,0 +1,93 @@
+import hashlib
+import json
+
+from app.cache.flood_updates_cache import SEVERE_FLOOD_WARNNING, FLOOD_WARNING, FLOOD_ALERT
+from app.connections.polygon_client import PolygonClient
+from app.logging.log import get_logger
+from app.models.pydantic_models.latest_flood_update import LatestFloodUpdate
+
+# (shortest, longest) number of seconds between polls, by the most severe warning currently in force
+POLL_INTERVALS_BY_SEVERITY: dict[int, tuple[int, int]] = {
+    SEVERE_FLOOD_WARNNING: (300, 600),
+    FLOOD_WARNING: (600, 1200),
+    FLOOD_ALERT: (900, 1800)
+}
+QUIET_POLL_INTERVAL: tuple[int, int] = (1800, 3600)
+
+
+class FloodFeedPoller:
+    """
+    Polls the Environmental Agency flood feed with conditional requests, so that an unchanged feed
+    is neither downloaded nor validated again.
+
+    The feed's ETag/Last-Modified validators are sent with every poll when the API provides them.
+    A digest of the feed body is also kept, so an unchanged feed is still recognised if it does not.
+    Validators are only committed by acknowledge(), once the flood update they came from has been
+    processed, so a failed run is retried on the next poll.
+
+    The poller also works out when the feed should next be polled. It is polled more often while severe
+    warnings are in force, and backs off towards a longer interval while the feed stays unchanged.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.etag: str | None = None
+        self.last_modified: str | None = None
+        self.body_digest: str | None = None
+        self.pending_validators: tuple[str | None, str | None, str] | None = None
+        self.most_severe_level: int | None = None
+        self.unchanged_polls = 0
+
+
+    def conditional_headers(self) -> dict[str, str]:
+        headers: dict[str, str] = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+    async def poll(self, client: PolygonClient) -> LatestFloodUpdate | None:
+        """
+        Polls the flood feed.
+
+        @param client: an open client to request the feed through
+        @return: the latest flood update, or None if the feed has not changed since it was last acknowledged
+        @throws ClientError: if the feed could not be requested
+        @throws ValidationError: if the feed could not be validated
+        """
+        status, body, headers = await client.get_feed(self.url, self.conditional_headers())
+        if status == 304:
+            self.unchanged_polls += 1
+            get_logger().info(f"Flood feed not modified since the last poll ({self.unchanged_polls} in a row)")
+            return None
+        body_digest: str = hashlib.sha256(body).hexdigest()
+        if body_digest == self.body_digest:
+            self.unchanged_polls += 1
+            get_logger().info(f"Flood feed unchanged since the last poll ({self.unchanged_polls} in a row)")
+            return None
+        flood_update: LatestFloodUpdate = LatestFloodUpdate(**json.loads(body))
+        self.pending_validators = (headers.get("ETag"), headers.get("Last-Modified"), body_digest)
+        self.unchanged_polls = 0
+        in_force_levels = [flood.severityLevel for flood in flood_update.items
+                           if flood.severityLevel in POLL_INTERVALS_BY_SEVERITY]
+        self.most_severe_level = min(in_force_levels) if len(in_force_levels) > 0 else None
+        return flood_update
+
+
+    def acknowledge(self) -> None:
+        """
+        Commits the validators of the last polled flood update, once it has been processed.
+        """
+        if self.pending_validators is not None:
+            self.etag, self.last_modified, self.body_digest = self.pending_validators
+            self.pending_validators = None
+
+
+    def next_poll_interval(self) -> int:
+        """
+        @return: the number of seconds to wait before the feed is next polled
+        """
+        shortest, longest = POLL_INTERVALS_BY_SEVERITY.get(self.most_severe_level, QUIET_POLL_INTERVAL)
+        return min(shortest * 2 ** self.unchanged_polls, longest)
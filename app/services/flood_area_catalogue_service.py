@@ -0,0 +1,164 @@
+"""
+Builds the flood area postcode mapping for every flood area in the Environment Agency's catalogue, so that a
+flood's postcodes can be looked up rather than matched when it is raised.
+
+Only the flood areas whose polygon has changed since they were last matched (or which have never been matched)
+are matched again, so the job can be run as often as the catalogue is expected to change.
+
+Run the job from the repository root with:
+python -m app.services.flood_area_catalogue_service
+"""
+import asyncio
+import json
+from typing import Any
+
+from geojson import Polygon, MultiPolygon
+
+from app.cache.flood_area_postcode_cache import get_flood_area_postcode_cache, FloodAreaPostcodeCache
+from app.cache.polygon_cache import get_polygon_cache
+from app.cache.subdivision_cache import SubdivisionCache
+from app.connections.cosmosdb_client import get_cosmos_client_manager
+from app.connections.polygon_client import PolygonClient
+from app.logging.log import get_logger
+from app.models.objects.flood_area_polygon import FloodAreaPolygon
+from app.models.pydantic_models.flood_area import FloodArea
+from app.services.flood_update_service import get_flood_area_geometries, get_postcode_matcher, get_postcode_set
+from app.services.postcodes_in_flood_range_service import PostcodeMatchStats
+
+FLOOD_AREA_CATALOGUE_URL = "https://environment.data.gov.uk/flood-monitoring/id/floodAreas"
+CATALOGUE_PAGE_SIZE = 500
+BUILD_BATCH_SIZE = 50
+
+
+class FloodAreaBuildReport:
+    """
+    Counts of what a build of the flood area postcode mapping did with each flood area in the catalogue.
+    """
+
+    def __init__(self):
+        self.areas = 0
+        self.unchanged = 0
+        self.rebuilt = 0
+        self.failed = 0
+        self.postcodes = 0
+
+
+    def __repr__(self) -> str:
+        return (f"FloodAreaBuildReport(areas={self.areas}, unchanged={self.unchanged}, rebuilt={self.rebuilt}, "
+                f"failed={self.failed}, postcodes={self.postcodes})")
+
+
+async def get_flood_area_catalogue(client: PolygonClient,
+                                   page_size: int = CATALOGUE_PAGE_SIZE) -> list[FloodArea]:
+    """
+    Pages through the Environment Agency's catalogue of flood areas.
+
+    @param client: an open client to make the requests with
+    @param page_size: the number of flood areas to request in each page
+    @return: every flood area in the catalogue
+    @throws ClientError: if a page of the catalogue could not be requested
+    @throws ValidationError: if a flood area in the catalogue could not be validated
+    """
+    flood_areas: list[FloodArea] = []
+    while True:
+        status, body, headers = await client.get(f"{FLOOD_AREA_CATALOGUE_URL}?_limit={page_size}"
+                                                 f"&_offset={len(flood_areas)}")
+        items: list[dict[str, Any]] = json.loads(body).get("items", [])
+        flood_areas.extend(FloodArea(**item) for item in items)
+        if len(items) < page_size:
+            return flood_areas
+
+
+async def match_flood_area(flood_area_id: str,
+                           polygon: FloodAreaPolygon,
+                           flood_area_postcode_cache: FloodAreaPostcodeCache,
+                           stats: PostcodeMatchStats,
+                           subdivision_cache: SubdivisionCache | None = None) -> set[str]:
+    """
+    Matches a flood area's polygon to the postcodes it covers, and records them in the mapping.
+
+    @return: the postcodes the flood area covers
+    """
+    geometries: list[Polygon | MultiPolygon] = \
+        await get_flood_area_geometries(flood_area_id, polygon.get_geojson(), polygon.get_serialized_size(),
+                                        polygon.get_digest(), subdivision_cache)
+    postcodes_dict: dict[str, Any] = await get_postcode_matcher(every_postcode=True)(flood_area_id, geometries,
+                                                                                     stats)
+    postcode_set: set[str] = get_postcode_set(postcodes_dict)
+    flood_area_postcode_cache.put(flood_area_id, polygon.get_digest(), postcode_set)
+    return postcode_set
+
+
+async def build_flood_area_postcodes(flood_areas: list[FloodArea],
+                                     polygon_client: PolygonClient,
+                                     flood_area_postcode_cache: FloodAreaPostcodeCache | None = None,
+                                     subdivision_cache: SubdivisionCache | None = None,
+                                     batch_size: int = BUILD_BATCH_SIZE) -> FloodAreaBuildReport:
+    """
+    Resolves every flood area whose polygon has changed since it was last matched to the postcodes it covers.
+
+    The flood areas are downloaded and matched in batches, so that only one batch of polygons is held at once.
+    A flood area which cannot be downloaded or matched is logged and left as it was, to be retried by the
+    next build.
+
+    @param flood_areas: the flood areas in the catalogue
+    @param polygon_client: an open PolygonClient to download the flood area polygons with
+    @param flood_area_postcode_cache: the FloodAreaPostcodeCache to build. If left blank, the process-wide
+    mapping is built.
+    @param subdivision_cache: the SubdivisionCache to reuse subdivided geometries from. If left blank, nothing is
+    reused, so that building the mapping does not evict the geometries of the floods currently in force.
+    @param batch_size: the number of flood areas to download and match at once
+    @return: a report of how many flood areas were unchanged, rebuilt or failed
+    """
+    if flood_area_postcode_cache is None:
+        flood_area_postcode_cache = get_flood_area_postcode_cache()
+    report: FloodAreaBuildReport = FloodAreaBuildReport()
+    stats: PostcodeMatchStats = PostcodeMatchStats()
+    flood_areas = [flood_area for flood_area in flood_areas if flood_area.notation is not None]
+    report.areas = len(flood_areas)
+    for batch_start in range(0, len(flood_areas), batch_size):
+        batch: list[FloodArea] = flood_areas[batch_start:batch_start + batch_size]
+        polygons: list[FloodAreaPolygon | BaseException] = \
+            await asyncio.gather(*[polygon_client.get_polygon(flood_area.polygon) for flood_area in batch],
+                                 return_exceptions=True)
+        changed: list[tuple[FloodArea, FloodAreaPolygon]] = []
+        for flood_area, polygon in zip(batch, polygons):
+            if isinstance(polygon, BaseException):
+                report.failed += 1
+                get_logger().error(f"Could not download the polygon of flood area {flood_area.notation}: "
+                                   f"{polygon!r}")
+            elif flood_area_postcode_cache.get_digest(flood_area.notation) == polygon.get_digest():
+                report.unchanged += 1
+            else:
+                changed.append((flood_area, polygon))
+        postcode_sets: list[set[str] | BaseException] = \
+            await asyncio.gather(*[match_flood_area(flood_area.notation, polygon, flood_area_postcode_cache,
+                                                    stats, subdivision_cache)
+                                   for flood_area, polygon in changed],
+                                 return_exceptions=True)
+        for (flood_area, _), postcode_set in zip(changed, postcode_sets):
+            if isinstance(postcode_set, BaseException):
+                report.failed += 1
+                get_logger().error(f"Could not match flood area {flood_area.notation} to its postcodes: "
+                                   f"{postcode_set!r}")
+            else:
+                report.rebuilt += 1
+                report.postcodes += len(postcode_set)
+        get_logger().info(f"Built flood area postcode mapping for {batch_start + len(batch)} "
+                          f"of {len(flood_areas)} flood areas: {report}")
+    get_logger().info(f"Postcode matching: {stats}")
+    return report
+
+
+async def main() -> None:
+    try:
+        async with PolygonClient(cache=get_polygon_cache()) as polygon_client:
+            flood_areas: list[FloodArea] = await get_flood_area_catalogue(polygon_client)
+            get_logger().info(f"Read {len(flood_areas)} flood areas from the catalogue")
+            await build_flood_area_postcodes(flood_areas, polygon_client)
+    finally:
+        await get_cosmos_client_manager().close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,28 +1,41 @@
 import asyncio
-import json
 from json import JSONDecodeError
 from typing import Any
 
-import requests
-from pydantic_core._pydantic_core import PydanticSerializationError
+from aiohttp import ClientError
+from pydantic import ValidationError
 from redis.exceptions import ConnectionError as RedisConnectionError
 
-from requests import get
-from requests.adapters import ConnectionError
-
-from geojson import Polygon, MultiPolygon, loads
-from requests.models import Response
+from geojson import Polygon, MultiPolygon, FeatureCollection
 
+from app.cache.flood_area_postcode_cache import get_flood_area_postcode_cache, FloodAreaPostcodeCache
+from app.cache.polygon_cache import get_polygon_cache
+from app.cache.shard_map_cache import get_shard_map_cache
+from app.cache.subdivision_cache import get_subdivision_cache, SubdivisionCache
+from app.connections.polygon_client import PolygonClient
+from app.models.objects.flood_area_polygon import FloodAreaPolygon
 from app.models.objects.flood_geometries import FloodGeometries
 from app.models.pydantic_models.flood_warning import FloodWarning
 from app.models.objects.floods_with_postcodes import FloodWithPostcodes
 from app.services.notification_service import notify_subscribers
-from app.services.postcodes_in_flood_range_service import collect_postcodes_in_flood_range
-from app.services.geometry_subdivision_service import subdivide_from_feature_collection
+from app.services.postcodes_in_flood_range_service import (collect_postcodes_in_flood_range,
+                                                           get_postcode_id,
+                                                           PostcodeMatchStats)
+from app.services import local_postcode_matching_service
+from app.services.local_postcode_matching_service import POSTCODE_MATCHING_BACKEND, POSTCODE_MATCHING_BACKEND_LOCAL
+from app.services import subscribed_postcode_matching_service
+from app.services.subscribed_postcode_matching_service import (POSTCODE_MATCHING_BACKEND_SUBSCRIBED,
+                                                               POSTCODE_MATCHING_BACKEND_PRUNED)
+from app.services.geometry_deduplication_service import deduplicate_flood_geometries, fan_out_flood_postcodes
+from app.services.geometry_subdivision_service import (subdivide_in_executor,
+                                                       run_in_subdivision_executor,
+                                                       get_subdivision_parameters)
+from app.services.feed_polling_service import FloodFeedPoller
 from app.cache.flood_updates_cache import (get_uncached_and_cached_floods_tuple,
                                            cache_flood_severity,
                                            cache_flood_postcodes)
 
+from app.cache.flood_snapshot_cache import get_changed_floods, save_flood_snapshot
 from app.cache.caching_functions import worker_queue
 
 from app.logging.log import get_logger
@@ -33,6 +46,8 @@ from app.utilities.utilities import flat_map
 SEGMENT_THRESHOLD = 0.1
 FLOOD_UPDATE_URL = "https://environment.data.gov.uk/flood-monitoring/id/floods"
 
+flood_feed_poller: FloodFeedPoller = FloodFeedPoller(FLOOD_UPDATE_URL)
+
 
 import functools
 
@@ -41,8 +56,20 @@ def catch_exceptions(cancel_on_failure=False):
     Generic method which catches all exceptions raised by any service within a scheduler.
     Provides a decorator which can be attached to any method which runs inside a scheduler.
     If an exception is caught, the job running is cancelled.
+    Coroutine functions are wrapped by a coroutine function, so that exceptions raised while they
+    are awaited are also caught.
     """
     def catch_exceptions_decorator(job_func):
+        if asyncio.iscoroutinefunction(job_func):
+            @functools.wraps(job_func)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await job_func(*args, **kwargs)
+                except Exception:
+                    import traceback
+                    get_logger().error(traceback.format_exc())
+            return async_wrapper
+
         @functools.wraps(job_func)
         def wrapper(schedule=None, *args, **kwargs):
             try:
@@ -56,98 +83,263 @@ def catch_exceptions(cancel_on_failure=False):
     return catch_exceptions_decorator
 
 
-async def get_geojson_from_floods(flood_update: LatestFloodUpdate) -> LatestFloodUpdate:
+async def get_geojson_from_floods(flood_update: LatestFloodUpdate,
+                                  polygon_client: PolygonClient | None = None) -> LatestFloodUpdate:
     """
-    Obtains a flood's geojson
+    Concurrently obtains every flood's geojson.
 
     @param flood_update: LatestFloodUpdate object to obtain geojson for
+    @param polygon_client: an open PolygonClient to download the polygons with. If left blank, a client
+    backed by the polygon cache is opened for the duration of this call.
     @return: LatestFloodUpdate object, now with its geojson attached.
     """
-    for flood in flood_update.items:
-        flood_geojson_request = get(flood.floodArea.polygon)
-        flood_geojson_request.raise_for_status()
-        flood_geojson = flood_geojson_request.json()
-        try:
-            flood.floodAreaGeoJson = loads(json.dumps(flood_geojson))
-        except JSONDecodeError as e:
-            get_logger().error("Could not deserialize flood update geojson object. "
-                         "(If you see this error, something is wrong wit the environment agency API. "
-                         "Documentation and further information can be found here:"
-                         "https://environment.data.gov.uk/flood-monitoring/doc/reference")
-            raise e
+    if polygon_client is None:
+        async with PolygonClient(cache=get_polygon_cache()) as client:
+            return await get_geojson_from_floods(flood_update, client)
+    try:
+        flood_polygons: list[FloodAreaPolygon] = \
+            await polygon_client.get_polygons([flood.floodArea.polygon for flood in flood_update.items])
+    except JSONDecodeError as e:
+        get_logger().error("Could not deserialize flood update geojson object. "
+                     "(If you see this error, something is wrong wit the environment agency API. "
+                     "Documentation and further information can be found here:"
+                     "https://environment.data.gov.uk/flood-monitoring/doc/reference")
+        raise e
+    for flood, flood_polygon in zip(flood_update.items, flood_polygons):
+        flood.floodAreaGeoJson = flood_polygon.get_geojson()
+        flood.floodAreaGeoJsonSize = flood_polygon.get_serialized_size()
+        flood.floodAreaGeoJsonDigest = flood_polygon.get_digest()
+    if polygon_client.cache is not None:
+        get_logger().info(f"Flood area polygon cache: {polygon_client.cache.stats}")
     return flood_update
 
 
-async def get_all_postcodes_in_flood_range(floods: list[FloodWarning]) -> list[dict[str, Any]]:
+async def get_flood_geometries(flood: FloodWarning,
+                               subdivision_cache: SubdivisionCache | None = None) -> list[Polygon | MultiPolygon]:
+    """
+    Prepares and subdivides a flood's geometries so that each of them fits in a Cosmos query, then packs small
+    geometries together so that as few queries as possible are needed (see get_flood_area_geometries).
+
+    @param flood: a FloodWarning object with its geojson attached
+    @param subdivision_cache: the SubdivisionCache to reuse subdivided geometries from
+    @return: the flood's geometries as Polygon, or MultiPolygon geojson objects
+    """
+    return await get_flood_area_geometries(flood.floodAreaID, flood.floodAreaGeoJson, flood.floodAreaGeoJsonSize,
+                                           flood.floodAreaGeoJsonDigest, subdivision_cache)
+
+
+async def get_flood_area_geometries(flood_area_id: str,
+                                    feature_collection: FeatureCollection,
+                                    serialized_size: int | None = None,
+                                    digest: str | None = None,
+                                    subdivision_cache: SubdivisionCache | None = None) \
+        -> list[Polygon | MultiPolygon]:
+    """
+    Prepares and subdivides a flood area's geometries so that each of them fits in a Cosmos query, then packs
+    small geometries together so that as few queries as possible are needed.
+    The geometries are subdivided and packed in the subdivision process pool, so the event loop is free to carry
+    on matching other floods in the meantime.
+
+    If a subdivision cache is given, the flood area's geometries are reused from the cache as long as its polygon
+    and the subdivision parameters are unchanged, and cached once subdivided otherwise.
+
+    @param flood_area_id: the ID of the flood area
+    @param feature_collection: the flood area polygon
+    @param serialized_size: an upper bound on the compact serialized length of the flood area geometries
+    @param digest: a digest of the flood area polygon
+    @param subdivision_cache: the SubdivisionCache to reuse subdivided geometries from
+    @return: the flood area's geometries as Polygon, or MultiPolygon geojson objects
+    """
+    parameters: str = get_subdivision_parameters(SEGMENT_THRESHOLD)
+    if subdivision_cache is not None and digest is not None:
+        cached_geometries: list[dict] | None = subdivision_cache.get(flood_area_id, digest, parameters)
+        if cached_geometries is not None:
+            return cached_geometries
+    geometries, report = await subdivide_in_executor(feature_collection, SEGMENT_THRESHOLD, serialized_size,
+                                                     pack=True)
+    if report is not None:
+        get_logger().info(f"Prepared geometry of flood {flood_area_id}: {report}")
+    if subdivision_cache is not None and digest is not None:
+        subdivision_cache.put(flood_area_id, digest, parameters, geometries)
+    return geometries
+
+
+def matches_every_postcode() -> bool:
+    """
+    @return: False if the configured postcode matching backend only matches the postcodes which have a subscriber
+    """
+    return POSTCODE_MATCHING_BACKEND not in (POSTCODE_MATCHING_BACKEND_SUBSCRIBED, POSTCODE_MATCHING_BACKEND_PRUNED)
+
+
+def get_postcode_matcher(every_postcode: bool = False):
+    """
+    @param every_postcode: if True, neither the subscribed postcode index nor the subscribed district pruning is
+    used, since they only match the postcodes which have a subscriber. Cosmos DB queries are used in their place.
+    @return: the collect_postcodes_in_flood_range of the configured postcode matching backend: Cosmos DB queries,
+    the local postcode boundary index, the subscribed postcode index, or Cosmos DB queries of only the
+    subscribed districts
+    """
+    if POSTCODE_MATCHING_BACKEND == POSTCODE_MATCHING_BACKEND_LOCAL:
+        return local_postcode_matching_service.collect_postcodes_in_flood_range
+    if POSTCODE_MATCHING_BACKEND == POSTCODE_MATCHING_BACKEND_SUBSCRIBED and not every_postcode:
+        return subscribed_postcode_matching_service.collect_postcodes_in_flood_range
+    if POSTCODE_MATCHING_BACKEND == POSTCODE_MATCHING_BACKEND_PRUNED and not every_postcode:
+        return subscribed_postcode_matching_service.collect_postcodes_in_subscribed_districts
+    return collect_postcodes_in_flood_range
+
+
+async def get_all_postcodes_in_flood_range(floods: list[FloodWarning],
+                                           subdivision_cache: SubdivisionCache | None = None) -> list[dict[str, Any]]:
     """
     Asynchronously gets all postcodes within a flood range.
 
+    Every flood's geometries are subdivided concurrently in the subdivision process pool. The geometries shared
+    between floods are then deduplicated (also in the pool), so that each region is only matched once, and its
+    postcodes are given to every flood which covers it.
+
     @param floods: a list of FloodWarning objects
+    @param subdivision_cache: the SubdivisionCache to reuse subdivided geometries from. If left blank,
+    the process-wide subdivision cache is used.
     @return: a list of dicts with the flood area ID being the key, and the list of postcodes the value.
     """
-    geometries_with_flood_area_ids: list[FloodGeometries] = []
-    for flood in floods:
-        geometries: list[Polygon | MultiPolygon] = (
-            subdivide_from_feature_collection(flood.floodAreaGeoJson, SEGMENT_THRESHOLD))
-        flood_geometries_object: FloodGeometries = FloodGeometries(flood.floodAreaID, geometries)
-        geometries_with_flood_area_ids.append(flood_geometries_object)
-    flood_postcodes = [collect_postcodes_in_flood_range(geo_with_id.id, geo_with_id.geometries)
-                       for geo_with_id in geometries_with_flood_area_ids]
-    flood_postcodes_results = await asyncio.gather(*flood_postcodes)
-    return flood_postcodes_results
+    if subdivision_cache is None:
+        subdivision_cache = get_subdivision_cache()
+    flood_geometries: list[list[Polygon | MultiPolygon]] = \
+        await asyncio.gather(*[get_flood_geometries(flood, subdivision_cache) for flood in floods])
+    subdivision_cache.flush()
+    get_logger().info(f"Subdivision cache: {subdivision_cache.stats}")
+    geometries_with_flood_area_ids: list[FloodGeometries] = \
+        [FloodGeometries(flood.floodAreaID, geometries) for flood, geometries in zip(floods, flood_geometries)]
+    pieces_per_flood: dict[str, int] = {geo_with_id.id: len(geo_with_id.geometries)
+                                        for geo_with_id in geometries_with_flood_area_ids}
+    get_logger().info(f"Flood geometries split into {sum(pieces_per_flood.values())} pieces "
+                      f"across {len(pieces_per_flood)} floods: {pieces_per_flood}")
+    regions, report = await run_in_subdivision_executor(deduplicate_flood_geometries, geometries_with_flood_area_ids)
+    get_logger().info(f"Deduplicated flood geometries: {report}")
+    region_flood_ids: list[frozenset[str]] = list(regions.keys())
+    postcode_match_stats: PostcodeMatchStats = PostcodeMatchStats()
+    collect_postcodes = get_postcode_matcher()
+    region_postcodes = [collect_postcodes(",".join(sorted(flood_ids)), regions[flood_ids], postcode_match_stats)
+                        for flood_ids in region_flood_ids]
+    region_postcodes_results = await asyncio.gather(*region_postcodes)
+    get_logger().info(f"Postcode matching: {postcode_match_stats}")
+    get_logger().info(f"Shard map: {get_shard_map_cache().stats}")
+    return fan_out_flood_postcodes([flood.floodAreaID for flood in floods], region_flood_ids,
+                                   region_postcodes_results)
+
+
+def get_postcode_set(postcodes_dict: dict[str, Any]) -> set[str]:
+    """
+    @param postcodes_dict: the postcodes in range of a flood, as get_all_postcodes_in_flood_range gives them
+    @return: the identifier of every postcode in range of the flood, once each
+    """
+    return {get_postcode_id(postcode) for postcode in flat_map(lambda f: f, postcodes_dict["floodPostcodes"])}
 
 
 async def get_all_flood_postcodes(floods: list[FloodWarning],
-                                  outdated_cached_floods: list[FloodWithPostcodes]) -> list[FloodWithPostcodes]:
+                                  outdated_cached_floods: list[FloodWithPostcodes],
+                                  flood_area_postcode_cache: FloodAreaPostcodeCache | None = None) \
+        -> list[FloodWithPostcodes]:
     """
     Asynchronously gets all postcodes within a flood range, removes any duplicate postcodes
     and converts the result to a list of FloodWithPostcodes objects.
 
+    The postcodes of every flood whose area polygon is in the flood area postcode mapping are looked up.
+    Only the floods whose area is unknown, or whose polygon has changed since the mapping was built, are
+    matched, and their postcodes are added to the mapping (unless only the subscribed postcodes were matched).
+
     Also takes any outdated cached FloodWithPostcodes objects and appends them to the final result.
 
     @param floods: a list of FloodWarning objects
     @param outdated_cached_floods: a list of FloodWithPostcodes which are out of date in the cache
+    @param flood_area_postcode_cache: the FloodAreaPostcodeCache to look postcodes up in. If left blank,
+    the process-wide mapping is used.
     @return: a list of FloodWithPostcodes objects.
     """
+    if flood_area_postcode_cache is None:
+        flood_area_postcode_cache = get_flood_area_postcode_cache()
     results: list[FloodWithPostcodes] = outdated_cached_floods
-    floods_with_postcodes: list[dict[str, Any]] = await get_all_postcodes_in_flood_range(floods)
-    for postcodes_dict in floods_with_postcodes:
-        for flood in floods:
-            if postcodes_dict.get("id") == flood.floodAreaID:
-                postcode_set: set[str] = set()
-                postcodes = flat_map(lambda f: f, postcodes_dict["floodPostcodes"])
-                for postcode in postcodes:
-                    postcode_id = postcode["features"][0]["properties"]["mapit_code"]
-                    postcode_set.add(postcode_id)
-                flood_with_postcodes: FloodWithPostcodes = FloodWithPostcodes(flood, postcode_set)
-                if len(flood_with_postcodes.postcode_set) > 0:
-                    cache_flood_postcodes(flood_with_postcodes.flood.floodAreaID,
-                                          flood_with_postcodes.postcode_set)
-                results.append(flood_with_postcodes)
+    postcode_sets: dict[str, set[str]] = {}
+    unmatched_floods: list[FloodWarning] = []
+    for flood in floods:
+        digest: str | None = flood.floodAreaGeoJsonDigest
+        postcode_set: set[str] | None = \
+            flood_area_postcode_cache.get(flood.floodAreaID, digest) if digest is not None else None
+        if postcode_set is None:
+            unmatched_floods.append(flood)
+        else:
+            postcode_sets[flood.floodAreaID] = postcode_set
+    get_logger().info(f"Flood area postcode mapping: {flood_area_postcode_cache.stats}")
+    if len(unmatched_floods) > 0:
+        floods_with_postcodes: list[dict[str, Any]] = await get_all_postcodes_in_flood_range(unmatched_floods)
+        for postcodes_dict in floods_with_postcodes:
+            for flood in unmatched_floods:
+                if postcodes_dict.get("id") == flood.floodAreaID:
+                    postcode_sets[flood.floodAreaID] = get_postcode_set(postcodes_dict)
+                    if flood.floodAreaGeoJsonDigest is not None and matches_every_postcode():
+                        flood_area_postcode_cache.put(flood.floodAreaID, flood.floodAreaGeoJsonDigest,
+                                                      postcode_sets[flood.floodAreaID])
+    for flood in floods:
+        if flood.floodAreaID in postcode_sets:
+            flood_with_postcodes: FloodWithPostcodes = FloodWithPostcodes(flood, postcode_sets[flood.floodAreaID])
+            # postcodes matched by a subscriber-restricted backend leave out anyone who subscribes later
+            if len(flood_with_postcodes.postcode_set) > 0 and matches_every_postcode():
+                cache_flood_postcodes(flood_with_postcodes.flood.floodAreaID,
+                                      flood_with_postcodes.postcode_set)
+            results.append(flood_with_postcodes)
     return results
 
 
-async def process_flood_updates(flood_update: LatestFloodUpdate) -> list[FloodWithPostcodes]:
+def get_floods_to_match(floods: list[FloodWarning]) -> tuple[list[FloodWarning], list[FloodWithPostcodes]]:
     """
-    Takes a LatestFloodUpdate object, ascertains which floods are cached, finds any outdated cached floods
+    Splits the floods into those whose postcodes must be matched, and the outdated cached floods whose cached
+    postcodes can be reused (see get_uncached_and_cached_floods_tuple).
+
+    If the postcode matching backend only matches the postcodes which have a subscriber, no postcodes are
+    cached, since anyone who subscribes later would be left out of them. The outdated cached floods are then
+    matched again instead, so that everyone subscribed now is notified of the change in severity.
+
+    @param floods: a list of FloodWarning objects
+    @return: the floods to match, and the outdated cached floods as FloodWithPostcodes objects
+    """
+    uncached_floods, outdated_cached_floods = get_uncached_and_cached_floods_tuple(floods)
+    if matches_every_postcode() or len(outdated_cached_floods) == 0:
+        return uncached_floods, outdated_cached_floods
+    get_logger().info(f"Matching {len(outdated_cached_floods)} floods whose severity has changed again, "
+                      f"since only the subscribed postcodes are matched")
+    return uncached_floods + [flood_with_postcodes.flood for flood_with_postcodes in outdated_cached_floods], []
+
+
+async def process_flood_updates(flood_update: LatestFloodUpdate,
+                                polygon_client: PolygonClient | None = None) -> list[FloodWithPostcodes]:
+    """
+    Takes a LatestFloodUpdate object, drops every flood which is unchanged since the previous run,
+    ascertains which of the remaining floods are cached, finds any outdated cached floods
     and finally takes those floods along with any uncached ones and gets their associated postcodes.
+    Geojson is only obtained for the floods to match, since the outdated cached floods already have postcodes
+    (unless only the subscribed postcodes are matched, see get_floods_to_match).
 
     If the redis database is online, any subscribers who have postcodes intersecting with the flood(s)
     area(s) are notified.
 
     @param flood_update: the LatestFloodUpdate object
+    @param polygon_client: an open PolygonClient used to download each flood's polygon
     @return: a list of FloodWithPostcodes objects
     """
     results: list[FloodWithPostcodes] = []
-    flood_update = await get_geojson_from_floods(flood_update)
     if flood_update is not None:
         floods: list[FloodWarning] = flood_update.items
-        floods_tuple: tuple[list[FloodWarning], list[FloodWithPostcodes]] = get_uncached_and_cached_floods_tuple(floods)
+        changed_floods: list[FloodWarning] = get_changed_floods(floods)
+        get_logger().info(f"{len(floods) - len(changed_floods)} of {len(floods)} floods "
+                          f"are unchanged since the previous run")
+        floods_tuple: tuple[list[FloodWarning], list[FloodWithPostcodes]] = get_floods_to_match(changed_floods)
         uncached_floods: list[FloodWarning] = floods_tuple[0]
         outdated_cached_floods: list[FloodWithPostcodes] = floods_tuple[1]
+        await get_geojson_from_floods(flood_update.model_copy(update={"items": uncached_floods}), polygon_client)
         for flood in uncached_floods:
             cache_flood_severity(flood.floodAreaID, flood.severityLevel, flood.severity)
         results = await get_all_flood_postcodes(uncached_floods, outdated_cached_floods)
+        save_flood_snapshot(floods)
     try:
         worker_queue.enqueue(notify_subscribers, results, job_timeout=180)
     except RedisConnectionError as e:
@@ -156,22 +348,40 @@ async def process_flood_updates(flood_update: LatestFloodUpdate) -> list[FloodWi
 
 
 @catch_exceptions(cancel_on_failure=True)
-async def get_flood_updates():
+async def get_flood_updates(polygon_client: PolygonClient | None = None) -> list[FloodWithPostcodes] | None:
     """
     Asynchronously retrieves the latest flood update from the Environmental Agency API,
     gets all postcodes associated with each flood and notifies any subscribers who have postcodes
     which intersect with the flood(s).
 
+    The flood feed is polled with a conditional request. If it has not changed since the last
+    successful run, the run is short-circuited and an empty list is returned.
+
     This method should only by called by a scheduler object.
+
+    @param polygon_client: an open PolygonClient which is kept warm between runs. If left blank,
+    a client is opened for the duration of the run.
+    @return: a list of FloodWithPostcodes objects, or None if the flood update could not be retrieved
     """
+    if polygon_client is None:
+        async with PolygonClient(cache=get_polygon_cache()) as client:
+            return await get_flood_updates(polygon_client=client)
     try:
-        res: Response = requests.get(FLOOD_UPDATE_URL)
-        if res.status_code == 200:
-            try:
-                flood_update: LatestFloodUpdate = LatestFloodUpdate(**res.json())
-                return await process_flood_updates(flood_update)
-            except PydanticSerializationError as e:
-                get_logger().error(f"Pydantic Serialization Error: {e}")
-        get_logger().error(f"Failed to get flood updates from {FLOOD_UPDATE_URL}")
-    except ConnectionError as e:
-        get_logger().error(f"Could not retrieve flood updates from flood api: {e}")
\ No newline at end of file
+        flood_update: LatestFloodUpdate | None = await flood_feed_poller.poll(polygon_client)
+        if flood_update is None:
+            return []
+        results: list[FloodWithPostcodes] = await process_flood_updates(flood_update, polygon_client)
+        flood_feed_poller.acknowledge()
+        return results
+    except ValidationError as e:
+        get_logger().error(f"Failed to validate flood updates from {FLOOD_UPDATE_URL}: {e}")
+    except (ClientError, asyncio.TimeoutError) as e:
+        get_logger().error(f"Could not retrieve flood updates from flood api: {e!r}")
+    return None
+
+
+def get_next_poll_interval() -> int:
+    """
+    @return: the number of seconds to wait before flood updates are next retrieved
+    """
+    return flood_feed_poller.next_poll_interval()
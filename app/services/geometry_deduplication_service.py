@@ -0,0 +1,187 @@
+from typing import Any
+
+import shapely
+from shapely import Geometry, Polygon, STRtree, get_parts, union_all
+from shapely.geometry import shape
+from geojson import Polygon as GeojsonPolygon
+from geojson import MultiPolygon as GeojsonMultiPolygon
+
+from app.models.objects.flood_geometries import FloodGeometries
+from app.services.geometry_subdivision_service import (get_geojson_size,
+                                                       get_mapping_from_geometry,
+                                                       get_query_character_budget,
+                                                       budget_geometry_subdivision,
+                                                       pack_geometries,
+                                                       SUBDIVISION_TOLERANCE)
+
+
+class GeometryDeduplicationReport:
+    """
+    How many geometries had to be matched against Cosmos once the geometries shared between floods were
+    deduplicated. Each geometry costs one full shard, area, district and postcode query cascade.
+    """
+
+    def __init__(self):
+        self.floods = 0
+        self.pieces = 0
+        self.regions = 0
+        self.identical_pieces = 0
+        self.overlapping_groups = 0
+        self.partitioned_groups = 0
+
+
+    @property
+    def queries_saved(self) -> int:
+        return self.pieces - self.regions
+
+
+    def __repr__(self) -> str:
+        return (f"GeometryDeduplicationReport(floods={self.floods}, pieces={self.pieces}, regions={self.regions}, "
+                f"identical_pieces={self.identical_pieces}, overlapping_groups={self.overlapping_groups}, "
+                f"partitioned_groups={self.partitioned_groups}, queries_saved={self.queries_saved})")
+
+
+def get_polygons(geom: Geometry, minimum_area: float) -> list[Polygon]:
+    """
+    @return: the polygons which make up a geometry, ignoring any parts which are not polygons and any slivers
+    no larger than the minimum area
+    """
+    return [part for part in get_parts(geom)
+            if isinstance(part, Polygon) and part.area > minimum_area]
+
+
+def partition_geometries(geoms: list[Geometry], flood_ids: list[frozenset[str]]) -> dict[frozenset[str], Geometry]:
+    """
+    Partitions overlapping geometries into regions which are each covered by a different set of floods.
+    Every flood's geometries are covered exactly by the regions whose set of floods includes it.
+
+    @param geoms: the geometries to partition
+    @param flood_ids: the set of floods each geometry belongs to
+    @return: the region covered by each set of floods
+    """
+    minimum_area: float = SUBDIVISION_TOLERANCE * max(geom.area for geom in geoms)
+    atoms: list[tuple[Geometry, frozenset[str]]] = []
+    for geom, geom_flood_ids in zip(geoms, flood_ids):
+        remainder: Geometry = geom
+        next_atoms: list[tuple[Geometry, frozenset[str]]] = []
+        for atom, atom_flood_ids in atoms:
+            if remainder.is_empty or not remainder.intersects(atom):
+                next_atoms.append((atom, atom_flood_ids))
+                continue
+            next_atoms.append((atom.intersection(remainder), atom_flood_ids | geom_flood_ids))
+            next_atoms.append((atom.difference(remainder), atom_flood_ids))
+            remainder = remainder.difference(atom)
+        next_atoms.append((remainder, geom_flood_ids))
+        atoms = [(union_all(polygons), atom_flood_ids) for atom, atom_flood_ids in next_atoms
+                 if len(polygons := get_polygons(atom, minimum_area)) > 0]
+    regions: dict[frozenset[str], list[Geometry]] = {}
+    for atom, atom_flood_ids in atoms:
+        regions.setdefault(atom_flood_ids, []).append(atom)
+    return {region_flood_ids: union_all(region_atoms) for region_flood_ids, region_atoms in regions.items()}
+
+
+def get_region_geometries(region: Geometry, character_budget: int) -> list[dict]:
+    """
+    @return: a region as geojson geometries which each fit in a Cosmos query
+    """
+    geometries: list[dict] = [get_mapping_from_geometry(polygon) for polygon in get_polygons(region, 0.0)]
+    if all(get_geojson_size(geometry) <= character_budget for geometry in geometries):
+        return pack_geometries(geometries, character_budget)
+    return pack_geometries([get_mapping_from_geometry(piece)
+                            for piece in budget_geometry_subdivision(region, character_budget)], character_budget)
+
+
+def deduplicate_flood_geometries(flood_geometries: list[FloodGeometries], character_budget: int | None = None) \
+        -> tuple[dict[frozenset[str], list[GeojsonPolygon | GeojsonMultiPolygon]], GeometryDeduplicationReport]:
+    """
+    Finds the geometries shared between floods, so that each region is only matched against Cosmos once and its
+    postcodes are given to every flood which covers it.
+
+    Identical geometries (such as those of two floods with the same flood area) are always merged. Groups of
+    geometries which overlap (such as an alert area containing several warning areas) are partitioned into regions
+    which are each covered by a different set of floods, as long as that does not take more geometries than the
+    group had to begin with. Otherwise the overlapping geometries are matched as they are.
+
+    @param flood_geometries: the geometries of each flood in the run
+    @param character_budget: the longest a region's geometry may be once serialized compactly. If left blank,
+    the query character budget is used.
+    @return: the geometries to be matched, grouped by the set of floods they belong to, and a report of how many
+    geometries were saved
+    """
+    character_budget = character_budget or get_query_character_budget()
+    report: GeometryDeduplicationReport = GeometryDeduplicationReport()
+    report.floods = len(flood_geometries)
+    unique_geometries: list[dict] = []
+    geoms: list[Geometry] = []
+    unique_flood_ids: list[set[str]] = []
+    unique_indexes: dict[bytes, int] = {}
+    for flood_geometries_object in flood_geometries:
+        for geometry in flood_geometries_object.get_geometries():
+            report.pieces += 1
+            geom: Geometry = shape(geometry)
+            key: bytes = shapely.to_wkb(geom)
+            if key in unique_indexes:
+                report.identical_pieces += 1
+                unique_flood_ids[unique_indexes[key]].add(flood_geometries_object.get_id())
+                continue
+            unique_indexes[key] = len(unique_geometries)
+            unique_geometries.append(geometry)
+            geoms.append(geom)
+            unique_flood_ids.append({flood_geometries_object.get_id()})
+    flood_ids: list[frozenset[str]] = [frozenset(geometry_flood_ids) for geometry_flood_ids in unique_flood_ids]
+
+    # group the geometries of different floods which overlap
+    groups: list[int] = list(range(len(geoms)))
+
+    def find_group(index: int) -> int:
+        while groups[index] != index:
+            groups[index] = groups[groups[index]]
+            index = groups[index]
+        return index
+
+    if len(geoms) > 1:
+        minimum_area: float = SUBDIVISION_TOLERANCE * max(geom.area for geom in geoms)
+        left, right = STRtree(geoms).query(geoms, predicate="intersects")
+        for i, j in zip(left.tolist(), right.tolist()):
+            if i < j and flood_ids[i] != flood_ids[j] \
+                    and shapely.intersection(geoms[i], geoms[j]).area > minimum_area:
+                groups[find_group(j)] = find_group(i)
+    members: dict[int, list[int]] = {}
+    for index in range(len(geoms)):
+        members.setdefault(find_group(index), []).append(index)
+
+    regions: dict[frozenset[str], list[GeojsonPolygon | GeojsonMultiPolygon]] = {}
+    for group in members.values():
+        if len(group) > 1:
+            report.overlapping_groups += 1
+            partition: dict[frozenset[str], Geometry] = \
+                partition_geometries([geoms[index] for index in group], [flood_ids[index] for index in group])
+            group_regions: dict[frozenset[str], list[dict]] = \
+                {region_flood_ids: get_region_geometries(region, character_budget)
+                 for region_flood_ids, region in partition.items()}
+            if sum(len(geometries) for geometries in group_regions.values()) <= len(group):
+                report.partitioned_groups += 1
+                for region_flood_ids, geometries in group_regions.items():
+                    regions.setdefault(region_flood_ids, []).extend(geometries)
+                continue
+        for index in group:
+            regions.setdefault(flood_ids[index], []).append(unique_geometries[index])
+    report.regions = sum(len(geometries) for geometries in regions.values())
+    return regions, report
+
+
+def fan_out_flood_postcodes(flood_area_ids: list[str], region_flood_ids: list[frozenset[str]],
+                            region_postcodes: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    Gives the postcodes matched to each deduplicated region to every flood which covers it.
+
+    @param flood_area_ids: the IDs of the floods in the run
+    @param region_flood_ids: the set of floods each region belongs to
+    @param region_postcodes: the postcodes matched to each region, as returned by collect_postcodes_in_flood_range
+    @return: a list of dicts with the flood area ID being the key, and the list of postcodes the value.
+    """
+    flood_postcodes: dict[str, list[list[dict[str, Any]]]] = {flood_area_id: [] for flood_area_id in flood_area_ids}
+    for flood_ids, postcodes in zip(region_flood_ids, region_postcodes):
+        for flood_area_id in flood_ids:
+            flood_postcodes[flood_area_id].extend(postcodes["floodPostcodes"])
+    return [{"id": flood_area_id, "floodPostcodes": postcodes} for flood_area_id, postcodes in flood_postcodes.items()]
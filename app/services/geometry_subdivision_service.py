@@ -1,15 +1,54 @@
 import array
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
+import numpy as np
+import shapely
 from shapely import (Polygon, from_geojson, get_parts, to_geojson, Geometry, GEOSException, box,
-                     GeometryCollection, MultiPolygon)
+                     GeometryCollection, MultiPolygon, get_coordinates, get_type_id, union_all, clip_by_rect,
+                     buffer, simplify, set_precision, get_num_coordinates, from_wkb, to_wkb, is_valid,
+                     make_valid)
+from shapely.geometry import shape
 from geojson import Polygon as GeojsonPolygon
 from geojson import MultiPolygon as GeojsonMultiPolygon
 from geojson import FeatureCollection, Feature
 import json
 
-from app.cosmos.cosmos_queries import COSMOS_QUERY_CHARACTER_LIMIT, match_areas_to_geometry_query
+from app.cosmos.cosmos_queries import (COSMOS_QUERY_CHARACTER_LIMIT,
+                                       match_area_codes_to_geometries_query,
+                                       match_district_names_to_geometries_query,
+                                       match_postcodes_to_geometries_query,
+                                       get_geometries_parameters)
+from app.env_vars import (subdivision_mode, geometry_coordinate_precision, geometry_simplification_tolerance,
+                          subdivision_workers)
+from app.logging.log import get_logger
 
 RECURSION_LIMIT = 250
+SUBDIVISION_TOLERANCE = 1e-9
+# shapely geometry type ids
+POLYGON_TYPE_ID = 3
+MULTIPOLYGON_TYPE_ID = 6
+GEOMETRYCOLLECTION_TYPE_ID = 7
+# split geometries until each piece is no larger than the cell surface threshold
+SUBDIVISION_MODE_THRESHOLD = "threshold"
+# split geometries only until each piece fits in a Cosmos query
+SUBDIVISION_MODE_BUDGET = "budget"
+# number of decimal places to round coordinates to, and the simplification tolerance in degrees, before querying.
+# Geometries are only prepared if at least one of them is set.
+GEOMETRY_COORDINATE_PRECISION: int | None = \
+    int(geometry_coordinate_precision) if geometry_coordinate_precision else None
+GEOMETRY_SIMPLIFICATION_TOLERANCE: float | None = \
+    float(geometry_simplification_tolerance) if geometry_simplification_tolerance else None
+# how far geometries are grown before they are simplified, as multiples of the simplification tolerance
+PREPARATION_GROWTH_FACTORS = (1, 2)
+# length of a compactly serialized geojson MultiPolygon, not counting its coordinates
+MULTIPOLYGON_GEOJSON_OVERHEAD = len('{"type":"MultiPolygon","coordinates":[]}')
+# most geometries matched by one multi-geometry Cosmos query
+MAX_GEOMETRIES_PER_QUERY = 16
+# number of worker processes geometries are subdivided in. 0 subdivides them in the event loop instead
+SUBDIVISION_WORKERS: int = int(subdivision_workers) if subdivision_workers else (os.cpu_count() or 1)
 
 
 def get_geometry_from_geojson(geojson: str) -> list[Geometry]:
@@ -27,6 +66,68 @@ def get_geometry_from_geojson(geojson: str) -> list[Geometry]:
     return parts.tolist()
 
 
+def get_geometry_from_mapping(geometry: GeojsonPolygon | GeojsonMultiPolygon | dict) -> list[Geometry]:
+    """
+    Returns shapely Geometry objects from an already deserialized geojson geometry, without serializing it again.
+
+    @param geometry: a deserialized geojson geometry
+    @return: a list of shapely Geometry objects, one for each part of the geometry
+    """
+    parts: array = get_parts(shape(geometry))
+    return parts.tolist()
+
+
+def get_mapping_from_polygon(polygon: Polygon) -> dict:
+    """
+    Returns a deserialized geojson Polygon from a shapely Polygon object, without serializing it first.
+    Produces the same coordinates as json.loads(to_geojson(polygon)).
+
+    @param polygon: a shapely Polygon object
+    @return: a geojson Polygon represented as a dict
+    """
+    rings = [polygon.exterior, *polygon.interiors]
+    return {"type": "Polygon", "coordinates": [get_coordinates(ring).tolist() for ring in rings]}
+
+
+def get_mapping_from_geometry(geom: Polygon | MultiPolygon) -> dict:
+    """
+    Returns a deserialized geojson Polygon or MultiPolygon from a shapely Polygon or MultiPolygon object,
+    without serializing it first.
+
+    @param geom: a shapely Polygon or MultiPolygon object
+    @return: a geojson Polygon or MultiPolygon represented as a dict
+    """
+    if isinstance(geom, MultiPolygon):
+        return {"type": "MultiPolygon",
+                "coordinates": [get_mapping_from_polygon(polygon)["coordinates"] for polygon in geom.geoms]}
+    return get_mapping_from_polygon(geom)
+
+
+def get_geojson_size(geometry: GeojsonPolygon | GeojsonMultiPolygon | dict) -> int:
+    """
+    Returns the length of a geojson geometry once it is serialized compactly, as the Cosmos SDK serializes it.
+
+    @param geometry: a deserialized geojson geometry
+    @return: the length of the serialized geometry
+    """
+    return len(json.dumps(geometry, separators=(",", ":")))
+
+
+def get_geojson_bounds(geometry: GeojsonPolygon | GeojsonMultiPolygon | dict) -> tuple[float, float, float, float]:
+    """
+    Returns the bounding box of a geojson Polygon or MultiPolygon, without converting it to a shapely geometry.
+    Only the exterior rings are looked at, since the holes lie within them.
+
+    @param geometry: a deserialized geojson Polygon or MultiPolygon
+    @return: the bounding box, as (min x, min y, max x, max y)
+    """
+    coordinates: np.ndarray = np.concatenate([np.asarray(polygon[0], dtype=float)[:, :2]
+                                              for polygon in get_polygon_coordinates(geometry)])
+    x1, y1 = coordinates.min(axis=0)
+    x2, y2 = coordinates.max(axis=0)
+    return float(x1), float(y1), float(x2), float(y2)
+
+
 def get_geojson_from_geometry(geom: Geometry):
     """
     Returns a serialized geojson object from a shapely Geometry object.
@@ -46,6 +147,9 @@ def recursive_geometry_subdivision(geom: Polygon, threshold, recursion_depth=0):
     Recursively subdivides a geometry into smaller geometry polygons, none of which will be larger than the
     specified threshold.
 
+    Superseded by iterative_geometry_subdivision, which produces the same polygons. Kept as the reference
+    implementation it is tested and benchmarked against.
+
     :param geom: shapely geometry object
     :param threshold: maximum distance between geometry and subdivision
     :param recursion_depth: current recursion depth
@@ -86,6 +190,318 @@ def recursive_geometry_subdivision(geom: Polygon, threshold, recursion_depth=0):
     return final_result
 
 
+def clip_by_rects(geoms: np.ndarray, rects: list[list[float]]) -> np.ndarray:
+    """
+    Clips each geometry to its rectangle with GEOS' rectangle clipping.
+
+    Rectangle clipping does not guarantee a valid result: a valid polygon can come back with a ring that touches
+    or crosses itself, which Cosmos' ST_INTERSECTS rejects or mis-evaluates. Every clipped piece is checked, and
+    any invalid one is repaired with make_valid, which keeps its area.
+
+    @param geoms: the geometries to clip
+    @param rects: the (x1, y1, x2, y2) rectangle to clip each geometry to
+    @return: the clipped geometries, all of them valid
+    """
+    clipped: np.ndarray = np.array([clip_by_rect(geom, *rect) for geom, rect in zip(geoms, rects)], dtype=object)
+    invalid: np.ndarray = np.flatnonzero(~is_valid(clipped))
+    if len(invalid) > 0:
+        clipped[invalid] = make_valid(clipped[invalid])
+    return clipped
+
+
+def iterative_geometry_subdivision(geom: Polygon, threshold: float) -> list[Polygon]:
+    """
+    Subdivides a geometry into smaller geometry polygons, none of which will be larger than the specified threshold.
+
+    Splits the geometry in the same way as recursive_geometry_subdivision, and returns the same polygons, except
+    where rectangle clipping returns an invalid piece: that piece is repaired with make_valid, so its parts may
+    differ from those of the recursive implementation's intersection. Rather than recursing, it works through the
+    split tree a level at a time. Every node on a level is measured, split and exploded into its parts with
+    shapely's vectorised array functions. Each node is clipped against the halves of its bounding box with GEOS'
+    rectangle clipping, which is far cheaper than a general intersection with a box polygon. Each node's path
+    through the tree is kept, so the polygons are returned in the order the recursive implementation would have
+    produced them in (although the parts of a multipart node may be ordered differently).
+
+    @param geom: shapely geometry object
+    @param threshold: maximum distance between geometry and subdivision
+    @return: a list of subdivided geometries represented as Polygon objects
+    """
+    nodes: np.ndarray = np.array([geom], dtype=object)
+    paths: list[tuple[int, ...]] = [()]
+    leaves: list[tuple[tuple[int, ...], Geometry]] = []
+    for depth in range(RECURSION_LIMIT + 1):
+        if len(nodes) == 0:
+            break
+        x1, y1, x2, y2 = shapely.bounds(nodes).T
+        width = x2 - x1
+        height = y2 - y1
+        is_leaf: np.ndarray = (np.maximum(width, height) <= threshold) | (depth == RECURSION_LIMIT)
+        if depth == 0 and is_leaf[0]:
+            return [geom]
+        leaves.extend((paths[i], nodes[i]) for i in np.flatnonzero(is_leaf))
+        is_split: np.ndarray = ~is_leaf
+        nodes, paths = nodes[is_split], [paths[i] for i in np.flatnonzero(is_split)]
+        x1, y1, x2, y2 = x1[is_split], y1[is_split], x2[is_split], y2[is_split]
+        width, height = width[is_split], height[is_split]
+
+        # split left to right where the node is at least as tall as it is wide, and top to bottom otherwise
+        split_left_to_right: np.ndarray = height >= width
+        side_a = np.column_stack([x1, y1,
+                                  np.where(split_left_to_right, x2, x1 + width / 2),
+                                  np.where(split_left_to_right, y1 + height / 2, y2)])
+        side_b = np.column_stack([np.where(split_left_to_right, x1, x1 + width / 2),
+                                  np.where(split_left_to_right, y1 + height / 2, y1),
+                                  x2, y2])
+        intersections: np.ndarray = clip_by_rects(np.concatenate([nodes, nodes]),
+                                                  np.concatenate([side_a, side_b]).tolist())
+
+        # explode geometry collections into their parts, and drop anything which is not a (multi)polygon
+        is_collection: np.ndarray = get_type_id(intersections) == GEOMETRYCOLLECTION_TYPE_ID
+        parts, part_indices = get_parts(np.where(is_collection, intersections, None), return_index=True)
+        children: list[tuple[int, Geometry]] = [(i, intersection) for i, intersection in enumerate(intersections)
+                                                if not is_collection[i]]
+        children.extend(zip(part_indices.tolist(), parts))
+        child_type_ids: np.ndarray = get_type_id(np.array([child[1] for child in children], dtype=object))
+        child_nodes: list[Geometry] = []
+        child_paths: list[tuple[int, ...]] = []
+        part_counts: dict[int, int] = {}
+        for (i, child), type_id in zip(children, child_type_ids):
+            part_index: int = part_counts.get(i, 0)
+            part_counts[i] = part_index + 1
+            if type_id in (POLYGON_TYPE_ID, MULTIPOLYGON_TYPE_ID) and not child.is_empty:
+                side, parent = divmod(i, len(paths))
+                child_nodes.append(child)
+                child_paths.append(paths[parent] + (side, part_index))
+        nodes = np.array(child_nodes, dtype=object)
+        paths = child_paths
+
+    # convert multipart into single part, in the order the recursive implementation visits the tree
+    leaves.sort(key=lambda leaf: leaf[0])
+    return get_parts(np.array([leaf[1] for leaf in leaves], dtype=object)).tolist()
+
+
+def get_query_character_budget() -> int:
+    """
+    @return: the longest a serialized geometry can be while still fitting, on its own, in every multi-geometry
+    query postcode matching sends it in
+    """
+    return COSMOS_QUERY_CHARACTER_LIMIT - get_multi_geometry_query_size(1) - 1
+
+
+def get_multi_geometry_query_size(geometry_count: int) -> int:
+    """
+    @return: the length of the longest multi-geometry query for the given number of geometries, along with its
+    parameters, without the geometries themselves
+    """
+    longest_query: int = max(len(query(geometry_count)) for query in (match_area_codes_to_geometries_query,
+                                                                      match_district_names_to_geometries_query,
+                                                                      match_postcodes_to_geometries_query))
+    return longest_query + get_geojson_size(get_geometries_parameters([None] * geometry_count))
+
+
+def batch_query_geometries(geometries: list[GeojsonPolygon | GeojsonMultiPolygon | dict],
+                           max_geometries: int = MAX_GEOMETRIES_PER_QUERY) -> list[list[int]]:
+    """
+    Batches geometries, in order, so that each batch can be matched with one multi-geometry query at every level
+    while staying under the Cosmos query character limit. A geometry too large to share a query is given a
+    batch of its own.
+
+    @param geometries: the geojson geometries to batch
+    @param max_geometries: the most geometries one query may be given
+    @return: the index of every geometry in each batch
+    """
+    batches: list[list[int]] = []
+    batch_size: int = 0
+    for index, geometry in enumerate(geometries):
+        size: int = get_geojson_size(geometry)
+        if len(batches) > 0 and len(batches[-1]) < max_geometries \
+                and get_multi_geometry_query_size(len(batches[-1]) + 1) + batch_size + size \
+                < COSMOS_QUERY_CHARACTER_LIMIT:
+            batches[-1].append(index)
+            batch_size += size
+        else:
+            batches.append([index])
+            batch_size = size
+    return batches
+
+
+def clip_to_polygons(geom: Geometry, x1: float, y1: float, x2: float, y2: float) -> list[Geometry]:
+    """
+    Clips a geometry to a rectangle, keeping only the polygonal parts of the result.
+
+    @return: a list of valid Polygon and MultiPolygon objects
+    """
+    intersection: Geometry = clip_by_rects(np.array([geom], dtype=object), [[x1, y1, x2, y2]])[0]
+    parts = get_parts(intersection) if get_type_id(intersection) == GEOMETRYCOLLECTION_TYPE_ID else [intersection]
+    return [part for part in parts
+            if get_type_id(part) in (POLYGON_TYPE_ID, MULTIPOLYGON_TYPE_ID) and not part.is_empty]
+
+
+def budget_geometry_subdivision(geom: Polygon | MultiPolygon, character_budget: int) \
+        -> list[Polygon | MultiPolygon]:
+    """
+    Subdivides a geometry only until every piece fits in the given character budget once serialized.
+
+    Unlike the threshold subdivision, pieces are measured rather than their extent, so a geometry just over
+    the budget is split in two rather than into dozens of cells. Pieces are split across their longer side at
+    the median of their vertices, rather than at the middle of their bounding box, so that each split roughly
+    halves a piece's serialized size. Multipart pieces which fit in the budget are kept whole.
+
+    @param geom: shapely Polygon or MultiPolygon object
+    @param character_budget: the longest a piece may be once serialized compactly
+    @return: a list of subdivided geometries represented as Polygon or MultiPolygon objects
+    """
+    nodes: list[tuple[tuple[int, ...], Polygon | MultiPolygon]] = [((), geom)]
+    leaves: list[tuple[tuple[int, ...], Polygon | MultiPolygon]] = []
+    for depth in range(RECURSION_LIMIT + 1):
+        child_nodes: list[tuple[tuple[int, ...], Polygon | MultiPolygon]] = []
+        for path, node in nodes:
+            if depth == RECURSION_LIMIT or get_geojson_size(get_mapping_from_geometry(node)) <= character_budget:
+                leaves.append((path, node))
+                continue
+            x1, y1, x2, y2 = node.bounds
+            coordinates: np.ndarray = get_coordinates(node)
+            if y2 - y1 >= x2 - x1:
+                # split left to right
+                split: float = float(np.median(coordinates[:, 1]))
+                if not y1 < split < y2:
+                    split = y1 + (y2 - y1) / 2
+                sides = ((x1, y1, x2, split), (x1, split, x2, y2))
+            else:
+                # split top to bottom
+                split: float = float(np.median(coordinates[:, 0]))
+                if not x1 < split < x2:
+                    split = x1 + (x2 - x1) / 2
+                sides = ((x1, y1, split, y2), (split, y1, x2, y2))
+            for side_index, side in enumerate(sides):
+                for part_index, part in enumerate(clip_to_polygons(node, *side)):
+                    child_nodes.append((path + (side_index, part_index), part))
+        if len(child_nodes) == 0:
+            break
+        nodes = child_nodes
+    leaves.sort(key=lambda leaf: leaf[0])
+    return [leaf[1] for leaf in leaves]
+
+
+class GeometryPreparationReport:
+    """
+    The reduction in vertices and serialized size achieved by preparing a flood's geometries.
+    """
+
+    def __init__(self):
+        self.vertices_before = 0
+        self.vertices_after = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.largest_geometry_size = 0
+        self.unprepared_geometries = 0
+
+
+    def add(self, geom: Geometry, prepared_geom: Geometry, size: int, prepared_size: int) -> None:
+        self.vertices_before += int(get_num_coordinates(geom))
+        self.vertices_after += int(get_num_coordinates(prepared_geom))
+        self.bytes_before += size
+        self.bytes_after += prepared_size
+        self.largest_geometry_size = max(self.largest_geometry_size, prepared_size)
+        if prepared_geom is geom:
+            self.unprepared_geometries += 1
+
+
+    @staticmethod
+    def reduction(before: int, after: int) -> float:
+        return 1 - after / before if before > 0 else 0.0
+
+
+    def __repr__(self) -> str:
+        return (f"GeometryPreparationReport(vertices={self.vertices_before}->{self.vertices_after} "
+                f"({self.reduction(self.vertices_before, self.vertices_after):.1%} fewer), "
+                f"bytes={self.bytes_before}->{self.bytes_after} "
+                f"({self.reduction(self.bytes_before, self.bytes_after):.1%} smaller), "
+                f"unprepared_geometries={self.unprepared_geometries})")
+
+
+def geometry_preparation_enabled() -> bool:
+    return GEOMETRY_COORDINATE_PRECISION is not None or GEOMETRY_SIMPLIFICATION_TOLERANCE is not None
+
+
+def prepare_geometry(geom: Polygon | MultiPolygon, precision: int | None, tolerance: float | None) \
+        -> Polygon | MultiPolygon:
+    """
+    Rounds a geometry's coordinates to the given number of decimal places, and simplifies it within the given
+    tolerance, without ever shrinking it.
+
+    The geometry is first grown by the tolerance plus the coordinate grid size, so that simplifying and rounding
+    it can only ever cut back into the area it was grown by. The prepared geometry is then checked to still cover
+    the original. Simplification can occasionally stray slightly beyond its tolerance, in which case the original
+    is grown by twice the tolerance and prepared again. If that fails too, the original geometry is returned, so
+    a prepared geometry can never miss a postcode the original would have matched. The prepared geometry lies
+    within roughly three times the tolerance, plus two grid cells, of the original.
+
+    @param geom: shapely Polygon or MultiPolygon object
+    @param precision: the number of decimal places to round coordinates to, or None to leave them as they are
+    @param tolerance: the simplification tolerance in degrees, or None to not simplify
+    @return: the prepared geometry, or the original geometry if it could not be prepared
+    """
+    grid_size: float = 10 ** -precision if precision is not None else 0.0
+    tolerance = tolerance or 0.0
+    if grid_size == 0.0 and tolerance == 0.0:
+        return geom
+    for growth_factor in PREPARATION_GROWTH_FACTORS:
+        prepared_geom: Geometry = buffer(geom, growth_factor * tolerance + grid_size, join_style="mitre")
+        if tolerance > 0.0:
+            prepared_geom = simplify(prepared_geom, tolerance, preserve_topology=True)
+        if grid_size > 0.0:
+            prepared_geom = set_precision(prepared_geom, grid_size)
+        if get_type_id(prepared_geom) in (POLYGON_TYPE_ID, MULTIPOLYGON_TYPE_ID) and prepared_geom.covers(geom):
+            return prepared_geom
+    get_logger().warning("Could not prepare a flood geometry without shrinking it, so it will be queried as it is")
+    return geom
+
+
+def prepare_feature_collection(feature_collection: FeatureCollection,
+                               precision: int | None = GEOMETRY_COORDINATE_PRECISION,
+                               tolerance: float | None = GEOMETRY_SIMPLIFICATION_TOLERANCE) \
+        -> tuple[FeatureCollection, GeometryPreparationReport]:
+    """
+    Prepares every geometry in a FeatureCollection object (see prepare_geometry) before it is subdivided and queried.
+    The original FeatureCollection object is left as it is.
+
+    @param feature_collection: a FeatureCollection object containing the geojson geometries to be prepared
+    @param precision: the number of decimal places to round coordinates to, or None to leave them as they are
+    @param tolerance: the simplification tolerance in degrees, or None to not simplify
+    @return: a FeatureCollection object containing the prepared geometries, and a report of how much smaller
+    they are
+    """
+    report: GeometryPreparationReport = GeometryPreparationReport()
+    prepared_features: list[dict] = []
+    for feature in feature_collection.get("features"):
+        feature_geometry: GeojsonPolygon | GeojsonMultiPolygon = feature.get("geometry")
+        geom: Geometry = shape(feature_geometry)
+        prepared_geom: Geometry = prepare_geometry(geom, precision, tolerance)
+        prepared_geometry: dict = \
+            feature_geometry if prepared_geom is geom else get_mapping_from_geometry(prepared_geom)
+        report.add(geom, prepared_geom, get_geojson_size(feature_geometry), get_geojson_size(prepared_geometry))
+        prepared_features.append({**feature, "geometry": prepared_geometry})
+    prepared_feature_collection: FeatureCollection = FeatureCollection([])
+    prepared_feature_collection.update({**feature_collection, "features": prepared_features})
+    return prepared_feature_collection, report
+
+
+def subdivision_covers_geometry(geom: Geometry, subdivided_polygons: list[Polygon],
+                                tolerance: float = SUBDIVISION_TOLERANCE) -> bool:
+    """
+    Checks that a subdivision neither loses nor adds any area: the union of the subdivided polygons must equal
+    the original geometry, allowing for the floating point error introduced by clipping.
+
+    @param geom: the geometry which was subdivided
+    @param subdivided_polygons: the polygons it was subdivided into
+    @param tolerance: the largest area by which the union and the geometry may differ, relative to the geometry's area
+    @return: True if the union of the subdivided polygons equals the geometry
+    """
+    union: Geometry = union_all(subdivided_polygons)
+    return union.symmetric_difference(geom).area <= tolerance * max(geom.area, 1.0)
+
+
 def subdivide(geojson: str, cell_surface_threshold: float) -> list[list[Polygon]]:
     """
     Subdivides a geojson string into smaller geometries each no larger than the given cell surface area threshold.
@@ -94,36 +510,309 @@ def subdivide(geojson: str, cell_surface_threshold: float) -> list[list[Polygon]
     @param cell_surface_threshold: cell surface area threshold for subdivision
     @return: a list of subdivided geometries represented as Polygon objects
     """
-    geom_parts: list[Geometry] = get_geometry_from_geojson(geojson)
+    return subdivide_parts(get_geometry_from_geojson(geojson), cell_surface_threshold)
+
+
+def subdivide_parts(geom_parts: list[Geometry], cell_surface_threshold: float) -> list[list[Polygon]]:
+    """
+    Subdivides the parts of a geometry into smaller geometries each no larger than the given cell surface area
+    threshold.
+
+    @param geom_parts: the parts of a geometry, as shapely Geometry objects
+    @param cell_surface_threshold: cell surface area threshold for subdivision
+    @return: a list of subdivided geometries represented as Polygon objects
+    """
     list_of_subdivided_polygons: list[list[Polygon]] = []
     for part in geom_parts:
         if isinstance(part, Polygon):
-            list_of_subdivided_polygons.append(recursive_geometry_subdivision(part, cell_surface_threshold))
+            list_of_subdivided_polygons.append(iterative_geometry_subdivision(part, cell_surface_threshold))
     return list_of_subdivided_polygons
 
 
-def subdivide_from_feature_collection(feature_collection: FeatureCollection, cell_surface_threshold: float) \
+def get_feature_geometry_size(feature_geometry: GeojsonPolygon | GeojsonMultiPolygon, feature_count: int,
+                              serialized_size: int | None, character_budget: int) -> int:
+    """
+    Returns the compact serialized length of a feature's geometry, or an upper bound on it. The upper bound
+    measured from the response body is used if it is all that is needed: if there is only one feature, or if the
+    bound shows every feature fits in the budget. Otherwise the geometry is serialized to measure it.
+    """
+    if serialized_size is not None and (feature_count == 1 or serialized_size <= character_budget):
+        return serialized_size
+    return get_geojson_size(feature_geometry)
+
+
+def subdivide_geometry(geom: Geometry, cell_surface_threshold: float, character_budget: int, mode: str) \
+        -> list[Polygon | MultiPolygon]:
+    """
+    Subdivides a geometry which is too large to fit in a Cosmos query, using the given subdivision mode.
+
+    @param geom: shapely Polygon or MultiPolygon object
+    @param cell_surface_threshold: cell surface area threshold for subdivision in threshold mode
+    @param character_budget: the longest a piece may be once serialized compactly, in budget mode
+    @param mode: SUBDIVISION_MODE_THRESHOLD or SUBDIVISION_MODE_BUDGET
+    @return: a list of subdivided geometries represented as Polygon or MultiPolygon objects
+    """
+    if mode == SUBDIVISION_MODE_BUDGET:
+        return budget_geometry_subdivision(geom, character_budget)
+    return [subdivided_polygon
+            for subdivided_polygons in subdivide_parts(list(get_parts(geom)), cell_surface_threshold)
+            for subdivided_polygon in subdivided_polygons]
+
+
+def subdivide_from_feature_collection(feature_collection: FeatureCollection, cell_surface_threshold: float,
+                                      serialized_size: int | None = None,
+                                      mode: str | None = None) \
         -> list[GeojsonPolygon | GeojsonMultiPolygon]:
     """
-    Subdivides a geojson string into smaller geometries each no larger than the
-    given cell surface area threshold. Each geojson string is obtained from a FeatureCollection object.
+    Subdivides each geometry in a FeatureCollection object which is too large to fit in a Cosmos query into smaller
+    geometries.
+
+    In threshold mode, each geometry is split into pieces no larger than the given cell surface area threshold.
+    In budget mode, each geometry is only split until every piece fits in a Cosmos query, which usually results in
+    far fewer pieces (and so far fewer queries). The mode defaults to the SUBDIVISION_MODE environment variable,
+    or budget mode if it is not set.
+
+    Geometries are never serialized and deserialized again along the way. They are converted straight to shapely
+    Geometry objects, and subdivided polygons are converted straight back. If an upper bound on the serialized
+    length of the geometries is given (see FloodAreaPolygon), it is used instead of serializing each geometry
+    to measure it.
 
     @param feature_collection: a FeatureCollection object containing all geojson geometries to be subdivided
-    @param cell_surface_threshold: cell surface area threshold for subdivision
+    @param cell_surface_threshold: cell surface area threshold for subdivision in threshold mode
+    @param serialized_size: an upper bound on the compact serialized length of every geometry in the
+    FeatureCollection, if one is known
+    @param mode: SUBDIVISION_MODE_THRESHOLD or SUBDIVISION_MODE_BUDGET
     @return: a list of subdivided geometries represented as Polygon, or MultiPolygon geojson objects
     """
+    mode = mode or subdivision_mode or SUBDIVISION_MODE_BUDGET
     geometries: list[GeojsonPolygon | GeojsonMultiPolygon] = []
     flood_area_features: list[Feature] = feature_collection.get("features")
+    character_budget: int = get_query_character_budget()
     for feature in flood_area_features:
         feature_geometry: GeojsonPolygon | GeojsonMultiPolygon = feature.get("geometry")
-        feature_geometry_as_string = json.dumps(feature_geometry)
-        if len(feature_geometry_as_string) + len(match_areas_to_geometry_query()) >= COSMOS_QUERY_CHARACTER_LIMIT:
-            list_of_subdivided_polygons: list[list[Polygon]] = (
-                subdivide(feature_geometry_as_string, cell_surface_threshold))
-            for subdivided_polygons in list_of_subdivided_polygons:
-                polygons_as_geojson: list[GeojsonPolygon] = [json.loads(get_geojson_from_geometry(subdivided_polygon))
-                                                      for subdivided_polygon in subdivided_polygons]
-                geometries.extend(polygons_as_geojson)
-        else:
+        geometry_size: int = get_feature_geometry_size(feature_geometry, len(flood_area_features),
+                                                       serialized_size, character_budget)
+        if geometry_size <= character_budget:
             geometries.append(feature_geometry)
-    return geometries
\ No newline at end of file
+        else:
+            geometries.extend([get_mapping_from_geometry(piece)
+                               for piece in subdivide_geometry(shape(feature_geometry), cell_surface_threshold,
+                                                               character_budget, mode)])
+    return geometries
+
+
+def get_polygon_coordinates(geometry: GeojsonPolygon | GeojsonMultiPolygon | dict) -> list:
+    """
+    @param geometry: a deserialized geojson Polygon or MultiPolygon
+    @return: the coordinates of each of the geometry's polygons
+    """
+    return geometry["coordinates"] if geometry["type"] == "MultiPolygon" else [geometry["coordinates"]]
+
+
+def pack_geometries(geometries: list[GeojsonPolygon | GeojsonMultiPolygon | dict],
+                    character_budget: int | None = None) -> list[GeojsonPolygon | GeojsonMultiPolygon | dict]:
+    """
+    Packs small geometries together into MultiPolygons, each of which still fits in a Cosmos query, so that a
+    flood made up of many small features is matched with a few queries rather than one for every feature.
+
+    Geometries are packed first fit, largest first. A geometry is never packed alongside one it intersects or
+    touches, since the resulting MultiPolygon would not be valid. A MultiPolygon intersects exactly what any of
+    its polygons intersect, so packing never changes which postcodes a flood is matched to.
+
+    @param geometries: the geojson Polygon and MultiPolygon geometries of a single flood
+    @param character_budget: the longest a packed geometry may be once serialized compactly. If left blank,
+    the query character budget is used.
+    @return: the packed geometries. Geometries which could not be packed alongside any other are left as they are.
+    """
+    character_budget = character_budget or get_query_character_budget()
+    packed_geometries: list[GeojsonPolygon | GeojsonMultiPolygon | dict] = []
+    candidates: list[tuple[int, dict, list]] = []
+    for geometry in geometries:
+        if geometry.get("type") not in ("Polygon", "MultiPolygon"):
+            packed_geometries.append(geometry)
+            continue
+        polygon_coordinates: list = get_polygon_coordinates(geometry)
+        # the length of the polygons' coordinates, without the brackets around them
+        size: int = get_geojson_size(polygon_coordinates) - 2
+        if MULTIPOLYGON_GEOJSON_OVERHEAD + size > character_budget:
+            packed_geometries.append(geometry)
+            continue
+        candidates.append((size, geometry, polygon_coordinates))
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+    bins: list[dict] = []
+    for size, geometry, polygon_coordinates in candidates:
+        geom: Geometry = shape(geometry)
+        for geometry_bin in bins:
+            if MULTIPOLYGON_GEOJSON_OVERHEAD + geometry_bin["size"] + 1 + size <= character_budget \
+                    and not shapely.intersects(geometry_bin["geoms"], geom).any():
+                geometry_bin["geometries"].append(geometry)
+                geometry_bin["coordinates"].extend(polygon_coordinates)
+                geometry_bin["geoms"].append(geom)
+                geometry_bin["size"] += 1 + size
+                break
+        else:
+            bins.append({"geometries": [geometry], "coordinates": list(polygon_coordinates),
+                         "geoms": [geom], "size": size})
+    for geometry_bin in bins:
+        if len(geometry_bin["geometries"]) == 1:
+            packed_geometries.append(geometry_bin["geometries"][0])
+        else:
+            packed_geometries.append({"type": "MultiPolygon", "coordinates": geometry_bin["coordinates"]})
+    return packed_geometries
+
+
+def subdivision_required(feature_collection: FeatureCollection, serialized_size: int | None = None) -> bool:
+    """
+    @param feature_collection: a FeatureCollection object containing geojson geometries
+    @param serialized_size: an upper bound on the compact serialized length of every geometry in the
+    FeatureCollection, if one is known
+    @return: True if any of the geometries might be too large to fit in a Cosmos query
+    """
+    character_budget: int = get_query_character_budget()
+    if serialized_size is not None:
+        return serialized_size > character_budget
+    return any(get_geojson_size(feature.get("geometry")) > character_budget
+               for feature in feature_collection.get("features"))
+
+
+def subdivide_to_wkb(feature_collection: FeatureCollection, cell_surface_threshold: float,
+                     serialized_size: int | None, mode: str, prepare: bool, pack: bool = False) \
+        -> tuple[list[bytes], GeometryPreparationReport | None]:
+    """
+    Prepares (if asked to), subdivides and packs (if asked to) every geometry in a FeatureCollection object,
+    returning the resulting geometries as WKB. This is what runs in the subdivision worker processes: WKB is far
+    smaller and cheaper to send back to the event loop than geojson coordinate lists.
+
+    @param feature_collection: a FeatureCollection object containing all geojson geometries to be subdivided
+    @param cell_surface_threshold: cell surface area threshold for subdivision in threshold mode
+    @param serialized_size: an upper bound on the compact serialized length of every geometry in the
+    FeatureCollection, if one is known
+    @param mode: SUBDIVISION_MODE_THRESHOLD or SUBDIVISION_MODE_BUDGET
+    @param prepare: whether to prepare the geometries before they are subdivided (see prepare_geometry)
+    @param pack: whether to pack the subdivided geometries together (see pack_geometries)
+    @return: the subdivided geometries as WKB, and the preparation report if the geometries were prepared
+    """
+    report: GeometryPreparationReport | None = None
+    if prepare:
+        feature_collection, report = prepare_feature_collection(feature_collection)
+        serialized_size = report.largest_geometry_size
+    flood_area_features: list[Feature] = feature_collection.get("features")
+    character_budget: int = get_query_character_budget()
+    pieces: list[Geometry] = []
+    for feature in flood_area_features:
+        feature_geometry: GeojsonPolygon | GeojsonMultiPolygon = feature.get("geometry")
+        geom: Geometry = shape(feature_geometry)
+        if get_feature_geometry_size(feature_geometry, len(flood_area_features),
+                                     serialized_size, character_budget) <= character_budget:
+            pieces.append(geom)
+        else:
+            pieces.extend(subdivide_geometry(geom, cell_surface_threshold, character_budget, mode))
+    if pack:
+        pieces = [shape(geometry) for geometry in
+                  pack_geometries([get_mapping_from_geometry(piece) for piece in pieces], character_budget)]
+    return to_wkb(pieces).tolist(), report
+
+
+__subdivision_executor: ProcessPoolExecutor | None = None
+
+
+def get_subdivision_executor() -> ProcessPoolExecutor | None:
+    """
+    @return: the process pool geometries are subdivided in, or None if SUBDIVISION_WORKERS is 0
+    """
+    global __subdivision_executor
+    if __subdivision_executor is None and SUBDIVISION_WORKERS > 0:
+        __subdivision_executor = ProcessPoolExecutor(max_workers=SUBDIVISION_WORKERS)
+    return __subdivision_executor
+
+
+def shutdown_subdivision_executor() -> None:
+    """
+    Shuts down the subdivision process pool, if it was ever started.
+    """
+    global __subdivision_executor
+    if __subdivision_executor is not None:
+        __subdivision_executor.shutdown(cancel_futures=True)
+        __subdivision_executor = None
+
+
+async def run_in_subdivision_executor(func, *args):
+    """
+    Runs a CPU bound geometry function in the subdivision process pool, without blocking the event loop.
+    If the pool is disabled, or one of its workers died, the function is run in the event loop instead.
+
+    @param func: the function to run. It must be picklable, as must its arguments and result.
+    @param args: the arguments to run the function with
+    @return: the function's result
+    """
+    executor: ProcessPoolExecutor | None = get_subdivision_executor()
+    if executor is not None:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        except BrokenProcessPool as e:
+            get_logger().warning(f"Subdivision process pool is broken, so running {func.__name__} "
+                                 f"in the event loop: {e!r}")
+            shutdown_subdivision_executor()
+    return func(*args)
+
+
+async def subdivide_in_executor(feature_collection: FeatureCollection, cell_surface_threshold: float,
+                                serialized_size: int | None = None,
+                                executor: ProcessPoolExecutor | None = None,
+                                pack: bool = False) \
+        -> tuple[list[GeojsonPolygon | GeojsonMultiPolygon], GeometryPreparationReport | None]:
+    """
+    Prepares (if enabled), subdivides and packs (if asked to) every geometry in a FeatureCollection object without
+    blocking the event loop, so that other floods can be matched while this one is split.
+
+    FeatureCollections which need none of this are passed straight through. Everything else is sent to the
+    subdivision process pool, and the geometries come back as WKB. If the pool is disabled, or one of its workers
+    died, the geometries are subdivided in the event loop instead.
+
+    @param feature_collection: a FeatureCollection object containing all geojson geometries to be subdivided
+    @param cell_surface_threshold: cell surface area threshold for subdivision in threshold mode
+    @param serialized_size: an upper bound on the compact serialized length of every geometry in the
+    FeatureCollection, if one is known
+    @param executor: the process pool to subdivide in. If left blank, the subdivision process pool is used.
+    @param pack: whether to pack the subdivided geometries together (see pack_geometries)
+    @return: the subdivided geometries as Polygon, or MultiPolygon geojson objects, and the preparation report if
+    the geometries were prepared
+    """
+    prepare: bool = geometry_preparation_enabled()
+    packing_required: bool = pack and len(feature_collection.get("features")) > 1
+    if not prepare and not packing_required and not subdivision_required(feature_collection, serialized_size):
+        return subdivide_from_feature_collection(feature_collection, cell_surface_threshold, serialized_size), None
+    executor = executor or get_subdivision_executor()
+    if executor is not None:
+        mode: str = subdivision_mode or SUBDIVISION_MODE_BUDGET
+        try:
+            pieces_wkb, report = await asyncio.get_running_loop().run_in_executor(
+                executor, subdivide_to_wkb, feature_collection, cell_surface_threshold, serialized_size, mode, prepare,
+                pack)
+            return [get_mapping_from_geometry(piece) for piece in from_wkb(pieces_wkb)], report
+        except BrokenProcessPool as e:
+            get_logger().warning(f"Subdivision process pool is broken, so subdividing in the event loop: {e!r}")
+            if executor is __subdivision_executor:
+                shutdown_subdivision_executor()
+    report: GeometryPreparationReport | None = None
+    if prepare:
+        feature_collection, report = prepare_feature_collection(feature_collection)
+        serialized_size = report.largest_geometry_size
+    geometries: list[GeojsonPolygon | GeojsonMultiPolygon] = \
+        subdivide_from_feature_collection(feature_collection, cell_surface_threshold, serialized_size)
+    return (pack_geometries(geometries) if pack else geometries), report
+
+
+def get_subdivision_parameters(cell_surface_threshold: float, mode: str | None = None) -> str:
+    """
+    Describes everything other than the geometry itself which decides how a geometry is prepared and subdivided,
+    so that subdivided geometries can be cached and reused for as long as it stays the same.
+
+    @param cell_surface_threshold: cell surface area threshold for subdivision in threshold mode
+    @param mode: SUBDIVISION_MODE_THRESHOLD or SUBDIVISION_MODE_BUDGET
+    @return: a string describing the subdivision parameters
+    """
+    mode = mode or subdivision_mode or SUBDIVISION_MODE_BUDGET
+    limit: float = cell_surface_threshold if mode == SUBDIVISION_MODE_THRESHOLD else get_query_character_budget()
+    return (f"mode={mode};limit={limit};budget={get_query_character_budget()};"
+            f"precision={GEOMETRY_COORDINATE_PRECISION};tolerance={GEOMETRY_SIMPLIFICATION_TOLERANCE};packed=True")
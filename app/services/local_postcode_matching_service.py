@@ -0,0 +1,201 @@
+import asyncio
+import json
+from typing import Any
+
+import numpy as np
+from shapely import Geometry, STRtree, box, intersects
+from shapely.geometry import shape
+from geojson import Polygon, MultiPolygon
+
+from app.env_vars import postcode_matching_backend, postcode_boundary_snapshot
+from app.logging.log import get_logger
+from app.services.boundary_snapshot_service import BoundarySnapshot, BoundarySnapshotLevel, is_boundary_snapshot_file
+from app.services.postcodes_in_flood_range_service import PostcodeMatchStats
+
+POSTCODE_MATCHING_BACKEND_COSMOS = "cosmos"
+POSTCODE_MATCHING_BACKEND_LOCAL = "local"
+POSTCODE_MATCHING_BACKEND: str = postcode_matching_backend or POSTCODE_MATCHING_BACKEND_COSMOS
+
+
+def group_matches(codes: list[str] | np.ndarray, flood_indexes: np.ndarray, boundary_indexes: np.ndarray) \
+        -> dict[str, list[int]]:
+    """
+    @param codes: the code of each boundary in boundary_indexes, by position in the level
+    @param flood_indexes: the index of the flood geometry of each match
+    @param boundary_indexes: the index of the boundary of each match
+    @return: the code of every matched boundary, along with the index of every flood geometry it intersects,
+    in order
+    """
+    order: np.ndarray = np.lexsort((flood_indexes, boundary_indexes))
+    matches: dict[str, list[int]] = {}
+    for flood_index, boundary_index in zip(flood_indexes[order].tolist(), boundary_indexes[order].tolist()):
+        matches.setdefault(codes[boundary_index], []).append(flood_index)
+    return matches
+
+
+class BoundaryLevel:
+    """
+    The boundaries of one level of the postcode hierarchy (areas, districts or postcodes) along with their codes,
+    indexed in an STRtree.
+    """
+
+    def __init__(self, codes: list[str], geoms: list[Geometry]):
+        self.codes: np.ndarray = np.array(codes, dtype=object)
+        self.geoms: np.ndarray = np.array(geoms, dtype=object)
+        self.tree: STRtree = STRtree(self.geoms)
+
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+
+    def match(self, flood_geoms: list[Geometry]) -> dict[str, list[int]]:
+        """
+        @param flood_geoms: the flood geometries to match
+        @return: the code of every boundary which intersects any of the flood geometries, along with the index of
+        every flood geometry it intersects
+        """
+        flood_indexes, boundary_indexes = self.tree.query(np.array(flood_geoms, dtype=object), predicate="intersects")
+        return group_matches(self.codes, flood_indexes, boundary_indexes)
+
+
+class MappedBoundaryLevel:
+    """
+    One level of a memory-mapped snapshot file, indexed in an STRtree of its bounding boxes.
+
+    Only the bounding boxes are held in the tree. The geometries and codes of the boundaries whose boxes a flood
+    touches are decoded from the snapshot when they are matched, so the level's boundaries stay in the shared
+    pages of the snapshot rather than in the memory of each process. The tree is built on first use.
+    """
+
+    def __init__(self, snapshot_level: BoundarySnapshotLevel):
+        self.snapshot_level = snapshot_level
+        self.tree: STRtree | None = None
+
+
+    def __len__(self) -> int:
+        return len(self.snapshot_level)
+
+
+    def get_tree(self) -> STRtree:
+        if self.tree is None:
+            self.tree = STRtree(box(*self.snapshot_level.bounds.T))
+        return self.tree
+
+
+    def match(self, flood_geoms: list[Geometry]) -> dict[str, list[int]]:
+        """
+        @param flood_geoms: the flood geometries to match
+        @return: the code of every boundary which intersects any of the flood geometries, along with the index of
+        every flood geometry it intersects
+        """
+        flood_geoms: np.ndarray = np.array(flood_geoms, dtype=object)
+        flood_indexes, boundary_indexes = self.get_tree().query(flood_geoms)
+        candidates, candidate_indexes = np.unique(boundary_indexes, return_inverse=True)
+        candidate_geoms: np.ndarray = self.snapshot_level.get_geoms(candidates)
+        intersecting: np.ndarray = intersects(flood_geoms[flood_indexes], candidate_geoms[candidate_indexes])
+        candidate_codes: list[str] = self.snapshot_level.get_codes(candidates.tolist())
+        return group_matches(candidate_codes, flood_indexes[intersecting], candidate_indexes[intersecting])
+
+
+class PostcodeBoundaryIndex:
+    """
+    Postcode unit boundaries from a local snapshot, indexed so that the postcodes which intersect a flood can be
+    found in process, without querying Cosmos DB.
+
+    Only the postcodes level of the snapshot is loaded. The tree of the postcodes finds the few boundaries near a
+    flood directly, so the areas and districts would not narrow the search, and are left in the snapshot.
+    """
+
+    def __init__(self, postcodes: BoundaryLevel | MappedBoundaryLevel):
+        self.postcodes = postcodes
+
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict[str, list[dict[str, Any]]]) -> "PostcodeBoundaryIndex":
+        """
+        @param snapshot: a dictionary of the "areas", "districts" and "postcodes" in the snapshot, each a list of
+        dictionaries with its code (under "areaCode", "district" or "postcode") and its geojson "geometry"
+        @return: the snapshot's postcode boundaries, indexed
+        """
+        return cls(BoundaryLevel([document["postcode"] for document in snapshot["postcodes"]],
+                                 [shape(document["geometry"]) for document in snapshot["postcodes"]]))
+
+
+    @classmethod
+    def from_snapshot_file(cls, snapshot: BoundarySnapshot) -> "PostcodeBoundaryIndex":
+        """
+        @param snapshot: a memory-mapped snapshot file
+        @return: the snapshot's postcode boundaries, indexed without copying them out of the snapshot
+        """
+        return cls(MappedBoundaryLevel(snapshot.levels["postcodes"]))
+
+
+    def __repr__(self) -> str:
+        return f"PostcodeBoundaryIndex(postcodes={len(self.postcodes)})"
+
+
+    def match_postcodes(self, flood_geometries: list[Polygon | MultiPolygon | dict]) -> list[dict[str, Any]]:
+        """
+        @param flood_geometries: the geojson geometries of a flood
+        @return: every postcode which intersects any of the flood geometries, tagged with the index of every flood
+        geometry it intersects, as the Cosmos DB matching tags them
+        """
+        matches: dict[str, list[int]] = self.postcodes.match([shape(geometry) for geometry in flood_geometries])
+        return [{"postcode": postcode, "geometries": geometries} for postcode, geometries in matches.items()]
+
+
+def load_postcode_boundary_snapshot(path: str) -> PostcodeBoundaryIndex:
+    """
+    Loads a postcode boundary snapshot, and indexes it. A snapshot file written by boundary_snapshot_service is
+    memory-mapped; any other snapshot is read as JSON.
+
+    @param path: the path of the snapshot
+    @return: the snapshot's boundaries, indexed
+    @throws OSError: if the snapshot could not be read
+    """
+    if is_boundary_snapshot_file(path):
+        index: PostcodeBoundaryIndex = PostcodeBoundaryIndex.from_snapshot_file(BoundarySnapshot(path))
+    else:
+        with open(path, "rb") as snapshot_file:
+            index = PostcodeBoundaryIndex.from_snapshot(json.load(snapshot_file))
+    get_logger().info(f"Loaded postcode boundary snapshot {path}: {index}")
+    return index
+
+
+__postcode_boundary_index: PostcodeBoundaryIndex | None = None
+
+
+def get_postcode_boundary_index() -> PostcodeBoundaryIndex:
+    """
+    Returns the process-wide postcode boundary index, loading it from POSTCODE_BOUNDARY_SNAPSHOT on first use.
+    """
+    global __postcode_boundary_index
+    if __postcode_boundary_index is None:
+        __postcode_boundary_index = load_postcode_boundary_snapshot(postcode_boundary_snapshot)
+    return __postcode_boundary_index
+
+
+async def collect_postcodes_in_flood_range(flood_area_id: str,
+                                           flood_geometries: list[Polygon | MultiPolygon],
+                                           stats: PostcodeMatchStats | None = None,
+                                           index: PostcodeBoundaryIndex | None = None) -> dict[str, Any]:
+    """
+    Gets all postcodes in range of each flood from the local postcode boundary index, in the same form as
+    postcodes_in_flood_range_service.collect_postcodes_in_flood_range gets them from Cosmos DB: each postcode is
+    only given once, for the first geometry it intersects.
+
+    @param flood_area_id: the id of the flood area
+    @param flood_geometries: a list of FloodGeometry objects which make up one entire flood area
+    @param stats: the PostcodeMatchStats of the run to count the matched postcodes in
+    @param index: the PostcodeBoundaryIndex to match against. If left blank, the process-wide index is used.
+    @return: a dictionary which represents the postcodes in range of each flood area
+    """
+    index = index if index is not None else get_postcode_boundary_index()
+    postcodes: list[dict[str, Any]] = await asyncio.to_thread(index.match_postcodes, flood_geometries)
+    flooded_postcodes_results: list[list[dict[str, Any]]] = [[] for _ in flood_geometries]
+    for postcode in postcodes:
+        flooded_postcodes_results[postcode["geometries"][0]].append(postcode)
+    if stats is not None:
+        stats.postcodes_matched += len(postcodes)
+    return {"id": flood_area_id, "floodPostcodes": flooded_postcodes_results}
@@ -1,74 +1,431 @@
 import asyncio
 import re
-from typing import Any
+from typing import Any, AsyncIterator, Callable, Container
 
 from geojson import Polygon, MultiPolygon
 
 from azure.cosmos.aio import CosmosClient
+from azure.cosmos.exceptions import CosmosHttpResponseError
 from azure.core.async_paging import AsyncItemPaged
 
 from app.connections import cosmosdb_client
-from app.cosmos.cosmos_functions import (async_get_shard_keys,
-                                         async_match_area_to_flood_geometry,
-                                         async_match_districts_to_geometry,
-                                         async_match_full_postcode_to_geometry)
+from app.logging.log import get_logger
+from app.models.objects.postcode_shard import PostcodeShard
+from app.services.geometry_subdivision_service import get_geojson_bounds, batch_query_geometries
+from app.cache.shard_map_cache import get_shard_map_cache
+from app.cosmos.cosmos_query_limiter import (get_cosmos_query_limiter,
+                                            AREA_QUERIES,
+                                            DISTRICT_QUERIES,
+                                            POSTCODE_QUERIES)
+from app.cosmos.cosmos_queries import get_geometries_parameters
+from app.cosmos.cosmos_functions import (async_get_any_district,
+                                         async_match_area_codes_to_flood_geometries,
+                                         async_match_district_names_to_geometries,
+                                         async_match_postcodes_to_geometries)
 
 
-async def async_match_postcodes_to_flood_geometry(flood_geometry: dict[str, Any]) -> list[dict[str, Any]]:
+class QueryFanOut:
+    """
+    Runs a tree of queries, each of which may start more queries from its results, and streams the results
+    of the queries at the leaves of the tree to the caller as they arrive.
+
+    Used as an async context manager, so that however the fan-out is left (including while queries are still
+    being started), every query still running is cancelled and waited for.
+    """
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.tasks: set[asyncio.Task] = set()
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.cancel()
+
+
+    async def cancel(self) -> None:
+        """
+        Cancels every query which has not finished, and waits for them to stop.
+        """
+        tasks: set[asyncio.Task] = self.tasks
+        self.tasks = set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+    def start(self, coroutine) -> None:
+        """
+        Starts a query in the fan-out. It may start further queries, and emit results.
+        """
+        task: asyncio.Task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.queue.put_nowait)
+
+
+    def emit(self, results: list[dict[str, Any]]) -> None:
+        self.queue.put_nowait(results)
+
+
+    async def results(self) -> AsyncIterator[list[dict[str, Any]]]:
+        """
+        Yields the results emitted by the queries until every query has finished. If a query fails,
+        every other query is cancelled and its exception is raised.
+        """
+        try:
+            while len(self.tasks) > 0:
+                item = await self.queue.get()
+                if isinstance(item, asyncio.Task):
+                    self.tasks.discard(item)
+                    if not item.cancelled() and item.exception() is not None:
+                        raise item.exception()
+                else:
+                    yield item
+        finally:
+            for task in self.tasks:
+                task.cancel()
+
+
+class PostcodeMatchStats:
+    """
+    Counters of the postcode queries saved, and the duplicate postcodes dropped, by remembering which districts
+    and postcodes have already been matched to each region in a run. Pruned queries are those not made because
+    nobody subscribes to a postcode in the district.
+    """
+
+    def __init__(self):
+        self.postcode_queries = 0
+        self.postcode_queries_skipped = 0
+        self.postcode_queries_pruned = 0
+        self.postcodes_matched = 0
+        self.duplicate_postcodes = 0
+
+
+    def reset(self) -> None:
+        self.__init__()
+
+
+    def get_prune_rate(self) -> float:
+        """
+        @return: the fraction of the districts matched to a flood whose postcode query was pruned
+        """
+        districts: int = self.postcode_queries + self.postcode_queries_skipped + self.postcode_queries_pruned
+        return self.postcode_queries_pruned / districts if districts > 0 else 0.0
+
+
+    def __repr__(self) -> str:
+        return (f"PostcodeMatchStats(postcode_queries={self.postcode_queries}, "
+                f"postcode_queries_skipped={self.postcode_queries_skipped}, "
+                f"postcode_queries_pruned={self.postcode_queries_pruned}, "
+                f"prune_rate={self.get_prune_rate():.2f}, "
+                f"postcodes_matched={self.postcodes_matched}, duplicate_postcodes={self.duplicate_postcodes})")
+
+
+def get_postcode_id(postcode: dict[str, Any]) -> str:
+    return postcode["postcode"]
+
+
+class RegionPostcodes:
+    """
+    The districts and postcodes already matched to one region of a run. Every geometry in a region goes to the
+    same floods, so once one geometry covers a district entirely, no other geometry needs to query that
+    district's postcodes, and a postcode matched by several geometries only needs to be kept once.
+
+    If the subscribed districts are given, the postcodes of any other district are never queried, since nobody
+    there would be notified.
+    """
+
+    def __init__(self, stats: PostcodeMatchStats | None = None, subscribed_districts: Container[str] | None = None):
+        self.covered_districts: set[str] = set()
+        self.postcode_ids: set[str] = set()
+        self.stats = stats if stats is not None else PostcodeMatchStats()
+        self.subscribed_districts = subscribed_districts
+
+
+    def claim_district(self, district_name: str, covered: bool) -> bool:
+        """
+        @param district_name: a district matched to some of the region's geometries
+        @param covered: whether any of those geometries covers the district entirely
+        @return: False if nobody subscribes to a postcode in the district, or if every postcode in the district
+        has already been matched to the region (or is being matched), so the district need not be queried
+        """
+        if self.subscribed_districts is not None and district_name not in self.subscribed_districts:
+            self.stats.postcode_queries_pruned += 1
+            return False
+        if district_name in self.covered_districts:
+            self.stats.postcode_queries_skipped += 1
+            return False
+        if covered:
+            self.covered_districts.add(district_name)
+        self.stats.postcode_queries += 1
+        return True
+
+
+    def add_postcodes(self, postcodes: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """
+        @param postcodes: postcodes matched to some of the region's geometries
+        @return: the postcodes which had not already been matched to the region
+        """
+        new_postcodes: list[dict[str, Any]] = []
+        for postcode in postcodes:
+            postcode_id: str = get_postcode_id(postcode)
+            if postcode_id in self.postcode_ids:
+                self.stats.duplicate_postcodes += 1
+                continue
+            self.postcode_ids.add(postcode_id)
+            new_postcodes.append(postcode)
+        self.stats.postcodes_matched += len(new_postcodes)
+        return new_postcodes
+
+
+async def read_query(level: str, query: Callable[[], AsyncItemPaged[dict[str, Any]]]) -> list[dict[str, Any]]:
+    """
+    Runs a query once the query limiter allows a query at its level, and reads every result.
+    """
+    async with get_cosmos_query_limiter().acquire(level):
+        return [item async for item in query()]
+
+
+class DistrictPartitioning:
+    """
+    Whether the districts of each area are partitioned by area code, as learnt from the district queries.
+
+    An area's districts are assumed to be partitioned by area code until that is known to be wrong: either a
+    query targeted at the area code's partition is rejected, or the partition turns out to hold no districts at
+    all. The partition is only checked once for each area, the first time a targeted query finds no districts,
+    since an area whose edge touches a flood often has no district which does.
+    """
+
+    def __init__(self):
+        self.targeted_areas: set[str] = set()
+        self.cross_partition_areas: set[str] = set()
+
+
+    def is_cross_partition(self, area_code: str) -> bool:
+        return area_code in self.cross_partition_areas
+
+
+    def is_targeted(self, area_code: str) -> bool:
+        return area_code in self.targeted_areas
+
+
+    def set_targeted(self, area_code: str) -> None:
+        self.targeted_areas.add(area_code)
+
+
+    def set_cross_partition(self, area_code: str) -> None:
+        if area_code not in self.cross_partition_areas:
+            self.cross_partition_areas.add(area_code)
+            get_logger().warning(f"Districts in area {area_code} are not partitioned by area code, "
+                                 f"so they will be matched with cross-partition queries")
+
+
+    def reset(self) -> None:
+        self.__init__()
+
+
+    def __repr__(self) -> str:
+        return (f"DistrictPartitioning(targeted_areas={len(self.targeted_areas)}, "
+                f"cross_partition_areas={len(self.cross_partition_areas)})")
+
+
+__district_partitioning: DistrictPartitioning | None = None
+
+
+def get_district_partitioning() -> DistrictPartitioning:
+    """
+    Returns the process-wide record of how each area's districts are partitioned.
+    """
+    global __district_partitioning
+    if __district_partitioning is None:
+        __district_partitioning = DistrictPartitioning()
+    return __district_partitioning
+
+
+async def area_partition_has_districts(client: CosmosClient, area_code: str) -> bool:
+    """
+    @return: True if the area code's partition of the district container holds any district
+    """
+    return len(await read_query(DISTRICT_QUERIES, lambda: async_get_any_district(client, area_code, area_code))) > 0
+
+
+async def read_districts_in_area(client: CosmosClient, area_code: str,
+                                 geometry_parameters: list[dict[str, Any]],
+                                 partitioning: DistrictPartitioning | None = None) -> list[dict[str, Any]]:
+    """
+    Reads every district within an area which intersects with any of the flood geometries, from the area code's
+    partition of the district container rather than from every partition.
+
+    What the targeted query finds is the answer, even if it finds nothing, unless the area's districts are known
+    not to be partitioned by area code (see DistrictPartitioning). They are then read with a cross-partition
+    query, as is every later query for the area.
+
+    @param client: Cosmos DB client
+    @param area_code: the area code, which is also the partition key of the area's districts
+    @param geometry_parameters: parameters which contain each flood geometry
+    @param partitioning: the DistrictPartitioning to learn each area's partitioning in. If left blank, the
+    process-wide one is used.
+    @return: the districts intersecting the flood geometries
+    """
+    partitioning = partitioning if partitioning is not None else get_district_partitioning()
+    if not partitioning.is_cross_partition(area_code):
+        try:
+            districts = await read_query(DISTRICT_QUERIES, lambda: async_match_district_names_to_geometries(
+                client, area_code, geometry_parameters, area_code))
+            if len(districts) > 0 or partitioning.is_targeted(area_code) \
+                    or await area_partition_has_districts(client, area_code):
+                partitioning.set_targeted(area_code)
+                return districts
+        except CosmosHttpResponseError as e:
+            if e.status_code != 400:
+                raise e
+        partitioning.set_cross_partition(area_code)
+    return await read_query(DISTRICT_QUERIES, lambda: async_match_district_names_to_geometries(
+        client, area_code, geometry_parameters))
+
+
+def get_matched_geometries(row: dict[str, Any], geometry_indexes: list[int], tag: str = "geometries") -> list[int]:
+    """
+    @param row: a result of a multi-geometry query
+    @param geometry_indexes: the index of each geometry the query was given
+    @param tag: the array of the row which holds a result for each geometry
+    @return: the index of every geometry the row matched
+    """
+    return [geometry_index for geometry_index, matched in zip(geometry_indexes, row[tag]) if matched]
+
+
+async def stream_postcodes_matching_flood_geometries(flood_geometries: list[dict[str, Any]],
+                                                     region: RegionPostcodes | None = None) \
+        -> AsyncIterator[list[dict[str, Any]]]:
     """
     Asynchronously obtains all areas, then all districts within those areas, and finally
-    all postcodes within those districts which intersect with any given flood geometry.
+    all postcodes within those districts which intersect with any of the given flood geometries.
+    Every match shares the process-wide Cosmos DB client, and shards whose areas cannot intersect a flood
+    geometry are skipped.
+
+    The flood geometries are batched so that each batch is matched with one multi-geometry query at every level,
+    rather than one query for every geometry. Each area is then only queried with the geometries it intersects,
+    and each district with the geometries it intersects.
+
+    Rather than waiting for each query in turn, the cascade fans out: every matched area's districts, and every
+    matched district's postcodes, are queried as soon as they are known, bounded by the query limiter. The
+    postcodes matched in each district are yielded as soon as they arrive.
+
+    Districts already covered entirely by another geometry in the region, or without a subscriber if the region
+    has the subscribed districts, are not queried, and postcodes already matched to the region are dropped as
+    they arrive.
+
+    @param flood_geometries: dictionaries which represent the geometries of the flood
+    @param region: the districts and postcodes already matched to the region the flood geometries belong to.
+    If left blank, only the flood geometries' own duplicates are dropped.
+    @return: an async iterator of lists of dictionaries which represent the postcodes intersecting the flood
+    geometries in each district, each tagged with the index of every flood geometry it intersects
+    """
+    client: CosmosClient = await cosmosdb_client.get_cosmos_client_manager().get_client()
+    region = region if region is not None else RegionPostcodes()
+    exhausted_districts: set[tuple[int, str]] = set()
+
+    def get_parameters(geometry_indexes: list[int]) -> list[dict[str, Any]]:
+        return get_geometries_parameters([flood_geometries[index] for index in geometry_indexes])
+
+    async def match_postcodes(district_name: str, geometry_indexes: list[int]):
+        area_code = re.split(r'(^\D+)', district_name)[1:][0]
+        #Obtains every postcode within the district which intersects with the flood
+        postcodes = await read_query(POSTCODE_QUERIES, lambda: async_match_postcodes_to_geometries(
+            client, area_code, district_name, get_parameters(geometry_indexes)))
+        for postcode in postcodes:
+            postcode["geometries"] = get_matched_geometries(postcode, geometry_indexes)
+        new_postcodes = region.add_postcodes(postcodes)
+        if len(new_postcodes) > 0:
+            fan_out.emit(new_postcodes)
+
+    async def match_districts(batch: int, area_code: str, geometry_indexes: list[int]):
+        #Obtains every district within the area which intersects with the flood
+        districts = await read_districts_in_area(client, area_code, get_parameters(geometry_indexes))
+        for district in districts:
+            district_name = district["district"]
+            #No need to check a district which has already been checked
+            if district_name is not None and (batch, district_name) not in exhausted_districts:
+                exhausted_districts.add((batch, district_name))
+                if region.claim_district(district_name, any(district["covered"])):
+                    fan_out.start(match_postcodes(district_name, get_matched_geometries(district,
+                                                                                        geometry_indexes)))
+
+    async def match_areas(batch: int, shard: PostcodeShard, geometry_indexes: list[int]):
+        #Obtains every area in the shard which intersects with the flood
+        areas = await read_query(AREA_QUERIES, lambda: async_match_area_codes_to_flood_geometries(
+            client, shard.get_database_name(), shard.get_partition_key(), get_parameters(geometry_indexes)))
+        for area in areas:
+            if area["areaCode"] is not None and area["areaCode"] != "":
+                fan_out.start(match_districts(batch, area["areaCode"], get_matched_geometries(area,
+                                                                                              geometry_indexes)))
+
+    async with QueryFanOut() as fan_out:
+        for batch, batch_indexes in enumerate(batch_query_geometries(flood_geometries)):
+            #Obtains every shard from the cached shard map which has an area that could intersect with the flood
+            shard_geometries: dict[str, tuple[PostcodeShard, list[int]]] = {}
+            for index in batch_indexes:
+                for shard in await get_shard_map_cache().get_intersecting_shards(
+                        client, get_geojson_bounds(flood_geometries[index])):
+                    shard_geometries.setdefault(shard.get_database_name(), (shard, []))[1].append(index)
+            for shard, geometry_indexes in shard_geometries.values():
+                fan_out.start(match_areas(batch, shard, geometry_indexes))
+        async for postcodes in fan_out.results():
+            yield postcodes
+
+
+async def stream_postcodes_matching_flood_geometry(flood_geometry: dict[str, Any],
+                                                  region: RegionPostcodes | None = None) \
+        -> AsyncIterator[list[dict[str, Any]]]:
+    """
+    Asynchronously obtains every postcode which intersects with any given flood geometry, as it is matched
+    (see stream_postcodes_matching_flood_geometries).
+
+    @param flood_geometry: a dictionary which represents the geometry of the flood
+    @param region: the districts and postcodes already matched to the region the flood geometry belongs to.
+    @return: an async iterator of lists of dictionaries which represent the postcodes intersecting the flood
+    geometry in each district
+    """
+    async for postcodes in stream_postcodes_matching_flood_geometries([flood_geometry], region):
+        yield postcodes
+
+
+async def async_match_postcodes_to_flood_geometry(flood_geometry: dict[str, Any],
+                                                   region: RegionPostcodes | None = None) -> list[dict[str, Any]]:
+    """
+    Asynchronously obtains every postcode which intersects with any given flood geometry
+    (see stream_postcodes_matching_flood_geometries).
 
     @param flood_geometry: a dictionary which represents the geometry of the flood
+    @param region: the districts and postcodes already matched to the region the flood geometry belongs to
     @return: a list of dictionaries which represent each postcode intersecting the flood geometry
     """
-    geometry_parameters = [dict(name="@geometry", value=flood_geometry)]
     postcode_results = []
-    async with (CosmosClient(cosmosdb_client.cosmos_endpoint, cosmosdb_client.credential) as client):
-
-        #Obtains every shard key from the shard map - the name of each database
-        shard_keys: AsyncItemPaged[dict[str, Any]] = async_get_shard_keys(client)
-        async for shard_key in shard_keys:
-            database_name = shard_key["databaseName"]
-            partition_key = database_name.split("-")[0]
-
-            #Obtains every area which intersects with the flood
-            areas: AsyncItemPaged[dict[str, Any]] = \
-                async_match_area_to_flood_geometry(client, database_name, partition_key, geometry_parameters)
-            async for area in areas:
-                if area["areaCode"] is not None or area["areaCode"] != "":
-                    exhausted_districts: set[str] = set()
-
-                    #Obtains every district within each obtained area which intersects with the flood
-                    districts: AsyncItemPaged[dict[str, Any]] = \
-                        async_match_districts_to_geometry(client, area["areaCode"], geometry_parameters)
-                    async for district in districts:
-                        district_name = district["district"]
-                        #No need to check a district which has already been checked
-                        if district_name is not None and not exhausted_districts.__contains__(district_name):
-                            exhausted_districts.add(district_name)
-                            area_code = re.split(r'(^\D+)', district_name)[1:][0]
-
-                            #Obtains every postcode within each obtained district which intersects with the flood
-                            postcodes: AsyncItemPaged[dict[str, Any]] = \
-                                async_match_full_postcode_to_geometry(client,
-                                                                      area_code,
-                                                                      district_name,
-                                                                      geometry_parameters)
-                            results = [postcode async for postcode in postcodes]
-                            postcode_results.extend(results)
+    async for postcodes in stream_postcodes_matching_flood_geometry(flood_geometry, region):
+        postcode_results.extend(postcodes)
     return postcode_results
 
 
 async def collect_postcodes_in_flood_range(flood_area_id: str,
-                                           flood_geometries: list[Polygon | MultiPolygon]) -> dict[str, Any]:
+                                           flood_geometries: list[Polygon | MultiPolygon],
+                                           stats: PostcodeMatchStats | None = None,
+                                           subscribed_districts: Container[str] | None = None) -> dict[str, Any]:
     """
-    Gets all postcodes in range of each flood
+    Gets all postcodes in range of each flood. The geometries are matched together, in multi-geometry queries,
+    and each postcode is only given once, for the first geometry it was matched to.
 
     @param flood_area_id: the id of the flood area
     @param flood_geometries: a list of FloodGeometry objects which make up one entire flood area
+    @param stats: the PostcodeMatchStats of the run to count the saved queries and dropped duplicates in
+    @param subscribed_districts: the districts with a subscriber. If given, only their postcodes are matched.
     @return: a dictionary which represents the postcodes in range of each flood area
     """
-    flooded_postcodes = [async_match_postcodes_to_flood_geometry(flood_geometry) for flood_geometry in flood_geometries]
-    flooded_postcodes_results: list[list[dict[str, Any]]] = await asyncio.gather(*flooded_postcodes)
-    return {"id": flood_area_id, "floodPostcodes": flooded_postcodes_results}
\ No newline at end of file
+    region: RegionPostcodes = RegionPostcodes(stats, subscribed_districts)
+    flooded_postcodes_results: list[list[dict[str, Any]]] = [[] for _ in flood_geometries]
+    async for postcodes in stream_postcodes_matching_flood_geometries(flood_geometries, region):
+        for postcode in postcodes:
+            flooded_postcodes_results[min(postcode["geometries"])].append(postcode)
+    return {"id": flood_area_id, "floodPostcodes": flooded_postcodes_results}
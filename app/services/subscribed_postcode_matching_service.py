@@ -0,0 +1,398 @@
+import asyncio
+import re
+import time
+from abc import ABC, abstractmethod
+from typing import Any
+
+from azure.cosmos.aio import CosmosClient
+from azure.cosmos.exceptions import CosmosHttpResponseError
+from geojson import Polygon, MultiPolygon
+from shapely import Geometry
+from shapely.geometry import shape
+
+from app.connections.cosmosdb_client import get_cosmos_client_manager
+from app.connections.database_orm import get_session
+from app.cosmos.cosmos_functions import async_get_postcode_geometries_by_postcode
+from app.cosmos.cosmos_query_limiter import POSTCODE_QUERIES
+from app.logging.log import get_logger
+from app.services import local_postcode_matching_service, postcodes_in_flood_range_service
+from app.services.local_postcode_matching_service import BoundaryLevel
+from app.services.postcodes_in_flood_range_service import PostcodeMatchStats, read_query
+from app.services.subscriber_service import get_subscribed_postcodes
+
+POSTCODE_MATCHING_BACKEND_SUBSCRIBED = "subscribed"
+POSTCODE_MATCHING_BACKEND_PRUNED = "pruned"
+SUBSCRIBED_POSTCODE_INDEX_MAX_AGE_SECONDS = 900
+AREA_CODE_PATTERN = re.compile(r"^[A-Z]+")
+
+
+def get_postcode_district(postcode: str) -> str:
+    """
+    @param postcode: a full postcode, with or without the space between its outward and inward codes
+    @return: the postcode's district (its outward code)
+    """
+    postcode = postcode.strip().upper()
+    return postcode.split(" ")[0] if " " in postcode else postcode[:-3]
+
+
+def get_district_area(district: str) -> str | None:
+    """
+    @param district: a postcode district (an outward code)
+    @return: the district's area (the letters it starts with), or None if it has none
+    """
+    area_code = AREA_CODE_PATTERN.match(district)
+    return area_code.group() if area_code is not None else None
+
+
+class SubscribedPostcodesStats:
+    """
+    Counters of the refreshes of a view of the subscribed postcodes. Each view adds counters of its own.
+    """
+
+    def __init__(self):
+        self.refreshes = 0
+        self.failed_refreshes = 0
+
+
+    def reset(self) -> None:
+        self.__init__()
+
+
+    def __repr__(self) -> str:
+        return f"SubscribedPostcodesStats(refreshes={self.refreshes}, failed_refreshes={self.failed_refreshes})"
+
+
+class SubscribedPostcodes(ABC):
+    """
+    Base class of the in-memory views of the postcodes which have a subscriber.
+
+    The subscribed postcodes are read from the postcodes table, and kept for max_age seconds. When they are read
+    again, refresh is given all of them, to bring itself up to date with only what has changed. If they cannot
+    be read, whatever was last read is kept, and the failed refresh is counted in stats. Concurrent callers which
+    ask for it while it is being refreshed all wait for the same refresh.
+    """
+
+    def __init__(self, stats: SubscribedPostcodesStats, max_age: float = SUBSCRIBED_POSTCODE_INDEX_MAX_AGE_SECONDS):
+        self.stats = stats
+        self.max_age = max_age
+        self.loaded = False
+        self.fetched_at = 0.0
+        self.lock: asyncio.Lock | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+
+    def is_fresh(self) -> bool:
+        return self.loaded and time.time() - self.fetched_at < self.max_age
+
+
+    def invalidate(self) -> None:
+        self.fetched_at = 0.0
+
+
+    async def refresh_if_stale(self, client: CosmosClient | None = None) -> None:
+        """
+        Refreshes if the subscribed postcodes have expired.
+
+        @param client: Cosmos DB client. If left blank, the shared client is used.
+        @throws SQLAlchemyError: if the subscribed postcodes could not be read, and they have never been read
+        @throws CosmosHttpResponseError: if the boundaries could not be read, and they have never been read
+        """
+        if self.is_fresh():
+            return
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.is_fresh():
+                return
+            try:
+                subscribed_postcodes: set[str] = await asyncio.to_thread(get_subscribed_postcodes, get_session())
+                await self.refresh(subscribed_postcodes, client)
+            except Exception as e:
+                self.stats.failed_refreshes += 1
+                if not self.loaded:
+                    raise e
+                get_logger().error(f"Could not refresh the subscribed postcodes, so those last read are used: "
+                                   f"{self!r}: {e!r}")
+                self.fetched_at = time.time()
+
+
+    @abstractmethod
+    async def refresh(self, subscribed_postcodes: set[str], client: CosmosClient | None = None) -> None:
+        """
+        Brings the view up to date with the subscribed postcodes.
+
+        @param subscribed_postcodes: every subscribed postcode
+        @param client: Cosmos DB client. If left blank, the shared client is used.
+        """
+
+
+class SubscribedDistrictStats(SubscribedPostcodesStats):
+    """
+    Counters which show how the subscribed districts have changed as subscribers come and go.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.districts = 0
+        self.postcodes = 0
+        self.added = 0
+        self.removed = 0
+
+
+    def __repr__(self) -> str:
+        return (f"SubscribedDistrictStats(refreshes={self.refreshes}, failed_refreshes={self.failed_refreshes}, "
+                f"districts={self.districts}, postcodes={self.postcodes}, added={self.added}, "
+                f"removed={self.removed})")
+
+
+class SubscribedDistricts(SubscribedPostcodes):
+    """
+    The districts with at least one subscribed postcode, along with how many subscribed postcodes each has.
+
+    Only the postcodes are held (a few bytes each), so the set stays small however many subscribers there are,
+    and a district is dropped as soon as its last subscribed postcode is.
+    """
+
+    def __init__(self, max_age: float = SUBSCRIBED_POSTCODE_INDEX_MAX_AGE_SECONDS):
+        super().__init__(SubscribedDistrictStats(), max_age)
+        self.postcodes: set[str] = set()
+        self.districts: dict[str, int] = {}
+
+
+    def __contains__(self, district: object) -> bool:
+        return district in self.districts
+
+
+    def __repr__(self) -> str:
+        return f"SubscribedDistricts(districts={len(self.districts)}, postcodes={len(self.postcodes)})"
+
+
+    async def refresh(self, subscribed_postcodes: set[str], client: CosmosClient | None = None) -> None:
+        """
+        Brings the districts up to date with the subscribed postcodes, counting only the postcodes which were
+        added or removed since the last refresh.
+
+        @param subscribed_postcodes: every subscribed postcode
+        @param client: unused, as nothing is read from Cosmos DB
+        """
+        added: set[str] = subscribed_postcodes - self.postcodes
+        removed: set[str] = self.postcodes - subscribed_postcodes
+        for postcode in added:
+            district: str = get_postcode_district(postcode)
+            self.districts[district] = self.districts.get(district, 0) + 1
+        for postcode in removed:
+            district: str = get_postcode_district(postcode)
+            self.districts[district] -= 1
+            if self.districts[district] == 0:
+                del self.districts[district]
+        self.postcodes = set(subscribed_postcodes)
+        self.loaded = True
+        self.fetched_at = time.time()
+        self.stats.refreshes += 1
+        self.stats.districts = len(self.districts)
+        self.stats.postcodes = len(self.postcodes)
+        self.stats.added += len(added)
+        self.stats.removed += len(removed)
+        get_logger().info(f"Refreshed subscribed districts: {len(added)} postcodes added, {len(removed)} removed, "
+                          f"{self.stats}")
+
+
+class SubscribedPostcodeIndexStats(SubscribedPostcodesStats):
+    """
+    Counters which show how the subscribed postcode index has changed as subscribers come and go.
+    Missing postcodes are subscribed postcodes without a boundary in Cosmos DB, which can never be matched.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.postcodes = 0
+        self.added = 0
+        self.removed = 0
+        self.missing = 0
+
+
+    def __repr__(self) -> str:
+        return (f"SubscribedPostcodeIndexStats(refreshes={self.refreshes}, "
+                f"failed_refreshes={self.failed_refreshes}, postcodes={self.postcodes}, added={self.added}, "
+                f"removed={self.removed}, missing={self.missing})")
+
+
+class SubscribedPostcodeIndex(SubscribedPostcodes):
+    """
+    In-memory spatial index of the boundaries of only those postcodes which have a subscriber.
+
+    Subscribed postcodes are a tiny subset of every postcode in England, so rather than finding every postcode in a
+    flood and then discarding those nobody subscribed to, floods are intersected with this index directly. The
+    work done is then proportional to the number of subscribed postcodes, not to the size of the flood.
+
+    When the subscribed postcodes are read again, only the boundaries of newly subscribed postcodes are read from
+    Cosmos DB, with one query targeted at each of their districts.
+    """
+
+    def __init__(self, max_age: float = SUBSCRIBED_POSTCODE_INDEX_MAX_AGE_SECONDS):
+        super().__init__(SubscribedPostcodeIndexStats(), max_age)
+        self.geoms: dict[str, Geometry] = {}
+        self.missing_postcodes: set[str] = set()
+        self.postcodes: BoundaryLevel | None = None
+
+
+    def __repr__(self) -> str:
+        return f"SubscribedPostcodeIndex(postcodes={len(self.geoms)}, missing={len(self.missing_postcodes)})"
+
+
+    async def refresh(self, subscribed_postcodes: set[str], client: CosmosClient | None = None) -> None:
+        """
+        Brings the index up to date with the subscribed postcodes, reading the boundaries of only those postcodes
+        which are not already in it.
+
+        @param subscribed_postcodes: every subscribed postcode
+        @param client: Cosmos DB client. If left blank, the shared client is used.
+        @throws CosmosHttpResponseError: if the boundaries of a district's postcodes could not be read
+        """
+        removed: set[str] = (set(self.geoms) | self.missing_postcodes) - subscribed_postcodes
+        added: set[str] = subscribed_postcodes - set(self.geoms) - self.missing_postcodes
+        if len(added) > 0:
+            client = client if client is not None else await get_cosmos_client_manager().get_client()
+            districts: dict[str, list[str]] = {}
+            for postcode in added:
+                districts.setdefault(get_postcode_district(postcode), []).append(postcode)
+            district_geometries: list[list[dict[str, Any]]] = await asyncio.gather(
+                *[read_postcode_geometries(client, district, postcodes) for district, postcodes in districts.items()])
+            for geometries in district_geometries:
+                for geometry in geometries:
+                    self.geoms[geometry["postcode"]] = shape(geometry["geometry"])
+            self.missing_postcodes |= added - set(self.geoms)
+        for postcode in removed:
+            self.geoms.pop(postcode, None)
+            self.missing_postcodes.discard(postcode)
+        self.postcodes = BoundaryLevel(list(self.geoms.keys()), list(self.geoms.values()))
+        self.loaded = True
+        self.fetched_at = time.time()
+        self.stats.refreshes += 1
+        self.stats.postcodes = len(self.geoms)
+        self.stats.added += len(added)
+        self.stats.removed += len(removed)
+        self.stats.missing = len(self.missing_postcodes)
+        get_logger().info(f"Refreshed subscribed postcode index: {len(added)} added, {len(removed)} removed, "
+                          f"{self.stats}")
+
+
+    def match_postcodes(self, flood_geometries: list[Polygon | MultiPolygon | dict]) -> list[dict[str, Any]]:
+        """
+        @param flood_geometries: the geojson geometries of a flood
+        @return: every subscribed postcode which intersects any of the flood geometries, tagged with the index of
+        every flood geometry it intersects
+        """
+        if self.postcodes is None or len(self.postcodes) == 0:
+            return []
+        matches: dict[str, list[int]] = self.postcodes.match([shape(geometry) for geometry in flood_geometries])
+        return [{"postcode": postcode, "geometries": geometries} for postcode, geometries in matches.items()]
+
+
+async def read_postcode_geometries(client: CosmosClient, district: str, postcodes: list[str]) -> list[dict[str, Any]]:
+    """
+    Reads the boundaries of some of a district's postcodes. A district whose area has no postcode database is
+    logged, and none of its postcodes are read.
+    """
+    area_code: str | None = get_district_area(district)
+    if area_code is None:
+        get_logger().warning(f"Subscribed postcodes {postcodes} are not in any postcode area")
+        return []
+    try:
+        return await read_query(POSTCODE_QUERIES, lambda: async_get_postcode_geometries_by_postcode(
+            client, area_code, district, postcodes))
+    except CosmosHttpResponseError as e:
+        if e.status_code != 404:
+            raise e
+        get_logger().warning(f"Subscribed postcodes {postcodes} are in area {area_code}, "
+                             f"which has no postcode database: {e.message}")
+        return []
+
+
+__subscribed_postcode_index: SubscribedPostcodeIndex | None = None
+
+
+def get_subscribed_postcode_index() -> SubscribedPostcodeIndex:
+    """
+    Returns the process-wide subscribed postcode index.
+    """
+    global __subscribed_postcode_index
+    if __subscribed_postcode_index is None:
+        __subscribed_postcode_index = SubscribedPostcodeIndex()
+    return __subscribed_postcode_index
+
+
+__subscribed_districts: SubscribedDistricts | None = None
+
+
+def get_subscribed_districts() -> SubscribedDistricts:
+    """
+    Returns the process-wide subscribed districts.
+    """
+    global __subscribed_districts
+    if __subscribed_districts is None:
+        __subscribed_districts = SubscribedDistricts()
+    return __subscribed_districts
+
+
+async def collect_postcodes_in_flood_range(flood_area_id: str,
+                                           flood_geometries: list[Polygon | MultiPolygon],
+                                           stats: PostcodeMatchStats | None = None,
+                                           index: SubscribedPostcodeIndex | None = None) -> dict[str, Any]:
+    """
+    Gets the subscribed postcodes in range of each flood from the subscribed postcode index, in the same form as
+    postcodes_in_flood_range_service.collect_postcodes_in_flood_range gets every postcode from Cosmos DB.
+
+    If the index has never been read, every postcode is matched in Cosmos DB instead, so that subscribers are
+    still notified.
+
+    @param flood_area_id: the id of the flood area
+    @param flood_geometries: a list of FloodGeometry objects which make up one entire flood area
+    @param stats: the PostcodeMatchStats of the run to count the matched postcodes in
+    @param index: the SubscribedPostcodeIndex to match against. If left blank, the process-wide index is used.
+    @return: a dictionary which represents the subscribed postcodes in range of each flood area
+    """
+    index = index if index is not None else get_subscribed_postcode_index()
+    try:
+        await index.refresh_if_stale()
+    except Exception as e:
+        get_logger().error(f"Could not read the subscribed postcode index, so every postcode in flood "
+                           f"{flood_area_id} is matched instead: {e!r}")
+        return await postcodes_in_flood_range_service.collect_postcodes_in_flood_range(flood_area_id,
+                                                                                       flood_geometries, stats)
+    return await local_postcode_matching_service.collect_postcodes_in_flood_range(flood_area_id, flood_geometries,
+                                                                                  stats, index)
+
+
+async def collect_postcodes_in_subscribed_districts(flood_area_id: str,
+                                                    flood_geometries: list[Polygon | MultiPolygon],
+                                                    stats: PostcodeMatchStats | None = None,
+                                                    subscribed_districts: SubscribedDistricts | None = None) \
+        -> dict[str, Any]:
+    """
+    Gets the postcodes in range of each flood from Cosmos DB, as
+    postcodes_in_flood_range_service.collect_postcodes_in_flood_range does, but without querying the postcodes
+    of any district which has no subscriber.
+
+    If the subscribed districts have never been read, every district is queried instead, so that subscribers are
+    still notified.
+
+    @param flood_area_id: the id of the flood area
+    @param flood_geometries: a list of FloodGeometry objects which make up one entire flood area
+    @param stats: the PostcodeMatchStats of the run to count the saved and pruned queries in
+    @param subscribed_districts: the SubscribedDistricts to prune with. If left blank, the process-wide
+    subscribed districts are used.
+    @return: a dictionary which represents the postcodes in range of each flood area
+    """
+    subscribed_districts = subscribed_districts if subscribed_districts is not None else get_subscribed_districts()
+    try:
+        await subscribed_districts.refresh_if_stale()
+    except Exception as e:
+        get_logger().error(f"Could not read the subscribed districts, so every district in flood "
+                           f"{flood_area_id} is matched instead: {e!r}")
+        return await postcodes_in_flood_range_service.collect_postcodes_in_flood_range(flood_area_id,
+                                                                                       flood_geometries, stats)
+    return await postcodes_in_flood_range_service.collect_postcodes_in_flood_range(flood_area_id, flood_geometries,
+                                                                                   stats, subscribed_districts)
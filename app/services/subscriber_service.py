@@ -39,3 +39,17 @@ def get_all_subscribers_by_postcodes(session_maker: sessionmaker, postcodes: set
             time.sleep(5)
     get_logger().error("Attempt limit reached.")
     return subscribers_with_postcodes
+
+
+def get_subscribed_postcodes(session_maker: sessionmaker) -> set[str]:
+    """
+    Retrieves every postcode which at least one subscriber wishes to receive flood updates on
+
+    @param session_maker: the database sessionmaker
+    @return: a set of the distinct subscribed postcodes
+    @throws SQLAlchemyError: if the postcodes could not be retrieved
+    """
+    Session = scoped_session(session_maker)
+    with Session() as session:
+        statement = select(Postcode.postcode).distinct()
+        return {postcode for postcode in session.scalars(statement) if postcode is not None}
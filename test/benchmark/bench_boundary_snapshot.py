@@ -0,0 +1,56 @@
+"""
+Benchmarks loading a postcode boundary snapshot from JSON against mapping the compact snapshot file, and the
+first and later matches against each.
+
+The snapshot is a grid of areas, each a grid of districts, each a grid of postcodes, --grid boundaries a side at
+each level. The flood is --pieces squares scattered over the grid.
+
+Run from the repository root with:
+PYTHONPATH=.:test python test/benchmark/bench_boundary_snapshot.py
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from cosmos_stand_in import box, get_grid_snapshot
+
+from app.services.boundary_snapshot_service import write_boundary_snapshot
+from app.services.local_postcode_matching_service import load_postcode_boundary_snapshot, PostcodeBoundaryIndex
+
+
+def timed(function, *args):
+    start: float = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grid", type=int, default=6)
+    parser.add_argument("--pieces", type=int, default=40)
+    args = parser.parse_args()
+
+    random.seed(0)
+    geometries: list[dict] = [box(x, y, x + 1, y + 1) for x, y in
+                              ((random.uniform(0, 99), random.uniform(0, 99)) for _ in range(args.pieces))]
+    snapshot: dict[str, list[dict]] = get_grid_snapshot((0, 0, 100, 100), args.grid)
+    with tempfile.TemporaryDirectory() as directory:
+        json_path: str = os.path.join(directory, "snapshot.json")
+        file_path: str = os.path.join(directory, "snapshot.bin")
+        with open(json_path, "w") as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        write_boundary_snapshot(file_path, snapshot)
+        print(f"{len(snapshot['postcodes'])} postcodes, {args.pieces} pieces")
+        for name, path in (("json", json_path), ("snapshot file", file_path)):
+            load_ms, index = timed(load_postcode_boundary_snapshot, path)
+            first_ms, postcodes = timed(PostcodeBoundaryIndex.match_postcodes, index, geometries)
+            later_ms, _ = timed(PostcodeBoundaryIndex.match_postcodes, index, geometries)
+            print(f"  {name:14} {os.path.getsize(path) / 2 ** 20:6.1f}MB, load {load_ms:8.1f}ms, "
+                  f"first match {first_ms:7.1f}ms, later matches {later_ms:6.1f}ms, {len(postcodes)} postcodes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmarks matching districts with cross-partition queries (as every district query used to be) against
+matching them with queries targeted at the area code's partition, using the local Cosmos stand-in.
+
+Every area of a grid of --areas areas, each of --districts districts, is matched against a flood which covers
+the whole grid. The stand-in counts the query plans fetched, the partitions touched and its estimate of the
+request charge, and adds --latency seconds to every round trip.
+
+Run from the repository root with:
+PYTHONPATH=.:test python test/benchmark/bench_district_partition_targeting.py
+"""
+import argparse
+import asyncio
+import time
+
+from cosmos_stand_in import CosmosStandIn, StandInStats
+
+from app.cosmos.cosmos_functions import async_match_district_names_to_geometries
+from app.cosmos.cosmos_queries import get_geometries_parameters
+
+
+def square(x: float, y: float, size: float = 1.0) -> dict:
+    return {"type": "Polygon",
+            "coordinates": [[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]]}
+
+
+def get_area_code(area_index: int) -> str:
+    return chr(ord("A") + area_index // 26) + chr(ord("A") + area_index % 26)
+
+
+def get_stand_in(areas: int, districts: int, latency: float) -> CosmosStandIn:
+    stand_in: CosmosStandIn = CosmosStandIn(latency)
+    for area_index in range(areas):
+        area_code: str = get_area_code(area_index)
+        stand_in.add_area(area_code, square(area_index, 0))
+        for district_index in range(districts):
+            stand_in.add_district(area_code, f"{area_code}{district_index + 1}",
+                                  square(area_index + district_index / districts, 0, 1 / districts))
+    return stand_in
+
+
+async def run(stand_in: CosmosStandIn, areas: int, targeted: bool) -> tuple[float, StandInStats, int]:
+    geometry_parameters: list[dict] = get_geometries_parameters([square(0, 0, areas)])
+
+    async def match_districts(area_code: str) -> list[dict]:
+        return [district async for district in async_match_district_names_to_geometries(
+            stand_in, area_code, geometry_parameters, area_code if targeted else None)]
+
+    stand_in.stats.reset()
+    start: float = time.perf_counter()
+    results: list[list[dict]] = await asyncio.gather(*[match_districts(get_area_code(area_index))
+                                                       for area_index in range(areas)])
+    return time.perf_counter() - start, stand_in.stats, sum(len(result) for result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--areas", type=int, default=100)
+    parser.add_argument("--districts", type=int, default=25)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    stand_in: CosmosStandIn = get_stand_in(args.areas, args.districts, args.latency)
+    print(f"{args.areas} areas of {args.districts} districts, {args.latency * 1000:.0f}ms per round trip")
+    for name, targeted in (("cross-partition", False), ("targeted", True)):
+        seconds, stats, districts = asyncio.run(run(stand_in, args.areas, targeted))
+        print(f"  {name:16} {seconds * 1000:7.1f}ms, {stats.queries} queries, {stats.query_plans} query plans, "
+              f"{stats.partitions_touched} partitions touched, {stats.request_charge:.1f} RU, "
+              f"{districts} districts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmarks the previous geometry pipeline, which serialized and deserialized every flood area geometry
+several times, against the single-parse pipeline, on the large feature collection fixtures.
+
+Previous pipeline: json.loads the response body, json.dumps it and geojson.loads it again,
+json.dumps each geometry to measure it, then shapely.from_geojson it, subdivide it recursively, and
+json.loads(shapely.to_geojson(...)) every subdivided polygon.
+Single-parse pipeline: FloodAreaPolygon.from_body, then subdivide_from_feature_collection with the
+serialized size measured from the body.
+
+Both pipelines finish by serializing the resulting geometries the way the Cosmos SDK does, since
+that is where they end up. CPU time and peak traced memory allocation are reported for each fixture.
+
+Run from the repository root with:
+PYTHONPATH=. python test/benchmark/bench_geometry_pipeline.py
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+from geojson import loads
+from shapely import Polygon, to_geojson
+
+from app.cosmos.cosmos_queries import COSMOS_QUERY_CHARACTER_LIMIT, match_areas_to_geometry_query
+from app.models.objects.flood_area_polygon import FloodAreaPolygon
+from app.services.geometry_subdivision_service import (get_geometry_from_geojson,
+                                                       recursive_geometry_subdivision,
+                                                       subdivide_from_feature_collection)
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+THRESHOLD = 0.1
+FIXTURES = ["test_feature_collection_1.json", "test_feature_collection_2.json", "test_feature_collection_3.json"]
+
+
+def previous_pipeline(body: bytes) -> int:
+    feature_collection = loads(json.dumps(json.loads(body)))
+    geometries: list = []
+    for feature in feature_collection.get("features"):
+        feature_geometry = feature.get("geometry")
+        feature_geometry_as_string = json.dumps(feature_geometry)
+        if len(feature_geometry_as_string) + len(match_areas_to_geometry_query()) >= COSMOS_QUERY_CHARACTER_LIMIT:
+            for part in get_geometry_from_geojson(feature_geometry_as_string):
+                if isinstance(part, Polygon):
+                    geometries.extend([json.loads(to_geojson(polygon))
+                                       for polygon in recursive_geometry_subdivision(part, THRESHOLD)])
+        else:
+            geometries.append(feature_geometry)
+    return sum(len(json.dumps(geometry, separators=(",", ":"))) for geometry in geometries)
+
+
+def single_parse_pipeline(body: bytes) -> int:
+    flood_area_polygon: FloodAreaPolygon = FloodAreaPolygon.from_body(body)
+    geometries: list = subdivide_from_feature_collection(flood_area_polygon.get_geojson(), THRESHOLD,
+                                                         flood_area_polygon.get_serialized_size())
+    return sum(len(json.dumps(geometry, separators=(",", ":"))) for geometry in geometries)
+
+
+def measure(pipeline, body: bytes, repeats: int) -> tuple[float, int]:
+    pipeline(body)
+    start = time.process_time()
+    for _ in range(repeats):
+        pipeline(body)
+    cpu_seconds: float = (time.process_time() - start) / repeats
+    tracemalloc.start()
+    pipeline(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    for fixture in FIXTURES:
+        body: bytes = open(root_dir + "/fixtures/" + fixture, "rb").read()
+        previous_cpu, previous_peak = measure(previous_pipeline, body, args.repeats)
+        single_cpu, single_peak = measure(single_parse_pipeline, body, args.repeats)
+        print(f"{fixture} ({len(body)} bytes)")
+        print(f"  previous pipeline:     {previous_cpu * 1000:7.1f}ms CPU, {previous_peak / 1e6:6.1f}MB peak allocated")
+        print(f"  single-parse pipeline: {single_cpu * 1000:7.1f}ms CPU, {single_peak / 1e6:6.1f}MB peak allocated "
+              f"({previous_cpu / single_cpu:.1f}x less CPU, {previous_peak / single_peak:.1f}x less memory)")
+
+
+if __name__ == "__main__":
+    main()
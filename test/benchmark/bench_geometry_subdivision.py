@@ -0,0 +1,79 @@
+"""
+Benchmarks the recursive geometry subdivision (recursive_geometry_subdivision) against the iterative,
+level-at-a-time engine (iterative_geometry_subdivision) on every part of the feature collection fixtures.
+
+For every threshold, the number of pieces each produces is reported, and the iterative engine's pieces
+are checked to be the same as the recursive implementation's and to cover the original geometry.
+
+Run from the repository root with:
+PYTHONPATH=. python test/benchmark/bench_geometry_subdivision.py
+"""
+import argparse
+import json
+import os
+import time
+
+from shapely import Geometry, normalize
+
+from app.services.geometry_subdivision_service import (get_geometry_from_mapping,
+                                                       recursive_geometry_subdivision,
+                                                       iterative_geometry_subdivision,
+                                                       subdivision_covers_geometry)
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+FIXTURES = [f"test_feature_collection_{i}.json" for i in range(1, 6)]
+
+
+def load_parts() -> list[Geometry]:
+    parts: list[Geometry] = []
+    for fixture in FIXTURES:
+        feature_collection: dict = json.loads(open(root_dir + "/fixtures/" + fixture).read())
+        for feature in feature_collection["features"]:
+            parts.extend(get_geometry_from_mapping(feature["geometry"]))
+    return parts
+
+
+def time_subdivision(subdivision, parts: list[Geometry], threshold: float, repeats: int) \
+        -> tuple[float, list[list[Geometry]]]:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        pieces = [subdivision(part, threshold) for part in parts]
+    return (time.perf_counter() - start) / repeats, pieces
+
+
+def same_pieces(pieces: list[Geometry], other_pieces: list[Geometry]) -> bool:
+    unmatched = [normalize(piece) for piece in other_pieces]
+    for piece in pieces:
+        piece = normalize(piece)
+        matches = [other for other in unmatched if piece.equals_exact(other, 1e-12)]
+        if len(matches) == 0:
+            return False
+        unmatched.remove(matches[0])
+    return len(unmatched) == 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.1, 0.05, 0.02])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    parts: list[Geometry] = load_parts()
+    print(f"{len(parts)} polygons from {len(FIXTURES)} fixtures")
+    for threshold in args.thresholds:
+        recursive_seconds, recursive_pieces = time_subdivision(recursive_geometry_subdivision, parts,
+                                                               threshold, args.repeats)
+        iterative_seconds, iterative_pieces = time_subdivision(iterative_geometry_subdivision, parts,
+                                                               threshold, args.repeats)
+        identical: bool = all(same_pieces(recursive, iterative)
+                              for recursive, iterative in zip(recursive_pieces, iterative_pieces))
+        covered: bool = all(subdivision_covers_geometry(part, iterative)
+                            for part, iterative in zip(parts, iterative_pieces))
+        print(f"threshold {threshold}: {sum(len(pieces) for pieces in iterative_pieces)} pieces, "
+              f"same pieces: {identical}, union equals input: {covered}")
+        print(f"  recursive: {recursive_seconds * 1000:7.1f}ms")
+        print(f"  iterative: {iterative_seconds * 1000:7.1f}ms ({recursive_seconds / iterative_seconds:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
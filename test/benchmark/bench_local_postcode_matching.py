@@ -0,0 +1,90 @@
+"""
+Benchmarks matching a flood's geometries against the Cosmos path, using the local Cosmos stand-in, and against
+the in-process STRtree backend, over the same postcode boundaries.
+
+The flood is --pieces squares scattered over a grid of --areas areas, each of 16 districts of 4 postcodes.
+The stand-in adds --latency seconds to every round trip.
+
+Run from the repository root with:
+PYTHONPATH=.:test python test/benchmark/bench_local_postcode_matching.py
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from cosmos_stand_in import CosmosStandIn
+
+from app.connections.cosmosdb_client import get_cosmos_client_manager
+from app.services import local_postcode_matching_service, postcodes_in_flood_range_service
+from app.services.local_postcode_matching_service import PostcodeBoundaryIndex
+
+
+def square(x: float, y: float, size: float = 1.0) -> dict:
+    return {"type": "Polygon",
+            "coordinates": [[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]]}
+
+
+def get_snapshot(areas: int) -> dict[str, list[dict]]:
+    snapshot: dict[str, list[dict]] = {"areas": [], "districts": [], "postcodes": []}
+    for area_index in range(areas):
+        area_code: str = chr(ord("A") + area_index // 26) + chr(ord("A") + area_index % 26)
+        snapshot["areas"].append({"areaCode": area_code, "geometry": square(area_index * 4, 0, 4)})
+        for district_index in range(16):
+            district: str = f"{area_code}{district_index + 1}"
+            x, y = area_index * 4 + district_index % 4, district_index // 4
+            snapshot["districts"].append({"district": district, "areaCode": area_code, "geometry": square(x, y)})
+            for postcode_index in range(4):
+                snapshot["postcodes"].append({"postcode": f"{district} {postcode_index + 1}AA",
+                                              "district": district, "areaCode": area_code,
+                                              "geometry": square(x + postcode_index % 2 / 2,
+                                                                 y + postcode_index // 2 / 2, 0.5)})
+    return snapshot
+
+
+def get_stand_in(snapshot: dict[str, list[dict]], latency: float) -> CosmosStandIn:
+    stand_in: CosmosStandIn = CosmosStandIn(latency)
+    stand_in.add_snapshot(snapshot)
+    return stand_in
+
+
+async def run_cosmos(stand_in: CosmosStandIn, geometries: list[dict]) -> tuple[float, int]:
+    manager = get_cosmos_client_manager()
+    manager.client, manager.loop = stand_in, asyncio.get_running_loop()
+    await postcodes_in_flood_range_service.collect_postcodes_in_flood_range("warm-up", [square(-10, -10)])
+    start: float = time.perf_counter()
+    flood_postcodes = await postcodes_in_flood_range_service.collect_postcodes_in_flood_range("flood", geometries)
+    manager.client = None
+    return time.perf_counter() - start, sum(len(postcodes) for postcodes in flood_postcodes["floodPostcodes"])
+
+
+async def run_local(index: PostcodeBoundaryIndex, geometries: list[dict]) -> tuple[float, int]:
+    start: float = time.perf_counter()
+    flood_postcodes = await local_postcode_matching_service.collect_postcodes_in_flood_range("flood", geometries,
+                                                                                             index=index)
+    return time.perf_counter() - start, sum(len(postcodes) for postcodes in flood_postcodes["floodPostcodes"])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--areas", type=int, default=8)
+    parser.add_argument("--pieces", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    random.seed(0)
+    geometries: list[dict] = [square(random.uniform(0, args.areas * 4 - 0.5), random.uniform(0, 3.5), 0.5)
+                              for _ in range(args.pieces)]
+    snapshot: dict[str, list[dict]] = get_snapshot(args.areas)
+    print(f"{args.pieces} pieces over {args.areas} areas, {args.latency * 1000:.0f}ms per round trip")
+    seconds, postcodes = asyncio.run(run_cosmos(get_stand_in(snapshot, args.latency), geometries))
+    print(f"  {'cosmos':14} {seconds * 1000:7.1f}ms, {postcodes} postcodes")
+    start: float = time.perf_counter()
+    index: PostcodeBoundaryIndex = PostcodeBoundaryIndex.from_snapshot(snapshot)
+    print(f"  {'local (index)':14} {(time.perf_counter() - start) * 1000:7.1f}ms to build {index}")
+    seconds, postcodes = asyncio.run(run_local(index, geometries))
+    print(f"  {'local':14} {seconds * 1000:7.1f}ms, {postcodes} postcodes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmarks matching a flood's geometries with one query for every geometry at every level against matching them
+together in multi-geometry queries, using the local Cosmos stand-in.
+
+The flood is --pieces squares scattered over a grid of --areas areas, each of 16 districts of 4 postcodes.
+The stand-in counts the queries made and its estimate of the request charge, and adds --latency seconds to every
+round trip.
+
+Run from the repository root with:
+PYTHONPATH=.:test python test/benchmark/bench_multi_geometry_queries.py
+"""
+import argparse
+import asyncio
+import random
+import time
+from functools import partial
+from unittest.mock import patch
+
+from cosmos_stand_in import CosmosStandIn, StandInStats
+
+from app.connections.cosmosdb_client import get_cosmos_client_manager
+from app.services import postcodes_in_flood_range_service
+from app.services.geometry_subdivision_service import batch_query_geometries, MAX_GEOMETRIES_PER_QUERY
+from app.services.postcodes_in_flood_range_service import collect_postcodes_in_flood_range
+
+
+def square(x: float, y: float, size: float = 1.0) -> dict:
+    return {"type": "Polygon",
+            "coordinates": [[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]]}
+
+
+def get_stand_in(areas: int, latency: float) -> CosmosStandIn:
+    stand_in: CosmosStandIn = CosmosStandIn(latency)
+    for area_index in range(areas):
+        area_code: str = chr(ord("A") + area_index // 26) + chr(ord("A") + area_index % 26)
+        stand_in.add_area(area_code, square(area_index * 4, 0, 4))
+        for district_index in range(16):
+            district: str = f"{area_code}{district_index + 1}"
+            x, y = area_index * 4 + district_index % 4, district_index // 4
+            stand_in.add_district(area_code, district, square(x, y))
+            for postcode_index in range(4):
+                stand_in.add_postcode(area_code, district, f"{district} {postcode_index + 1}AA",
+                                      square(x + postcode_index % 2 / 2, y + postcode_index // 2 / 2, 0.5))
+    return stand_in
+
+
+async def run(stand_in: CosmosStandIn, geometries: list[dict], max_geometries: int) \
+        -> tuple[float, StandInStats, int]:
+    manager = get_cosmos_client_manager()
+    manager.client, manager.loop = stand_in, asyncio.get_running_loop()
+    await collect_postcodes_in_flood_range("warm-up", [square(-10, -10)])
+    stand_in.stats.reset()
+    with patch.object(postcodes_in_flood_range_service, "batch_query_geometries",
+                      side_effect=partial(batch_query_geometries, max_geometries=max_geometries)):
+        start: float = time.perf_counter()
+        flood_postcodes = await collect_postcodes_in_flood_range("flood", geometries)
+    manager.client = None
+    return (time.perf_counter() - start, stand_in.stats,
+            sum(len(postcodes) for postcodes in flood_postcodes["floodPostcodes"]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--areas", type=int, default=8)
+    parser.add_argument("--pieces", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    random.seed(0)
+    geometries: list[dict] = [square(random.uniform(0, args.areas * 4 - 0.5), random.uniform(0, 3.5), 0.5)
+                              for _ in range(args.pieces)]
+    stand_in: CosmosStandIn = get_stand_in(args.areas, args.latency)
+    print(f"{args.pieces} pieces over {args.areas} areas, {args.latency * 1000:.0f}ms per round trip")
+    for name, max_geometries in (("one per query", 1), ("batched", MAX_GEOMETRIES_PER_QUERY)):
+        seconds, stats, postcodes = asyncio.run(run(stand_in, geometries, max_geometries))
+        print(f"  {name:14} {seconds * 1000:7.1f}ms, {stats.queries} queries, {stats.request_charge:.1f} RU, "
+              f"{stats.bytes_returned} bytes returned, {postcodes} postcodes")
+
+
+if __name__ == "__main__":
+    main()
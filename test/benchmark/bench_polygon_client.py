@@ -0,0 +1,90 @@
+"""
+Benchmarks downloading flood area polygons serially with requests (the previous behaviour of
+get_geojson_from_floods) against the pooled, concurrent PolygonClient.
+
+Both are run against a local stub HTTP server which adds a fixed latency to every response,
+so no requests are made to the Environmental Agency API.
+
+Run from the repository root with:
+PYTHONPATH=. python test/benchmark/bench_polygon_client.py
+"""
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+import requests
+from aiohttp import web
+from geojson import loads
+
+from app.connections.polygon_client import PolygonClient
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def start_stub_server(body: bytes, latency: float) -> tuple[str, asyncio.AbstractEventLoop]:
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    address: list[str] = []
+
+    async def polygon_handler(request: web.Request) -> web.Response:
+        await asyncio.sleep(latency)
+        return web.Response(body=body, content_type="application/json")
+
+    async def serve():
+        app = web.Application()
+        app.router.add_get("/floodAreas/{id}/polygon", polygon_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        address.append(f"http://127.0.0.1:{runner.addresses[0][1]}")
+        started.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(serve())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return address[0], loop
+
+
+def serial_fetch(urls: list[str]) -> float:
+    start = time.perf_counter()
+    for url in urls:
+        response = requests.get(url)
+        response.raise_for_status()
+        loads(response.text)
+    return time.perf_counter() - start
+
+
+async def pooled_fetch(urls: list[str]) -> float:
+    start = time.perf_counter()
+    async with PolygonClient() as client:
+        await client.get_polygons(urls)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--floods", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--fixture", default="test_feature_collection_4.json")
+    args = parser.parse_args()
+
+    body = open(root_dir + "/fixtures/" + args.fixture, "rb").read()
+    base_url, _ = start_stub_server(body, args.latency)
+    urls = [f"{base_url}/floodAreas/{i}/polygon" for i in range(args.floods)]
+
+    serial_seconds = serial_fetch(urls)
+    pooled_seconds = asyncio.run(pooled_fetch(urls))
+    print(f"{args.floods} polygons of {len(body)} bytes, {args.latency * 1000:.0f}ms server latency")
+    print(f"serial requests.get: {serial_seconds:.2f}s")
+    print(f"PolygonClient:       {pooled_seconds:.2f}s ({serial_seconds / pooled_seconds:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmarks subdividing a run's worth of flood geometries in the event loop against subdividing them in the
+subdivision process pool.
+
+Every fixture is subdivided --copies times, as a run with that many large floods would. Alongside the wall
+clock time, the longest the event loop went without running a ticker task is reported: this is how long
+Cosmos queries for other floods would have been stalled.
+
+Run from the repository root with:
+PYTHONPATH=. python test/benchmark/bench_subdivision_pool.py
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.models.objects.flood_area_polygon import FloodAreaPolygon
+from app.services.geometry_subdivision_service import subdivide_in_executor, subdivide_from_feature_collection
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+THRESHOLD = 0.1
+FIXTURES = [f"test_feature_collection_{i}.json" for i in range(1, 6)]
+
+
+async def longest_stall(done: asyncio.Event) -> float:
+    longest: float = 0.0
+    last_tick: float = time.perf_counter()
+    while not done.is_set():
+        await asyncio.sleep(0.001)
+        now: float = time.perf_counter()
+        longest = max(longest, now - last_tick)
+        last_tick = now
+    return longest
+
+
+async def in_event_loop(flood_area_polygon: FloodAreaPolygon) -> list:
+    return subdivide_from_feature_collection(flood_area_polygon.get_geojson(), THRESHOLD,
+                                             flood_area_polygon.get_serialized_size())
+
+
+async def run(subdivision, flood_area_polygons: list[FloodAreaPolygon]) -> tuple[float, float, int]:
+    done: asyncio.Event = asyncio.Event()
+    ticker: asyncio.Task = asyncio.create_task(longest_stall(done))
+    await asyncio.sleep(0)
+    start: float = time.perf_counter()
+    results: list = await asyncio.gather(*[subdivision(flood_area_polygon)
+                                           for flood_area_polygon in flood_area_polygons])
+    elapsed: float = time.perf_counter() - start
+    done.set()
+    return elapsed, await ticker, sum(len(result) for result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--copies", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    flood_area_polygons: list[FloodAreaPolygon] = [
+        FloodAreaPolygon.from_body(open(root_dir + "/fixtures/" + fixture, "rb").read())
+        for fixture in FIXTURES for _ in range(args.copies)]
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+
+        async def in_process_pool(flood_area_polygon: FloodAreaPolygon) -> list:
+            geometries, _ = await subdivide_in_executor(flood_area_polygon.get_geojson(), THRESHOLD,
+                                                        flood_area_polygon.get_serialized_size(), executor)
+            return geometries
+
+        asyncio.run(run(in_process_pool, flood_area_polygons[:args.workers]))
+        loop_seconds, loop_stall, loop_pieces = asyncio.run(run(in_event_loop, flood_area_polygons))
+        pool_seconds, pool_stall, pool_pieces = asyncio.run(run(in_process_pool, flood_area_polygons))
+    print(f"{len(flood_area_polygons)} floods, {args.workers} workers")
+    print(f"  event loop:   {loop_seconds * 1000:7.1f}ms, longest stall {loop_stall * 1000:7.1f}ms, "
+          f"{loop_pieces} pieces")
+    print(f"  process pool: {pool_seconds * 1000:7.1f}ms, longest stall {pool_stall * 1000:7.1f}ms, "
+          f"{pool_pieces} pieces")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmarks the Cosmos path with and without pruning the districts nobody subscribes to, using the local Cosmos
+stand-in.
+
+The flood covers the whole of a grid of 16 areas, each of 16 districts of 16 postcodes, and --subscribed of the
+districts have a subscriber. The stand-in adds --latency seconds to every round trip.
+
+Run from the repository root with:
+PYTHONPATH=.:test python test/benchmark/bench_subscribed_district_pruning.py
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from cosmos_stand_in import CosmosStandIn, box, get_grid_snapshot
+
+from app.connections.cosmosdb_client import get_cosmos_client_manager
+from app.services import postcodes_in_flood_range_service
+from app.services.postcodes_in_flood_range_service import PostcodeMatchStats
+
+
+async def run(stand_in: CosmosStandIn, geometries: list[dict], subscribed_districts: set[str] | None) \
+        -> tuple[float, int, PostcodeMatchStats]:
+    manager = get_cosmos_client_manager()
+    manager.client, manager.loop = stand_in, asyncio.get_running_loop()
+    await postcodes_in_flood_range_service.collect_postcodes_in_flood_range("warm-up", [box(-10, -10, -9, -9)])
+    stand_in.stats.reset()
+    stats: PostcodeMatchStats = PostcodeMatchStats()
+    start: float = time.perf_counter()
+    flood_postcodes = await postcodes_in_flood_range_service.collect_postcodes_in_flood_range(
+        "flood", geometries, stats, subscribed_districts)
+    manager.client = None
+    return (time.perf_counter() - start, sum(len(postcodes) for postcodes in flood_postcodes["floodPostcodes"]),
+            stats)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribed", type=float, default=0.1)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    random.seed(0)
+    snapshot: dict[str, list[dict]] = get_grid_snapshot((0, 0, 16, 16))
+    districts: list[str] = [district["district"] for district in snapshot["districts"]]
+    subscribed_districts: set[str] = set(random.sample(districts, max(1, int(len(districts) * args.subscribed))))
+    geometries: list[dict] = [box(0.01, 0.01, 15.99, 15.99)]
+    print(f"{len(districts)} districts, {len(subscribed_districts)} with a subscriber, "
+          f"{args.latency * 1000:.0f}ms per round trip")
+    for name, districts_to_match in (("every district", None), ("pruned", subscribed_districts)):
+        stand_in: CosmosStandIn = CosmosStandIn(args.latency)
+        stand_in.add_snapshot(snapshot)
+        seconds, postcodes, stats = asyncio.run(run(stand_in, geometries, districts_to_match))
+        print(f"  {name:14} {seconds * 1000:7.1f}ms, {postcodes} postcodes, {stand_in.stats.queries} queries, "
+              f"{stand_in.stats.request_charge:.0f} RU, prune rate {stats.get_prune_rate():.2f}")
+
+
+if __name__ == "__main__":
+    main()
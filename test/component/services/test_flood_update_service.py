@@ -7,6 +7,7 @@ from unittest.async_case import IsolatedAsyncioTestCase
 from geojson import Polygon, MultiPolygon, FeatureCollection
 from shapely import Geometry
 from shapely import intersects
+from shapely.geometry import shape
 
 from redis.exceptions import ConnectionError
 
@@ -14,8 +15,11 @@ from app.models.objects.floods_with_postcodes import FloodWithPostcodes
 from app.models.pydantic_models.flood_warning import FloodWarning
 from app.models.pydantic_models.latest_flood_update import LatestFloodUpdate
 from app.cache.caching_functions import redis
+from app.connections.cosmosdb_client import get_cosmos_client_manager
+from app.cosmos.cosmos_functions import async_get_postcode_geometries_by_postcode
 from app.services.flood_update_service import get_all_postcodes_in_flood_range, process_flood_updates
 from app.services.geometry_subdivision_service import get_geometry_from_geojson
+from app.services.subscribed_postcode_matching_service import get_postcode_district, get_district_area
 
 from app.utilities.utilities import flat_map
 
@@ -26,6 +30,22 @@ logger = logging.getLogger(__name__)
 root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
 
 
+async def get_postcode_geometries(postcode_ids: list[str]) -> dict[str, dict]:
+    """
+    @return: the geojson geometry of each of the postcodes, read from Cosmos DB
+    """
+    client = await get_cosmos_client_manager().get_client()
+    districts: dict[str, list[str]] = {}
+    for postcode_id in postcode_ids:
+        districts.setdefault(get_postcode_district(postcode_id), []).append(postcode_id)
+    postcode_geometries: dict[str, dict] = {}
+    for district, postcodes in districts.items():
+        async for postcode in async_get_postcode_geometries_by_postcode(client, get_district_area(district),
+                                                                        district, postcodes):
+            postcode_geometries[postcode["postcode"]] = postcode["geometry"]
+    return postcode_geometries
+
+
 class FloodToPostcodeServiceTests(IsolatedAsyncioTestCase):
 
 
@@ -72,7 +92,7 @@ class FloodToPostcodeServiceTests(IsolatedAsyncioTestCase):
         return has_intersection
 
 
-    async def test_get_all_flood_postcode_geometries(self):
+    async def test_get_all_flood_postcodes(self):
         test_floods_with_areas: dict = (
             json.loads(open(root_dir + "/fixtures/test_floods_with_flood_area_geojson.json").read()))
         floods: list[dict] = test_floods_with_areas.get("items")
@@ -81,21 +101,25 @@ class FloodToPostcodeServiceTests(IsolatedAsyncioTestCase):
         floods_as_objects: list[FloodWarning] = [FloodWarning(**flood_warning) for flood_warning in floods]
         floods_with_postcodes: list[dict[str, str | list[Polygon | MultiPolygon]]] \
             = await get_all_postcodes_in_flood_range(floods_as_objects)
-        for flood in floods:
-            flood_geojson = flood["floodAreaGeoJson"]
-            assert isinstance(flood_geojson, dict)
-            flood_geometry_json = flood_geojson["features"][0]["geometry"]
-            flood_geometry = get_geometry_from_geojson(json.dumps(flood_geometry_json))
-            for flood_with_postcodes in floods_with_postcodes:
-                postcodes = flat_map(lambda f: f, flood_with_postcodes["floodPostcodes"])
-                for postcode in postcodes:
-                    postcode_geometry_json = postcode["features"][0]["geometry"]
-                    assert isinstance(postcode_geometry_json, dict)
-                    if isinstance(flood_geometry, MultiPolygon):
-                        assert self.verify_multipolygon_geometries_intersect_from_dict(flood_geometry,
-                                                                                       postcode_geometry_json)
-                    if isinstance(flood_geometry[0], Polygon):
-                        self.verify_polygon_geometries_intersect(flood_geometry, postcode_geometry_json)
+        assert {flood_with_postcodes["id"] for flood_with_postcodes in floods_with_postcodes} == \
+               {flood.floodAreaID for flood in floods_as_objects}
+        flood_geometries: dict[str, list[Geometry]] = {
+            flood.floodAreaID: flat_map(lambda feature: get_geometry_from_geojson(json.dumps(feature["geometry"])),
+                                        flood.floodAreaGeoJson["features"])
+            for flood in floods_as_objects}
+        for flood_with_postcodes in floods_with_postcodes:
+            postcodes = flat_map(lambda f: f, flood_with_postcodes["floodPostcodes"])
+            postcode_ids: list[str] = [postcode["postcode"] for postcode in postcodes]
+            # only identifiers are matched, and each postcode only once for each flood
+            assert all(isinstance(postcode_id, str) for postcode_id in postcode_ids)
+            assert len(postcode_ids) == len(set(postcode_ids))
+            # every postcode matched to a flood intersects the flood's area
+            postcode_geometries: dict[str, dict] = await get_postcode_geometries(postcode_ids)
+            assert set(postcode_geometries) == set(postcode_ids)
+            for postcode_id in postcode_ids:
+                postcode_geometry: Geometry = shape(postcode_geometries[postcode_id])
+                assert any(intersects(postcode_geometry, flood_geometry)
+                           for flood_geometry in flood_geometries[flood_with_postcodes["id"]])
 
 
     async def test_process_flood_update(self):
@@ -8,14 +8,33 @@ from geojson.geometry import Polygon as GeoPolygon
 from geojson.geometry import MultiPolygon as GeoMultiPolygon
 from shapely import Geometry, Polygon, intersects
 
+from app.connections.cosmosdb_client import get_cosmos_client_manager
+from app.cosmos.cosmos_functions import async_get_postcode_geometries_by_postcode
 from app.services.postcodes_in_flood_range_service import collect_postcodes_in_flood_range
 from app.services.geometry_subdivision_service import get_geometry_from_geojson
+from app.services.subscribed_postcode_matching_service import get_postcode_district, get_district_area
 
 root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
 
 relevant_polygon_areas = ["PR"]
 relevant_multipolygon_areas = ["DL", "HG", "LA"]
 
+async def get_postcode_geometries(postcode_ids: list[str]) -> dict[str, dict]:
+    """
+    @return: the geojson geometry of each of the postcodes, read from Cosmos DB
+    """
+    client = await get_cosmos_client_manager().get_client()
+    districts: dict[str, list[str]] = {}
+    for postcode_id in postcode_ids:
+        districts.setdefault(get_postcode_district(postcode_id), []).append(postcode_id)
+    postcode_geometries: dict[str, dict] = {}
+    for district, postcodes in districts.items():
+        async for postcode in async_get_postcode_geometries_by_postcode(client, get_district_area(district),
+                                                                        district, postcodes):
+            postcode_geometries[postcode["postcode"]] = postcode["geometry"]
+    return postcode_geometries
+
+
 class FloodToPostcodeOperationsTests(IsolatedAsyncioTestCase):
 
 
@@ -81,13 +100,21 @@ class FloodToPostcodeOperationsTests(IsolatedAsyncioTestCase):
             assert isinstance(flood_with_postcodes, dict)
             assert flood_with_postcodes["id"] == flood_area_id
             postcode_list: list[list[dict[str, Any]]] = flood_with_postcodes["floodPostcodes"]
+            assert len(postcode_list) == len(flood_geometries)
+            postcode_ids: list[str] = []
             for postcodes in postcode_list:
                 for postcode in postcodes:
                     assert isinstance(postcode, dict)
-                    geometry = postcode["features"][0]["geometry"]
-                    for geom in flood_geometries:
-                        assert isinstance(geom, Iterable)
-                        assert self.verify_multipolygon_geometries_intersect_from_dict(geom, geometry)
+                    assert isinstance(postcode["postcode"], str)
+                    postcode_ids.append(postcode["postcode"])
+            assert len(postcode_ids) == len(set(postcode_ids))
+            # every postcode matched to a flood geometry intersects it
+            postcode_geometries: dict[str, dict] = await get_postcode_geometries(postcode_ids)
+            assert set(postcode_geometries) == set(postcode_ids)
+            for flood_geometry, postcodes in zip(flood_geometries, postcode_list):
+                for postcode in postcodes:
+                    assert self.verify_multipolygon_geometries_intersect_from_dict(
+                        flood_geometry, postcode_geometries[postcode["postcode"]])
 
 
 if __name__ == '__main__':
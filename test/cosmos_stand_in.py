@@ -0,0 +1,335 @@
+"""
+A local stand-in for the sharded postcode Cosmos DB databases, for the tests and benchmarks which cannot
+reach Cosmos DB.
+
+CosmosStandIn answers query_items the way the Cosmos DB async client does, for the queries in
+app/cosmos/cosmos_queries.py: the join, where clause and select list (along with any TOP) are evaluated against
+every document, with ST_INTERSECTS and ST_WITHIN against the geometry parameters evaluated with shapely. Every
+query is counted, along with the partitions it touched, the documents it returned and an estimate of its request
+charge, and an optional latency can be added to every query so that concurrency can be measured.
+
+The request charge is a rough model rather than Cosmos DB's own: a fixed charge for every partition a query
+touches, plus a charge for every document it evaluates, for every spatial function it evaluates and for every
+KB it returns. A cross-partition query (one without a partition key) first fetches a query plan, which costs it
+another round trip.
+"""
+import asyncio
+import json
+import re
+from typing import Any, AsyncIterator
+
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from shapely import Geometry, intersects, within
+from shapely.geometry import shape
+
+from app.env_vars import (shard_map_database, shard_map_container, postcode_database_suffix,
+                          area_container_suffix, district_container_suffix, full_postcode_container_suffix)
+
+PARTITION_CHARGE = 2.5
+DOCUMENT_CHARGE = 0.05
+SPATIAL_CHARGE = 0.02
+KB_CHARGE = 1.0
+PARTITION_FIELD = "_partition"
+DOCUMENT_GEOMETRY = "c.features[0].geometry"
+QUERY_PATTERN = re.compile(r"^\s*select\s+(?P<select>.*?)\s+from\s+c\b(?P<join>.*?)(?:\bwhere\s+(?P<where>.*))?$",
+                           re.IGNORECASE | re.DOTALL)
+TOP_PATTERN = re.compile(r"^\s*top\s+(?P<count>\d+)\s+(?P<select>.*)$", re.IGNORECASE | re.DOTALL)
+JOIN_PATTERN = re.compile(r"^\s*join\s*\(\s*select\s+value\s+(?P<expression>.*)\)\s*(?P<alias>\w+)\s*$",
+                          re.IGNORECASE | re.DOTALL)
+FUNCTION_PATTERN = re.compile(r"^(?P<name>\w+)\((?P<arguments>.*)\)$", re.DOTALL)
+SPATIAL_FUNCTIONS = {"ST_WITHIN": within, "ST_INTERSECTS": intersects}
+
+
+class StandInStats:
+    """
+    Counters of the work done by every query made against the stand-in.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.queries_by_container: dict[str, int] = {}
+        self.partitions_touched = 0
+        self.query_plans = 0
+        self.spatial_evaluations = 0
+        self.documents_returned = 0
+        self.bytes_returned = 0
+        self.request_charge = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+    def reset(self) -> None:
+        self.__init__()
+
+
+    def __repr__(self) -> str:
+        return (f"StandInStats(queries={self.queries}, query_plans={self.query_plans}, "
+                f"partitions_touched={self.partitions_touched}, "
+                f"documents_returned={self.documents_returned}, bytes_returned={self.bytes_returned}, "
+                f"request_charge={self.request_charge:.1f}, max_in_flight={self.max_in_flight})")
+
+
+def get_path(document: dict, path: str) -> Any:
+    value: Any = document
+    for key in re.findall(r"[^.\[\]]+", path):
+        if value is None:
+            return None
+        value = value[int(key)] if isinstance(value, list) else value.get(key)
+    return value
+
+
+def split_top_level(text: str) -> list[str]:
+    """
+    Splits a list of expressions on the commas which are not inside brackets.
+    """
+    items: list[str] = []
+    depth: int = 0
+    item_start: int = 0
+    for position, character in enumerate(text):
+        if character in "([":
+            depth += 1
+        elif character in ")]":
+            depth -= 1
+        elif character == "," and depth == 0:
+            items.append(text[item_start:position].strip())
+            item_start = position + 1
+    items.append(text[item_start:].strip())
+    return [item for item in items if item != ""]
+
+
+class Evaluation:
+    """
+    Evaluates the expressions of a query against one document: document paths, parameters, the array,
+    ARRAY_CONTAINS and spatial functions the queries use, and the value bound by a join.
+    """
+
+    def __init__(self, document: dict, geom: Geometry | None, parameter_geoms: dict[str, Geometry],
+                 stats: StandInStats, parameter_values: dict[str, Any] | None = None):
+        self.document = document
+        self.geom = geom
+        self.parameter_geoms = parameter_geoms
+        self.parameter_values = parameter_values or {}
+        self.stats = stats
+        self.bindings: dict[str, Any] = {}
+
+
+    def get_geom(self, argument: str) -> Geometry | None:
+        if argument == DOCUMENT_GEOMETRY:
+            return self.geom
+        return self.parameter_geoms.get(argument)
+
+
+    def evaluate(self, expression: str) -> Any:
+        expression = expression.strip()
+        if expression.startswith("[") and expression.endswith("]"):
+            return [self.evaluate(item) for item in split_top_level(expression[1:-1])]
+        if expression.lower() in ("true", "false"):
+            return expression.lower() == "true"
+        if expression in self.bindings:
+            return self.bindings[expression]
+        if expression in self.parameter_values:
+            return self.parameter_values[expression]
+        function = FUNCTION_PATTERN.match(expression)
+        if function is not None:
+            name: str = function.group("name").upper()
+            arguments: list[str] = split_top_level(function.group("arguments"))
+            if name in SPATIAL_FUNCTIONS:
+                self.stats.spatial_evaluations += 1
+                first, second = (self.get_geom(argument) for argument in arguments)
+                return first is not None and second is not None and bool(SPATIAL_FUNCTIONS[name](first, second))
+            if name == "ARRAY_CONTAINS":
+                return self.evaluate(arguments[1]) in self.evaluate(arguments[0])
+            raise ValueError(f"The stand-in does not support {name}")
+        if "=" in expression:
+            left, right = expression.split("=", 1)
+            return self.evaluate(left) == self.evaluate(right)
+        return get_path(self.document, expression.removeprefix("c."))
+
+
+def project(evaluation: Evaluation, select: str) -> dict:
+    if select.strip() == "*":
+        return {key: value for key, value in evaluation.document.items() if key != PARTITION_FIELD}
+    projection: dict = {}
+    for item in split_top_level(select):
+        expression, _, alias = item.rpartition(" as ") if " as " in item else (item, "", "")
+        alias = alias.strip() or re.findall(r"[^.\[\]]+", expression.strip())[-1]
+        projection[alias] = evaluation.evaluate(expression)
+    return projection
+
+
+class StandInContainer:
+
+
+    def __init__(self, name: str, stats: StandInStats, latency: float = 0.0):
+        self.name = name
+        self.stats = stats
+        self.latency = latency
+        self.documents: list[dict] = []
+        self.geoms: list[Geometry | None] = []
+
+
+    def add(self, document: dict, partition: str) -> None:
+        self.documents.append({**document, PARTITION_FIELD: partition})
+        geometry: dict | None = get_path(document, "features[0].geometry")
+        self.geoms.append(shape(geometry) if geometry is not None else None)
+
+
+    def query_items(self, query: str, parameters: list[dict] | None = None, partition_key: str | None = None,
+                    **kwargs) -> AsyncIterator[dict]:
+        return self.run_query(query, parameters or [], partition_key)
+
+
+    async def run_query(self, query: str, parameters: list[dict], partition_key: str | None) \
+            -> AsyncIterator[dict]:
+        self.stats.queries += 1
+        self.stats.queries_by_container[self.name] = self.stats.queries_by_container.get(self.name, 0) + 1
+        self.stats.in_flight += 1
+        self.stats.max_in_flight = max(self.stats.max_in_flight, self.stats.in_flight)
+        try:
+            if partition_key is None:
+                self.stats.query_plans += 1
+                await asyncio.sleep(self.latency)
+            await asyncio.sleep(self.latency)
+            candidates: list[int] = [index for index, document in enumerate(self.documents)
+                                     if partition_key is None or document[PARTITION_FIELD] == partition_key]
+            partitions: set[str] = {self.documents[index][PARTITION_FIELD] for index in candidates}
+            parameter_geoms: dict[str, Geometry] = {parameter["name"]: shape(parameter["value"])
+                                                    for parameter in parameters
+                                                    if isinstance(parameter["value"], dict)
+                                                    and "coordinates" in parameter["value"]}
+            parameter_values: dict[str, Any] = {parameter["name"]: parameter["value"] for parameter in parameters
+                                                if parameter["name"] not in parameter_geoms}
+            query_parts = QUERY_PATTERN.match(query)
+            join = JOIN_PATTERN.match(query_parts.group("join")) if query_parts.group("join").strip() else None
+            select: str = query_parts.group("select")
+            top = TOP_PATTERN.match(select)
+            limit: int | None = int(top.group("count")) if top is not None else None
+            select = top.group("select") if top is not None else select
+            spatial_evaluations: int = self.stats.spatial_evaluations
+            results: list[dict] = []
+            for index in candidates:
+                evaluation: Evaluation = Evaluation(self.documents[index], self.geoms[index], parameter_geoms,
+                                                    self.stats, parameter_values)
+                if join is not None:
+                    evaluation.bindings[join.group("alias")] = evaluation.evaluate(join.group("expression"))
+                if query_parts.group("where") is None or evaluation.evaluate(query_parts.group("where")):
+                    results.append(project(evaluation, select))
+                    if limit is not None and len(results) == limit:
+                        break
+            size: int = sum(len(json.dumps(result, separators=(",", ":"))) for result in results)
+            self.stats.partitions_touched += max(len(partitions), 1)
+            self.stats.documents_returned += len(results)
+            self.stats.bytes_returned += size
+            self.stats.request_charge += (PARTITION_CHARGE * max(len(partitions), 1)
+                                          + DOCUMENT_CHARGE * len(candidates)
+                                          + SPATIAL_CHARGE * (self.stats.spatial_evaluations - spatial_evaluations)
+                                          + KB_CHARGE * size / 1024)
+        finally:
+            self.stats.in_flight -= 1
+        for result in results:
+            yield result
+
+
+class StandInDatabase:
+
+
+    def __init__(self):
+        self.containers: dict[str, StandInContainer] = {}
+
+
+    def get_container_client(self, container_name: str) -> StandInContainer:
+        if container_name not in self.containers:
+            raise CosmosResourceNotFoundError(status_code=404, message=f"Container {container_name} does not exist")
+        return self.containers[container_name]
+
+
+def box(x1: float, y1: float, x2: float, y2: float) -> dict:
+    return {"type": "Polygon", "coordinates": [[[x1, y1], [x2, y1], [x2, y2], [x1, y2], [x1, y1]]]}
+
+
+def get_grid_snapshot(bounds: tuple[float, float, float, float], grid_size: int = 4) -> dict[str, list[dict]]:
+    """
+    A postcode boundary snapshot of a grid of areas over the bounds, each a grid of districts, each a grid of
+    postcodes. Every district and postcode also has its area code, so that it can be added to the stand-in.
+    """
+    snapshot: dict[str, list[dict]] = {"areas": [], "districts": [], "postcodes": []}
+
+    def cells(x1: float, y1: float, x2: float, y2: float):
+        width, height = (x2 - x1) / grid_size, (y2 - y1) / grid_size
+        for i in range(grid_size * grid_size):
+            x, y = x1 + i % grid_size * width, y1 + i // grid_size * height
+            yield i, (x, y, x + width, y + height)
+
+    for area_index, area_bounds in cells(*bounds):
+        area_code: str = chr(ord("A") + area_index // 26) + chr(ord("A") + area_index % 26)
+        snapshot["areas"].append({"areaCode": area_code, "geometry": box(*area_bounds)})
+        for district_index, district_bounds in cells(*area_bounds):
+            district: str = f"{area_code}{district_index + 1}"
+            snapshot["districts"].append({"district": district, "areaCode": area_code,
+                                          "geometry": box(*district_bounds)})
+            for postcode_index, postcode_bounds in cells(*district_bounds):
+                snapshot["postcodes"].append({"postcode": f"{district} {postcode_index + 1}AA",
+                                              "district": district, "areaCode": area_code,
+                                              "geometry": box(*postcode_bounds)})
+    return snapshot
+
+
+class CosmosStandIn:
+    """
+    Stands in for the async CosmosClient, holding a shard map and one postcode database per area.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.stats = StandInStats()
+        self.databases: dict[str, StandInDatabase] = {}
+        self.container(shard_map_database, shard_map_container)
+
+
+    def get_database_client(self, database_name: str) -> StandInDatabase:
+        if database_name not in self.databases:
+            raise CosmosResourceNotFoundError(status_code=404, message=f"Database {database_name} does not exist")
+        return self.databases[database_name]
+
+
+    def container(self, database_name: str, container_name: str) -> StandInContainer:
+        database: StandInDatabase = self.databases.setdefault(database_name, StandInDatabase())
+        if container_name not in database.containers:
+            database.containers[container_name] = StandInContainer(container_name, self.stats, self.latency)
+        return database.containers[container_name]
+
+
+    def add_area(self, area_code: str, geometry: dict) -> None:
+        database_name: str = area_code + postcode_database_suffix
+        if area_code not in [document["databaseName"].split("-")[0]
+                             for document in self.container(shard_map_database, shard_map_container).documents]:
+            self.container(shard_map_database, shard_map_container).add(
+                {"id": database_name, "databaseName": database_name}, database_name)
+        self.container(database_name, area_code + area_container_suffix).add(
+            {"id": area_code, "areaCode": area_code, "features": [{"type": "Feature", "geometry": geometry}]},
+            area_code)
+
+
+    def add_district(self, area_code: str, district: str, geometry: dict, partition: str | None = None) -> None:
+        self.container(area_code + postcode_database_suffix, area_code + district_container_suffix).add(
+            {"id": district, "district": district, "features": [{"type": "Feature", "geometry": geometry}]},
+            partition or area_code)
+
+
+    def add_postcode(self, area_code: str, district: str, postcode: str, geometry: dict) -> None:
+        self.container(area_code + postcode_database_suffix, area_code + full_postcode_container_suffix).add(
+            {"id": postcode, "district": district,
+             "features": [{"type": "Feature", "geometry": geometry, "properties": {"mapit_code": postcode}}]},
+            district)
+
+
+    def add_snapshot(self, snapshot: dict[str, list[dict]]) -> None:
+        """
+        Adds every area, district and postcode of a snapshot (see get_grid_snapshot).
+        """
+        for area in snapshot["areas"]:
+            self.add_area(area["areaCode"], area["geometry"])
+        for district in snapshot["districts"]:
+            self.add_district(district["areaCode"], district["district"], district["geometry"])
+        for postcode in snapshot["postcodes"]:
+            self.add_postcode(postcode["areaCode"], postcode["district"], postcode["postcode"], postcode["geometry"])
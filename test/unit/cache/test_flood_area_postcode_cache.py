@@ -0,0 +1,58 @@
+import tempfile
+import unittest
+from unittest import TestCase
+
+from app.cache.cache_stores import FileCacheStore
+from app.cache.flood_area_postcode_cache import FloodAreaPostcodeCache
+
+POSTCODES = {"AB1 1AA", "AB1 1AB"}
+
+
+class FloodAreaPostcodeCacheTests(TestCase):
+
+
+    def setUp(self):
+        self.cache_directory = tempfile.TemporaryDirectory()
+        self.store = FileCacheStore(self.cache_directory.name)
+        self.cache = FloodAreaPostcodeCache(self.store)
+
+
+    def tearDown(self):
+        self.cache_directory.cleanup()
+
+
+    def test_miss_then_hit(self):
+        assert self.cache.get("flood-1", "digest-1") is None
+        assert self.cache.get_digest("flood-1") is None
+        self.cache.put("flood-1", "digest-1", POSTCODES)
+        assert self.cache.get("flood-1", "digest-1") == POSTCODES
+        assert self.cache.get_digest("flood-1") == "digest-1"
+        assert self.cache.stats.hits == 1
+        assert self.cache.stats.misses == 1
+        assert self.cache.stats.hit_rate == 0.5
+
+
+    def test_flood_area_without_postcodes_is_a_hit(self):
+        self.cache.put("flood-1", "digest-1", set())
+        assert self.cache.get("flood-1", "digest-1") == set()
+        assert self.cache.stats.hits == 1
+
+
+    def test_changed_polygon_invalidates_entry(self):
+        self.cache.put("flood-1", "digest-1", POSTCODES)
+        assert self.cache.get("flood-1", "digest-2") is None
+        assert self.cache.stats.invalidations == 1
+        self.cache.put("flood-1", "digest-2", {"AB1 1AA"})
+        assert self.cache.get("flood-1", "digest-2") == {"AB1 1AA"}
+        assert self.cache.get("flood-1", "digest-1") is None
+
+
+    def test_malformed_entry_is_discarded(self):
+        self.store.set("flood-1", {"polygonDigest": "digest-1", "postcodes": "not json"})
+        assert self.cache.get("flood-1", "digest-1") is None
+        assert self.store.get("flood-1") is None
+        assert self.cache.stats.misses == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import json
+import os
+import unittest
+from unittest.mock import patch
+
+from app.cache.flood_snapshot_cache import (fingerprint_flood,
+                                            get_changed_floods,
+                                            save_flood_snapshot,
+                                            FLOOD_SNAPSHOT_KEY)
+from app.models.pydantic_models.flood_warning import FloodWarning
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+dict_data: dict = {}
+
+
+def save_dict_to_cache(key: str, dictionary: dict):
+    dict_data[key] = dict(dictionary)
+
+
+def retrieve_dict_from_cache(key: str):
+    return dict_data.get(key, {})
+
+
+def delete_key(key: str):
+    dict_data.pop(key, None)
+
+
+def load_floods(fixture: str) -> list[FloodWarning]:
+    flood_update: dict = json.loads(open(root_dir + "/fixtures/" + fixture).read())
+    return [FloodWarning(**flood) for flood in flood_update.get("items")]
+
+
+@patch("app.cache.flood_snapshot_cache.delete_key", side_effect=delete_key)
+@patch("app.cache.flood_snapshot_cache.save_dict_to_cache", side_effect=save_dict_to_cache)
+@patch("app.cache.flood_snapshot_cache.retrieve_dict_from_cache", side_effect=retrieve_dict_from_cache)
+class FloodSnapshotCacheTests(unittest.TestCase):
+
+
+    def setUp(self):
+        dict_data.clear()
+
+
+    def test_fingerprint_ignores_unrelated_fields(self, *mocks):
+        flood: FloodWarning = load_floods("test_floods.json")[0]
+        reworded_flood: FloodWarning = flood.model_copy(update={"message": "A different message"})
+        assert fingerprint_flood(flood) == fingerprint_flood(reworded_flood)
+
+
+    def test_fingerprint_changes_with_severity(self, *mocks):
+        flood: FloodWarning = load_floods("test_floods.json")[0]
+        escalated_flood: FloodWarning = flood.model_copy(update={"severityLevel": 2})
+        assert fingerprint_flood(flood) != fingerprint_flood(escalated_flood)
+
+
+    def test_every_flood_is_changed_without_snapshot(self, *mocks):
+        floods: list[FloodWarning] = load_floods("test_floods.json")
+        assert get_changed_floods(floods) == floods
+
+
+    def test_unchanged_floods_are_dropped(self, *mocks):
+        floods: list[FloodWarning] = load_floods("test_floods.json")
+        save_flood_snapshot(floods)
+        assert get_changed_floods(floods) == []
+
+
+    def test_only_changed_floods_are_kept(self, *mocks):
+        save_flood_snapshot(load_floods("test_floods.json"))
+        changed_floods: list[FloodWarning] = get_changed_floods(load_floods("test_floods_severity_changes.json"))
+        assert {flood.floodAreaID for flood in changed_floods} == {"122WAF939", "011WAFKB"}
+
+
+    def test_snapshot_is_replaced(self, *mocks):
+        floods: list[FloodWarning] = load_floods("test_floods.json")
+        save_flood_snapshot(floods)
+        save_flood_snapshot(floods[:1])
+        assert list(dict_data[FLOOD_SNAPSHOT_KEY].keys()) == [floods[0].floodAreaID]
+        save_flood_snapshot([])
+        assert FLOOD_SNAPSHOT_KEY not in dict_data
+
+
+if __name__ == "__main__":
+    unittest.main()
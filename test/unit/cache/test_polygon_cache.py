@@ -0,0 +1,115 @@
+import os
+import tempfile
+import unittest
+from unittest.async_case import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from aiohttp import web
+from geojson import FeatureCollection
+
+from app.cache.cache_stores import FileCacheStore
+from app.cache.polygon_cache import PolygonCache
+from app.connections.polygon_client import PolygonClient
+from app.models.objects.flood_area_polygon import FloodAreaPolygon
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+
+class PolygonCacheTests(IsolatedAsyncioTestCase):
+
+
+    async def asyncSetUp(self):
+        self.polygon_body: bytes = open(root_dir + "/fixtures/test_feature_collection_4.json", "rb").read()
+        self.etag = '"version-1"'
+        self.request_headers: list[dict[str, str]] = []
+        app = web.Application()
+        app.router.add_get("/polygon", self.polygon_handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{self.runner.addresses[0][1]}/polygon"
+        self.cache_directory = tempfile.TemporaryDirectory()
+        self.cache = PolygonCache(FileCacheStore(self.cache_directory.name))
+
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+        self.cache_directory.cleanup()
+
+
+    async def polygon_handler(self, request: web.Request) -> web.Response:
+        self.request_headers.append(dict(request.headers))
+        if request.headers.get("If-None-Match") == self.etag:
+            return web.Response(status=304, headers={"ETag": self.etag})
+        return web.Response(body=self.polygon_body, content_type="application/json",
+                            headers={"ETag": self.etag, "Last-Modified": "Tue, 15 Jul 2025 19:42:00 GMT"})
+
+
+    async def test_miss_then_fresh_hit(self):
+        async with PolygonClient(cache=self.cache) as client:
+            first = await client.get_polygon(self.url)
+            second = await client.get_polygon(self.url)
+        assert isinstance(first.get_geojson(), FeatureCollection)
+        assert isinstance(second.get_geojson(), FeatureCollection)
+        assert second.get_geojson() == first.get_geojson()
+        assert second.get_digest() == first.get_digest()
+        assert len(self.request_headers) == 1
+        assert self.cache.stats.misses == 1
+        assert self.cache.stats.fresh_hits == 1
+        assert self.cache.stats.bytes_saved == len(self.polygon_body)
+        assert self.cache.stats.hit_rate == 0.5
+
+
+    async def test_changes_to_a_polygon_are_not_seen_by_the_next_caller(self):
+        async with PolygonClient(cache=self.cache) as client:
+            first = await client.get_polygon(self.url)
+            first.get_geojson()["features"].clear()
+            first.set_digest("changed")
+            second = await client.get_polygon(self.url)
+            second.get_geojson()["features"][0]["geometry"]["coordinates"].clear()
+            third = await client.get_polygon(self.url)
+        assert len(second.get_geojson()["features"]) > 0
+        assert second.get_digest() != "changed"
+        assert len(third.get_geojson()["features"][0]["geometry"]["coordinates"]) > 0
+
+
+    async def test_stale_entry_is_revalidated(self):
+        self.cache.max_age = 0
+        async with PolygonClient(cache=self.cache) as client:
+            first = await client.get_polygon(self.url)
+            with patch.object(FloodAreaPolygon, "from_body") as from_body:
+                second = await client.get_polygon(self.url)
+        # the revalidated polygon is copied from the one already parsed, rather than parsed again
+        from_body.assert_not_called()
+        assert second.get_geojson() == first.get_geojson()
+        assert len(self.request_headers) == 2
+        assert self.request_headers[1].get("If-None-Match") == self.etag
+        assert self.request_headers[1].get("If-Modified-Since") == "Tue, 15 Jul 2025 19:42:00 GMT"
+        assert self.cache.stats.revalidations == 1
+        assert self.cache.stats.bytes_saved == len(self.polygon_body)
+
+
+    async def test_changed_polygon_is_downloaded_again(self):
+        self.cache.max_age = 0
+        async with PolygonClient(cache=self.cache) as client:
+            await client.get_polygon(self.url)
+            self.etag = '"version-2"'
+            await client.get_polygon(self.url)
+        assert self.cache.stats.misses == 2
+        assert self.cache.get(self.url).etag == '"version-2"'
+
+
+    async def test_entries_persist_between_processes(self):
+        async with PolygonClient(cache=self.cache) as client:
+            await client.get_polygon(self.url)
+        restarted_cache = PolygonCache(FileCacheStore(self.cache_directory.name))
+        async with PolygonClient(cache=restarted_cache) as client:
+            polygon = await client.get_polygon(self.url)
+        assert isinstance(polygon.get_geojson(), FeatureCollection)
+        assert len(self.request_headers) == 1
+        assert restarted_cache.stats.fresh_hits == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+from unittest.async_case import IsolatedAsyncioTestCase
+
+from app.cache.shard_map_cache import ShardMapCache
+from app.env_vars import shard_map_database, shard_map_container, area_container_suffix
+
+
+def square(x: float, y: float, size: float = 1.0) -> dict:
+    return {"type": "Polygon",
+            "coordinates": [[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]]}
+
+
+class FakeContainer:
+
+
+    def __init__(self, documents: list[dict]):
+        self.documents = documents
+        self.query_count = 0
+
+
+    def query_items(self, query: str, parameters: list | None = None, partition_key: str | None = None):
+        self.query_count += 1
+
+        async def documents():
+            for document in self.documents:
+                yield document
+        return documents()
+
+
+class FakeDatabase:
+
+
+    def __init__(self, containers: dict[str, FakeContainer]):
+        self.containers = containers
+
+
+    def get_container_client(self, container_name: str) -> FakeContainer:
+        return self.containers[container_name]
+
+
+class FakeCosmosClient:
+
+
+    def __init__(self, databases: dict[str, FakeDatabase]):
+        self.databases = databases
+
+
+    def get_database_client(self, database_name: str) -> FakeDatabase:
+        return self.databases[database_name]
+
+
+class ShardMapCacheTests(IsolatedAsyncioTestCase):
+
+
+    async def asyncSetUp(self):
+        self.shard_map = FakeContainer([{"databaseName": "AB-postcodes"}, {"databaseName": "CD-postcodes"}])
+        self.client = FakeCosmosClient({
+            shard_map_database: FakeDatabase({shard_map_container: self.shard_map}),
+            "AB-postcodes": FakeDatabase({"AB" + area_container_suffix: FakeContainer(
+                [{"areaCode": "AB", "geometry": square(0, 0)}, {"areaCode": "AB", "geometry": square(5, 5)}])}),
+            "CD-postcodes": FakeDatabase({"CD" + area_container_suffix: FakeContainer(
+                [{"areaCode": "CD", "geometry": square(10, 0)}])})
+        })
+        self.cache = ShardMapCache(max_age=60)
+
+
+    async def test_shard_map_is_read_once_while_fresh(self):
+        for _ in range(3):
+            shards = await self.cache.get_shards(self.client)
+        assert [shard.get_database_name() for shard in shards] == ["AB-postcodes", "CD-postcodes"]
+        assert self.shard_map.query_count == 1
+        assert self.cache.stats.refreshes == 1
+        assert self.cache.stats.hits == 2
+
+
+    async def test_expired_shard_map_is_read_again(self):
+        self.cache.max_age = 0
+        await self.cache.get_shards(self.client)
+        await self.cache.get_shards(self.client)
+        assert self.shard_map.query_count == 2
+
+
+    async def test_extents_are_not_read_again_when_the_shard_map_expires(self):
+        self.cache.max_age = 0
+        await self.cache.get_shards(self.client)
+        self.shard_map.documents.append({"databaseName": "EF-postcodes"})
+        self.client.databases["EF-postcodes"] = FakeDatabase({"EF" + area_container_suffix: FakeContainer(
+            [{"areaCode": "EF", "geometry": square(20, 0)}])})
+        shards = await self.cache.get_shards(self.client)
+        assert [shard.get_database_name() for shard in shards] == ["AB-postcodes", "CD-postcodes", "EF-postcodes"]
+        assert self.client.databases["AB-postcodes"].containers["AB" + area_container_suffix].query_count == 1
+        assert self.client.databases["EF-postcodes"].containers["EF" + area_container_suffix].query_count == 1
+        assert self.cache.stats.extents_read == 3
+        assert shards[0].get_area_bounds() == [(0.0, 0.0, 1.0, 1.0), (5.0, 5.0, 6.0, 6.0)]
+
+
+    async def test_unknown_extent_is_read_again_on_refresh(self):
+        self.cache.max_age = 0
+        area_container = self.client.databases["CD-postcodes"].containers.pop("CD" + area_container_suffix)
+        shards = await self.cache.get_shards(self.client)
+        assert shards[1].get_area_bounds() is None
+        self.client.databases["CD-postcodes"].containers["CD" + area_container_suffix] = area_container
+        shards = await self.cache.get_shards(self.client)
+        assert shards[1].get_area_bounds() == [(10.0, 0.0, 11.0, 1.0)]
+        assert self.cache.stats.extents_read == 3
+
+
+    async def test_shards_outside_flood_are_skipped(self):
+        shards = await self.cache.get_intersecting_shards(self.client, (5.5, 5.5, 6.0, 6.0))
+        assert [shard.get_database_name() for shard in shards] == ["AB-postcodes"]
+        shards = await self.cache.get_intersecting_shards(self.client, (0.5, 0.5, 10.5, 0.5))
+        assert [shard.get_database_name() for shard in shards] == ["AB-postcodes", "CD-postcodes"]
+        assert self.cache.stats.shards_skipped == 1
+        assert self.cache.stats.skip_rate == 0.25
+
+
+    async def test_shard_without_known_extent_is_never_skipped(self):
+        del self.client.databases["CD-postcodes"].containers["CD" + area_container_suffix]
+        shards = await self.cache.get_intersecting_shards(self.client, (5.5, 5.5, 6.0, 6.0))
+        assert [shard.get_database_name() for shard in shards] == ["AB-postcodes", "CD-postcodes"]
+
+
+if __name__ == "__main__":
+    unittest.main()
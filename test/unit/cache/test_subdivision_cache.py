@@ -0,0 +1,64 @@
+import tempfile
+import unittest
+from unittest import TestCase
+
+from app.cache.cache_stores import FileCacheStore
+from app.cache.subdivision_cache import SubdivisionCache
+
+GEOMETRIES = [{"type": "Polygon", "coordinates": [[[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 0.0]]]}]
+PARAMETERS = "mode=budget;limit=199000"
+
+
+class SubdivisionCacheTests(TestCase):
+
+
+    def setUp(self):
+        self.cache_directory = tempfile.TemporaryDirectory()
+        self.store = FileCacheStore(self.cache_directory.name)
+        self.cache = SubdivisionCache(self.store, max_entries=2)
+
+
+    def tearDown(self):
+        self.cache_directory.cleanup()
+
+
+    def test_miss_then_hit(self):
+        assert self.cache.get("flood-1", "digest-1", PARAMETERS) is None
+        self.cache.put("flood-1", "digest-1", PARAMETERS, GEOMETRIES)
+        assert self.cache.get("flood-1", "digest-1", PARAMETERS) == GEOMETRIES
+        assert self.cache.stats.hits == 1
+        assert self.cache.stats.misses == 1
+        assert self.cache.stats.hit_rate == 0.5
+
+
+    def test_changed_polygon_or_parameters_invalidates_entry(self):
+        self.cache.put("flood-1", "digest-1", PARAMETERS, GEOMETRIES)
+        assert self.cache.get("flood-1", "digest-2", PARAMETERS) is None
+        assert self.cache.get("flood-1", "digest-1", "mode=threshold;limit=0.1") is None
+        assert self.cache.stats.invalidations == 2
+        self.cache.put("flood-1", "digest-2", PARAMETERS, [])
+        assert self.cache.get("flood-1", "digest-2", PARAMETERS) == []
+        assert self.cache.get("flood-1", "digest-1", PARAMETERS) is None
+
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.put("flood-1", "digest-1", PARAMETERS, GEOMETRIES)
+        self.cache.put("flood-2", "digest-2", PARAMETERS, GEOMETRIES)
+        self.cache.get_index()["flood-1"] += 10
+        self.cache.put("flood-3", "digest-3", PARAMETERS, GEOMETRIES)
+        assert self.cache.stats.evictions == 1
+        assert self.store.get("flood-2") is None
+        assert self.cache.get("flood-1", "digest-1", PARAMETERS) == GEOMETRIES
+        assert self.cache.get("flood-3", "digest-3", PARAMETERS) == GEOMETRIES
+
+
+    def test_entries_and_index_persist_across_instances(self):
+        self.cache.put("flood-1", "digest-1", PARAMETERS, GEOMETRIES)
+        self.cache.flush()
+        cache = SubdivisionCache(self.store, max_entries=2)
+        assert set(cache.get_index()) == {"flood-1"}
+        assert cache.get("flood-1", "digest-1", PARAMETERS) == GEOMETRIES
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import unittest
+from unittest.async_case import IsolatedAsyncioTestCase
+from unittest.mock import patch, AsyncMock
+
+from azure.cosmos.aio import CosmosClient
+
+from app.connections.cosmosdb_client import (CosmosClientManager,
+                                             get_container,
+                                             get_postcodes_district_container)
+
+TEST_ENDPOINT = "https://localhost:8081"
+
+
+class CosmosClientManagerTests(IsolatedAsyncioTestCase):
+
+
+    async def asyncSetUp(self):
+        self.client_opened = patch.object(CosmosClient, "__aenter__", new_callable=AsyncMock)
+        self.client_closed = patch.object(CosmosClient, "close", autospec=True, side_effect=CosmosClient.close)
+        self.mock_open = self.client_opened.start()
+        self.mock_close = self.client_closed.start()
+        self.manager = CosmosClientManager(TEST_ENDPOINT)
+
+
+    async def asyncTearDown(self):
+        await self.manager.close()
+        self.client_opened.stop()
+        self.client_closed.stop()
+
+
+    async def test_concurrent_callers_share_one_client(self):
+        clients = await asyncio.gather(*[self.manager.get_client() for _ in range(10)])
+        assert len({id(client) for client in clients}) == 1
+        assert self.mock_open.await_count == 1
+
+
+    async def test_client_is_closed_and_reopened(self):
+        client = await self.manager.get_client()
+        await self.manager.close()
+        assert self.mock_close.await_count == 1
+        assert self.manager.client is None
+        assert await self.manager.get_client() is not client
+
+
+    async def test_client_of_a_finished_loop_is_closed_when_replaced(self):
+        stale_client = await asyncio.to_thread(asyncio.run, self.manager.get_client())
+        client = await self.manager.get_client()
+        assert client is not stale_client
+        self.mock_close.assert_awaited_once_with(stale_client)
+
+
+    async def test_client_of_a_running_loop_is_closed_on_that_loop(self):
+        other_loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=other_loop.run_forever)
+        thread.start()
+        try:
+            stale_client = await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(self.manager.get_client(), other_loop))
+            await self.manager.get_client()
+            self.mock_close.assert_awaited_once_with(stale_client)
+        finally:
+            other_loop.call_soon_threadsafe(other_loop.stop)
+            await asyncio.to_thread(thread.join)
+            other_loop.close()
+
+
+    async def test_close_without_client_does_nothing(self):
+        await self.manager.close()
+        assert self.mock_close.await_count == 0
+
+
+    async def test_container_proxies_are_cached_per_client(self):
+        client = await self.manager.get_client()
+        other_client = CosmosClient(TEST_ENDPOINT, "key")
+        assert get_container(client, "database", "container") is get_container(client, "database", "container")
+        assert get_container(client, "database", "container") is not get_container(client, "database", "other")
+        assert get_container(client, "database", "container") \
+               is not get_container(other_client, "database", "container")
+        assert get_postcodes_district_container(client, "AB") is get_postcodes_district_container(client, "AB")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+import unittest
+from unittest.async_case import IsolatedAsyncioTestCase
+
+from aiohttp import web, ClientResponseError
+from geojson import FeatureCollection
+
+from app.connections.polygon_client import PolygonClient
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+
+class PolygonClientTests(IsolatedAsyncioTestCase):
+
+
+    async def asyncSetUp(self):
+        self.polygon_body: bytes = open(root_dir + "/fixtures/test_feature_collection_4.json", "rb").read()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.failures_remaining = 0
+        self.request_count = 0
+        app = web.Application()
+        app.router.add_get("/polygon/{id}", self.polygon_handler)
+        app.router.add_get("/flaky", self.flaky_handler)
+        app.router.add_get("/missing", self.missing_handler)
+        app.router.add_get("/slow", self.slow_handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+
+
+    async def polygon_handler(self, request: web.Request) -> web.Response:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return web.Response(body=self.polygon_body, content_type="application/json")
+
+
+    async def flaky_handler(self, request: web.Request) -> web.Response:
+        self.request_count += 1
+        if self.failures_remaining > 0:
+            self.failures_remaining -= 1
+            return web.Response(status=503)
+        return web.Response(body=self.polygon_body, content_type="application/json")
+
+
+    async def missing_handler(self, request: web.Request) -> web.Response:
+        self.request_count += 1
+        return web.Response(status=404)
+
+
+    async def slow_handler(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(1)
+        return web.Response(body=self.polygon_body, content_type="application/json")
+
+
+    async def test_get_polygon(self):
+        async with PolygonClient() as client:
+            polygon = await client.get_polygon(self.base_url + "/polygon/1")
+        assert isinstance(polygon.get_geojson(), FeatureCollection)
+        assert len(polygon.get_geojson()["features"]) > 0
+        assert polygon.get_serialized_size() >= len(json.dumps(polygon.get_geojson()["features"][0]["geometry"],
+                                                               separators=(",", ":")))
+
+
+    async def test_get_polygons_preserves_order_and_bounds_concurrency(self):
+        urls = [self.base_url + f"/polygon/{i}" for i in range(30)]
+        async with PolygonClient(max_concurrent_requests=5) as client:
+            polygons = await client.get_polygons(urls)
+        assert len(polygons) == len(urls)
+        for polygon in polygons:
+            assert isinstance(polygon.get_geojson(), FeatureCollection)
+        assert 1 < self.max_in_flight <= 5
+
+
+    async def test_retries_retryable_status(self):
+        self.failures_remaining = 2
+        async with PolygonClient(retry_backoff=0) as client:
+            polygon = await client.get_polygon(self.base_url + "/flaky")
+        assert isinstance(polygon.get_geojson(), FeatureCollection)
+        assert self.request_count == 3
+
+
+    async def test_gives_up_after_max_retries(self):
+        self.failures_remaining = 10
+        async with PolygonClient(max_retry_count=2, retry_backoff=0) as client:
+            with self.assertRaises(ClientResponseError):
+                await client.get_polygon(self.base_url + "/flaky")
+        assert self.request_count == 3
+
+
+    async def test_does_not_retry_client_errors(self):
+        async with PolygonClient(retry_backoff=0) as client:
+            with self.assertRaises(ClientResponseError):
+                await client.get_polygon(self.base_url + "/missing")
+        assert self.request_count == 1
+
+
+    async def test_request_timeout(self):
+        async with PolygonClient(request_timeout=0.1, max_retry_count=0) as client:
+            with self.assertRaises(asyncio.TimeoutError):
+                await client.get_polygon(self.base_url + "/slow")
+
+
+if __name__ == '__main__':
+    unittest.main()
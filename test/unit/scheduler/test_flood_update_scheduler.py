@@ -0,0 +1,134 @@
+import asyncio
+import unittest
+from unittest.async_case import IsolatedAsyncioTestCase
+
+from app.connections.polygon_client import PolygonClient
+from app.logging.log import get_logger
+from app.scheduler.flood_update_scheduler import FloodUpdateScheduler, RunReport
+
+
+class FloodUpdateSchedulerTests(IsolatedAsyncioTestCase):
+
+
+    async def asyncSetUp(self):
+        self.polygon_client = PolygonClient()
+        self.run_count = 0
+        self.running_jobs = 0
+        self.most_running_jobs = 0
+        self.job_duration = 0.0
+        self.clients_seen: set[int] = set()
+
+
+    async def job(self, polygon_client: PolygonClient):
+        self.run_count += 1
+        self.running_jobs += 1
+        self.most_running_jobs = max(self.most_running_jobs, self.running_jobs)
+        self.clients_seen.add(id(polygon_client))
+        await asyncio.sleep(self.job_duration)
+        self.running_jobs -= 1
+        return []
+
+
+    def scheduler(self, interval: int = 3600) -> FloodUpdateScheduler:
+        return FloodUpdateScheduler(job=self.job, next_interval=lambda: interval, polygon_client=self.polygon_client)
+
+
+    async def wait_for_runs(self, run_count: int):
+        while self.run_count < run_count:
+            await asyncio.sleep(0.01)
+
+
+    async def test_runs_immediately_and_stops_cleanly(self):
+        scheduler = self.scheduler()
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.wait_for(self.wait_for_runs(1), timeout=5)
+        scheduler.stop()
+        await asyncio.wait_for(task, timeout=5)
+        assert self.run_count == 1
+        assert self.polygon_client.session is None
+
+
+    async def test_runs_again_after_interval_with_same_client(self):
+        scheduler = self.scheduler(interval=0)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.wait_for(self.wait_for_runs(3), timeout=5)
+        scheduler.stop()
+        await asyncio.wait_for(task, timeout=5)
+        assert self.clients_seen == {id(self.polygon_client)}
+
+
+    async def test_trigger_starts_run_before_interval(self):
+        scheduler = self.scheduler()
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.wait_for(self.wait_for_runs(1), timeout=5)
+        scheduler.trigger()
+        await asyncio.wait_for(self.wait_for_runs(2), timeout=5)
+        scheduler.stop()
+        await asyncio.wait_for(task, timeout=5)
+        assert self.run_count == 2
+
+
+    async def test_runs_do_not_overlap(self):
+        self.job_duration = 0.1
+        scheduler = self.scheduler()
+        reports = await asyncio.gather(scheduler.run_once(), scheduler.run_once())
+        assert self.most_running_jobs == 1
+        assert reports.count(None) == 1
+
+
+    async def test_stop_waits_for_current_run(self):
+        self.job_duration = 0.1
+        scheduler = self.scheduler()
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.01)
+        scheduler.stop()
+        await asyncio.wait_for(task, timeout=5)
+        assert self.run_count == 1
+        assert self.running_jobs == 0
+
+
+    async def test_second_stop_cancels_current_run(self):
+        self.job_duration = 60
+        scheduler = self.scheduler()
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.01)
+        scheduler.stop()
+        scheduler.stop()
+        await asyncio.wait_for(task, timeout=5)
+        assert self.running_jobs == 1
+        assert self.polygon_client.session is None
+
+
+    async def test_run_is_reported_against_its_interval(self):
+        self.job_duration = 0.05
+        scheduler = self.scheduler()
+        scheduler.current_interval = 300
+        report = await scheduler.run_once()
+        assert report.duration >= 0.05
+        assert report.interval == 300
+        assert not report.overran
+        assert report.flood_count == 0
+        assert RunReport(0.0, 301.0, 300, 0).overran
+
+
+    async def test_first_run_does_not_overrun(self):
+        scheduler = self.scheduler()
+        with self.assertNoLogs(get_logger(), level="WARNING"):
+            report = await scheduler.run_once()
+        assert report.interval == 0
+        assert not report.overran
+
+
+    async def test_triggered_run_is_not_measured_against_the_interval(self):
+        scheduler = self.scheduler()
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.wait_for(self.wait_for_runs(1), timeout=5)
+        scheduler.trigger()
+        await asyncio.wait_for(self.wait_for_runs(2), timeout=5)
+        scheduler.stop()
+        await asyncio.wait_for(task, timeout=5)
+        assert [report.interval for report in scheduler.reports] == [0, 0]
+
+
+if __name__ == "__main__":
+    unittest.main()
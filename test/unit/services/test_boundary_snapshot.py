@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.async_case import IsolatedAsyncioTestCase
+
+from cosmos_stand_in import CosmosStandIn, box, get_grid_snapshot
+from shapely.geometry import shape
+
+from app.services.boundary_snapshot_service import (BoundarySnapshot,
+                                                    write_boundary_snapshot,
+                                                    export_boundary_snapshot,
+                                                    is_boundary_snapshot_file)
+from app.services.local_postcode_matching_service import (PostcodeBoundaryIndex,
+                                                          MappedBoundaryLevel,
+                                                          load_postcode_boundary_snapshot)
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+FIXTURES = [f"test_feature_collection_{i}.json" for i in range(1, 6)]
+LEVEL_KEYS = {"areas": "areaCode", "districts": "district", "postcodes": "postcode"}
+
+
+class BoundarySnapshotTests(IsolatedAsyncioTestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path: str = os.path.join(self.directory.name, "snapshot.bin")
+
+
+    def assert_snapshot_holds(self, snapshot_file: BoundarySnapshot, snapshot: dict[str, list[dict]]):
+        for level, key in LEVEL_KEYS.items():
+            snapshot_level = snapshot_file.levels[level]
+            assert len(snapshot_level) == len(snapshot[level])
+            assert sorted(snapshot_level.get_codes()) == sorted(document[key] for document in snapshot[level])
+            geoms = dict(zip(snapshot_level.get_codes(),
+                             snapshot_level.get_geoms(list(range(len(snapshot_level))))))
+            bounds = dict(zip(snapshot_level.get_codes(), snapshot_level.bounds.tolist()))
+            for document in snapshot[level]:
+                assert geoms[document[key]].equals(shape(document["geometry"]))
+                assert bounds[document[key]] == list(shape(document["geometry"]).bounds)
+
+
+    def test_snapshot_file_round_trip(self):
+        snapshot: dict[str, list[dict]] = get_grid_snapshot((0, 0, 16, 16))
+        write_boundary_snapshot(self.path, snapshot)
+        assert is_boundary_snapshot_file(self.path)
+        snapshot_file: BoundarySnapshot = BoundarySnapshot(self.path)
+        self.assert_snapshot_holds(snapshot_file, snapshot)
+        for snapshot_level in snapshot_file.levels.values():
+            assert snapshot_level.bounds.base is not None
+            assert not snapshot_level.bounds.flags.writeable
+
+
+    def test_json_snapshot_is_not_a_snapshot_file(self):
+        with open(self.path, "w") as snapshot_file:
+            json.dump(get_grid_snapshot((0, 0, 16, 16)), snapshot_file)
+        assert not is_boundary_snapshot_file(self.path)
+        with self.assertRaises(ValueError):
+            BoundarySnapshot(self.path)
+
+
+    def test_mapped_index_matches_in_memory_index(self):
+        for fixture in FIXTURES:
+            feature_collection: dict = json.loads(open(root_dir + "/fixtures/" + fixture).read())
+            geometries: list[dict] = [feature["geometry"] for feature in feature_collection["features"]]
+            x1, y1, x2, y2 = zip(*[shape(geometry).bounds for geometry in geometries])
+            snapshot: dict[str, list[dict]] = get_grid_snapshot((min(x1), min(y1), max(x2), max(y2)))
+            write_boundary_snapshot(self.path, snapshot)
+            mapped_index: PostcodeBoundaryIndex = load_postcode_boundary_snapshot(self.path)
+            assert isinstance(mapped_index.postcodes, MappedBoundaryLevel)
+            expected: list[dict] = PostcodeBoundaryIndex.from_snapshot(snapshot).match_postcodes(geometries)
+            assert len(expected) > 0
+            assert mapped_index.match_postcodes(geometries) == expected
+
+
+    def test_mapped_index_matches_nothing_outside_the_snapshot(self):
+        write_boundary_snapshot(self.path, get_grid_snapshot((0, 0, 16, 16)))
+        mapped_index: PostcodeBoundaryIndex = load_postcode_boundary_snapshot(self.path)
+        assert mapped_index.match_postcodes([box(20, 20, 21, 21)]) == []
+        assert mapped_index.match_postcodes([box(0.1, 0.1, 0.2, 0.2)]) == [{"postcode": "AA1 1AA",
+                                                                            "geometries": [0]}]
+
+
+    async def test_export_pages_through_every_container(self):
+        snapshot: dict[str, list[dict]] = get_grid_snapshot((0, 0, 16, 16))
+        stand_in: CosmosStandIn = CosmosStandIn()
+        stand_in.add_snapshot(snapshot)
+        await export_boundary_snapshot(self.path, stand_in)
+        self.assert_snapshot_holds(BoundarySnapshot(self.path), snapshot)
+        # the shard map, then the area, district and full postcode containers of each of the 16 shards once each
+        assert stand_in.stats.queries == 1 + 3 * 16
+
+
+if __name__ == "__main__":
+    unittest.main()
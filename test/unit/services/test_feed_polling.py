@@ -0,0 +1,132 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.async_case import IsolatedAsyncioTestCase
+
+from aiohttp import web, ClientResponseError
+
+from app.cache.cache_stores import FileCacheStore
+from app.cache.polygon_cache import PolygonCache
+from app.connections.polygon_client import PolygonClient, FEED_MAX_RETRY_COUNT
+from app.models.pydantic_models.latest_flood_update import LatestFloodUpdate
+from app.services.feed_polling_service import FloodFeedPoller, QUIET_POLL_INTERVAL, POLL_INTERVALS_BY_SEVERITY
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+
+class FloodFeedPollerTests(IsolatedAsyncioTestCase):
+
+
+    async def asyncSetUp(self):
+        self.feed_body: bytes = open(root_dir + "/fixtures/test_floods.json", "rb").read()
+        self.etag: str | None = None
+        self.request_count = 0
+        self.unavailable = False
+        app = web.Application()
+        app.router.add_get("/floods", self.feed_handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{self.runner.addresses[0][1]}/floods"
+        self.client = PolygonClient(retry_backoff=0)
+        await self.client.open()
+
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.runner.cleanup()
+
+
+    async def feed_handler(self, request: web.Request) -> web.Response:
+        self.request_count += 1
+        if self.unavailable:
+            return web.Response(status=503)
+        headers = {"ETag": self.etag} if self.etag else {}
+        if self.etag and request.headers.get("If-None-Match") == self.etag:
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=self.feed_body, content_type="application/json", headers=headers)
+
+
+    async def test_first_poll_returns_flood_update(self):
+        poller = FloodFeedPoller(self.url)
+        flood_update = await poller.poll(self.client)
+        assert isinstance(flood_update, LatestFloodUpdate)
+        assert len(flood_update.items) > 0
+
+
+    async def test_unchanged_feed_without_validators_is_short_circuited(self):
+        poller = FloodFeedPoller(self.url)
+        await poller.poll(self.client)
+        poller.acknowledge()
+        assert await poller.poll(self.client) is None
+        assert poller.unchanged_polls == 1
+
+
+    async def test_not_modified_feed_is_short_circuited(self):
+        self.etag = '"feed-1"'
+        poller = FloodFeedPoller(self.url)
+        await poller.poll(self.client)
+        poller.acknowledge()
+        assert await poller.poll(self.client) is None
+        assert poller.unchanged_polls == 1
+        assert self.request_count == 2
+
+
+    async def test_unacknowledged_flood_update_is_polled_again(self):
+        self.etag = '"feed-1"'
+        poller = FloodFeedPoller(self.url)
+        await poller.poll(self.client)
+        assert isinstance(await poller.poll(self.client), LatestFloodUpdate)
+
+
+    async def test_changed_feed_is_returned(self):
+        poller = FloodFeedPoller(self.url)
+        await poller.poll(self.client)
+        poller.acknowledge()
+        self.feed_body = open(root_dir + "/fixtures/test_floods_severity_changes.json", "rb").read()
+        assert isinstance(await poller.poll(self.client), LatestFloodUpdate)
+
+
+    async def test_poll_interval_follows_most_severe_warning(self):
+        poller = FloodFeedPoller(self.url)
+        await poller.poll(self.client)
+        feed: dict = json.loads(self.feed_body)
+        most_severe_level = min(flood["severityLevel"] for flood in feed["items"] if flood["severityLevel"] < 4)
+        assert poller.next_poll_interval() == POLL_INTERVALS_BY_SEVERITY[most_severe_level][0]
+
+
+    async def test_feed_is_never_cached_as_a_polygon(self):
+        self.etag = '"feed-1"'
+        with tempfile.TemporaryDirectory() as cache_directory:
+            cache = PolygonCache(FileCacheStore(cache_directory))
+            async with PolygonClient(cache=cache) as client:
+                poller = FloodFeedPoller(self.url)
+                await poller.poll(client)
+                poller.acknowledge()
+                assert await poller.poll(client) is None
+            assert cache.get(self.url) is None
+            assert cache.stats.requests == 0
+        assert self.request_count == 2
+
+
+    async def test_unavailable_feed_is_retried_less_than_a_polygon(self):
+        self.unavailable = True
+        with self.assertRaises(ClientResponseError):
+            await FloodFeedPoller(self.url).poll(self.client)
+        assert self.request_count == FEED_MAX_RETRY_COUNT + 1
+        assert FEED_MAX_RETRY_COUNT < self.client.max_retry_count
+
+
+    def test_poll_interval_backs_off_while_unchanged(self):
+        poller = FloodFeedPoller(self.url)
+        assert poller.next_poll_interval() == QUIET_POLL_INTERVAL[0]
+        poller.unchanged_polls = 1
+        assert poller.next_poll_interval() == QUIET_POLL_INTERVAL[0] * 2
+        poller.unchanged_polls = 10
+        assert poller.next_poll_interval() == QUIET_POLL_INTERVAL[1]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import json
+import os
+import tempfile
+import unittest
+from functools import partial
+from unittest.async_case import IsolatedAsyncioTestCase
+from unittest.mock import patch, AsyncMock
+
+from aiohttp import ClientError
+from cosmos_stand_in import get_grid_snapshot
+from shapely.geometry import shape
+
+from app.cache.cache_stores import FileCacheStore
+from app.cache.flood_area_postcode_cache import FloodAreaPostcodeCache
+from app.models.objects.flood_area_polygon import FloodAreaPolygon
+from app.models.objects.floods_with_postcodes import FloodWithPostcodes
+from app.models.pydantic_models.flood_area import FloodArea
+from app.models.pydantic_models.flood_warning import FloodWarning
+from app.services import flood_area_catalogue_service, flood_update_service
+from app.services import local_postcode_matching_service
+from app.services.flood_area_catalogue_service import (build_flood_area_postcodes,
+                                                       get_flood_area_catalogue,
+                                                       FloodAreaBuildReport,
+                                                       FLOOD_AREA_CATALOGUE_URL)
+from app.services.flood_update_service import get_all_flood_postcodes
+from app.services.local_postcode_matching_service import PostcodeBoundaryIndex
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+FLOOD_AREA_IDS = ["area-1", "area-2", "area-3"]
+
+
+def get_polygon_url(flood_area_id: str) -> str:
+    return f"{FLOOD_AREA_CATALOGUE_URL}/{flood_area_id}/polygon"
+
+
+def get_flood_area(flood_area_id: str) -> FloodArea:
+    return FloodArea(**{"@id": f"{FLOOD_AREA_CATALOGUE_URL}/{flood_area_id}", "notation": flood_area_id,
+                        "polygon": get_polygon_url(flood_area_id)})
+
+
+class FakePolygonClient:
+    """
+    Serves flood area polygons, and pages of the flood area catalogue, from memory.
+    """
+
+    def __init__(self, bodies: dict[str, str], catalogue: list[dict] | None = None):
+        self.bodies = bodies
+        self.catalogue = catalogue or []
+        self.requested_urls: list[str] = []
+
+
+    async def get_polygon(self, url: str) -> FloodAreaPolygon:
+        if url not in self.bodies:
+            raise ClientError(f"No polygon at {url}")
+        return FloodAreaPolygon.from_body(self.bodies[url])
+
+
+    async def get(self, url: str, headers: dict[str, str] | None = None):
+        self.requested_urls.append(url)
+        query: dict[str, int] = {key: int(value) for key, value in
+                                 (parameter.split("=") for parameter in url.split("?")[1].split("&"))}
+        page: list[dict] = self.catalogue[query["_offset"]:query["_offset"] + query["_limit"]]
+        return 200, json.dumps({"items": page}).encode(), {}
+
+
+class FloodAreaCatalogueTests(IsolatedAsyncioTestCase):
+
+
+    def setUp(self):
+        self.cache_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_directory.cleanup)
+        self.cache = FloodAreaPostcodeCache(FileCacheStore(self.cache_directory.name))
+        self.bodies: dict[str, str] = {
+            get_polygon_url(flood_area_id): open(root_dir + f"/fixtures/test_feature_collection_{i + 1}.json").read()
+            for i, flood_area_id in enumerate(FLOOD_AREA_IDS)}
+        geometries: list[dict] = [feature["geometry"] for body in self.bodies.values()
+                                  for feature in json.loads(body)["features"]]
+        x1, y1, x2, y2 = zip(*[shape(geometry).bounds for geometry in geometries])
+        index: PostcodeBoundaryIndex = \
+            PostcodeBoundaryIndex.from_snapshot(get_grid_snapshot((min(x1), min(y1), max(x2), max(y2))))
+        self.matcher = AsyncMock(side_effect=partial(local_postcode_matching_service.collect_postcodes_in_flood_range,
+                                                     index=index))
+        patch.object(flood_area_catalogue_service, "get_postcode_matcher", return_value=self.matcher).start()
+        patch.object(flood_update_service, "get_postcode_matcher", return_value=self.matcher).start()
+        patch.object(flood_update_service, "cache_flood_postcodes").start()
+        self.addCleanup(patch.stopall)
+
+
+    async def build(self) -> FloodAreaBuildReport:
+        return await build_flood_area_postcodes([get_flood_area(flood_area_id) for flood_area_id in FLOOD_AREA_IDS],
+                                                FakePolygonClient(self.bodies), self.cache, batch_size=2)
+
+
+    async def test_only_changed_flood_areas_are_rebuilt(self):
+        report: FloodAreaBuildReport = await self.build()
+        assert (report.areas, report.rebuilt, report.unchanged, report.failed) == (3, 3, 0, 0)
+        assert report.postcodes > 0
+        assert self.matcher.await_count == 3
+        report = await self.build()
+        assert (report.rebuilt, report.unchanged) == (0, 3)
+        assert self.matcher.await_count == 3
+        self.bodies[get_polygon_url("area-2")] = self.bodies[get_polygon_url("area-3")]
+        report = await self.build()
+        assert (report.rebuilt, report.unchanged) == (1, 2)
+        assert self.matcher.await_count == 4
+        digest: str = FloodAreaPolygon.from_body(self.bodies[get_polygon_url("area-3")]).get_digest()
+        assert self.cache.get("area-2", digest) == self.cache.get("area-3", digest)
+
+
+    async def test_flood_area_which_cannot_be_downloaded_is_left_for_the_next_build(self):
+        del self.bodies[get_polygon_url("area-1")]
+        report: FloodAreaBuildReport = await self.build()
+        assert (report.rebuilt, report.failed) == (2, 1)
+        assert self.cache.get_digest("area-1") is None
+
+
+    async def test_catalogue_is_paged_through(self):
+        catalogue: list[dict] = [{"@id": f"{FLOOD_AREA_CATALOGUE_URL}/area-{i}", "notation": f"area-{i}",
+                                  "polygon": get_polygon_url(f"area-{i}")} for i in range(5)]
+        client: FakePolygonClient = FakePolygonClient({}, catalogue)
+        flood_areas: list[FloodArea] = await get_flood_area_catalogue(client, page_size=2)
+        assert [flood_area.notation for flood_area in flood_areas] == [f"area-{i}" for i in range(5)]
+        assert len(client.requested_urls) == 3
+
+
+    async def test_known_flood_areas_are_looked_up_rather_than_matched(self):
+        await self.build()
+        self.matcher.reset_mock()
+        flood_items: list[dict] = json.loads(open(root_dir + "/fixtures/test_floods.json").read())["items"][:2]
+        floods: list[FloodWarning] = []
+        for flood_area_id, flood_item, body in zip(FLOOD_AREA_IDS, flood_items, self.bodies.values()):
+            flood: FloodWarning = FloodWarning(**{**flood_item, "floodAreaID": flood_area_id})
+            polygon: FloodAreaPolygon = FloodAreaPolygon.from_body(body)
+            flood.floodAreaGeoJson = polygon.get_geojson()
+            flood.floodAreaGeoJsonSize = polygon.get_serialized_size()
+            flood.floodAreaGeoJsonDigest = polygon.get_digest()
+            floods.append(flood)
+        floods[1].floodAreaGeoJsonDigest = "changed"
+        expected: set[str] = self.cache.get("area-2", FloodAreaPolygon.from_body(
+            self.bodies[get_polygon_url("area-2")]).get_digest())
+        results: list[FloodWithPostcodes] = await get_all_flood_postcodes(floods, [], self.cache)
+        assert [result.flood.floodAreaID for result in results] == ["area-1", "area-2"]
+        assert self.matcher.await_count == 1
+        assert self.matcher.await_args.args[0] == "area-2"
+        assert results[1].postcode_set == expected
+        assert self.cache.get("area-2", "changed") == expected
+
+
+if __name__ == "__main__":
+    unittest.main()
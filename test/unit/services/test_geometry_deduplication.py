@@ -0,0 +1,74 @@
+import unittest
+from unittest import TestCase
+
+from shapely import union_all
+from shapely.geometry import shape
+
+from app.models.objects.flood_geometries import FloodGeometries
+from app.services.geometry_deduplication_service import deduplicate_flood_geometries, fan_out_flood_postcodes
+from app.services.geometry_subdivision_service import subdivision_covers_geometry
+
+
+def square(x: float, y: float, size: float = 1.0) -> dict:
+    return {"type": "Polygon",
+            "coordinates": [[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]]}
+
+
+def flood_region(regions: dict, flood_id: str):
+    return union_all([shape(geometry) for flood_ids, geometries in regions.items() if flood_id in flood_ids
+                      for geometry in geometries])
+
+
+class GeometryDeduplicationTests(TestCase):
+
+
+    def test_identical_geometries_are_matched_once(self):
+        regions, report = deduplicate_flood_geometries([FloodGeometries("alert", [square(0, 0)]),
+                                                        FloodGeometries("warning", [square(0, 0)])])
+        assert regions == {frozenset({"alert", "warning"}): [square(0, 0)]}
+        assert report.identical_pieces == 1
+        assert report.queries_saved == 1
+
+
+    def test_disjoint_geometries_are_left_alone(self):
+        regions, report = deduplicate_flood_geometries([FloodGeometries("alert", [square(0, 0)]),
+                                                        FloodGeometries("warning", [square(2, 0)])])
+        assert regions == {frozenset({"alert"}): [square(0, 0)], frozenset({"warning"}): [square(2, 0)]}
+        assert report.queries_saved == 0
+
+
+    def test_nested_geometries_are_partitioned(self):
+        flood_geometries: list[FloodGeometries] = [FloodGeometries("alert", [square(0, 0, 10)]),
+                                                   FloodGeometries("warning-1", [square(1, 1)]),
+                                                   FloodGeometries("warning-2", [square(5, 5)])]
+        regions, report = deduplicate_flood_geometries(flood_geometries)
+        assert report.partitioned_groups == 1
+        assert report.regions <= report.pieces
+        assert set(regions) == {frozenset({"alert"}), frozenset({"alert", "warning-1"}),
+                                frozenset({"alert", "warning-2"})}
+        for flood_geometries_object in flood_geometries:
+            assert subdivision_covers_geometry(shape(flood_geometries_object.get_geometries()[0]),
+                                               [flood_region(regions, flood_geometries_object.get_id())])
+        assert union_all([shape(geometry) for geometries in regions.values() for geometry in geometries]).area == 100
+
+
+    def test_partially_overlapping_geometries_are_not_partitioned_into_more_geometries(self):
+        regions, report = deduplicate_flood_geometries([FloodGeometries("alert", [square(0, 0, 2)]),
+                                                        FloodGeometries("warning", [square(1, 1, 2)])])
+        assert report.overlapping_groups == 1
+        assert report.partitioned_groups == 0
+        assert regions == {frozenset({"alert"}): [square(0, 0, 2)], frozenset({"warning"}): [square(1, 1, 2)]}
+
+
+    def test_postcodes_are_fanned_out_to_every_flood_covering_them(self):
+        flood_postcodes: list[dict] = fan_out_flood_postcodes(
+            ["alert", "warning"],
+            [frozenset({"alert"}), frozenset({"alert", "warning"})],
+            [{"id": "alert", "floodPostcodes": [["AB1 1AA"]]},
+             {"id": "alert,warning", "floodPostcodes": [["AB1 1AB"], ["AB1 1AC"]]}])
+        assert flood_postcodes == [{"id": "alert", "floodPostcodes": [["AB1 1AA"], ["AB1 1AB"], ["AB1 1AC"]]},
+                                   {"id": "warning", "floodPostcodes": [["AB1 1AB"], ["AB1 1AC"]]}]
+
+
+if __name__ == "__main__":
+    unittest.main()
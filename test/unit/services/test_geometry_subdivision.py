@@ -1,15 +1,41 @@
 import os
 import json
+import asyncio
 import unittest
+from concurrent.futures import ProcessPoolExecutor
 from unittest import TestCase
+from unittest.mock import patch
 
-from shapely import Geometry, Polygon, GEOSException, intersects
+from shapely import (Geometry, Polygon, GEOSException, from_wkb, union_all, intersects, normalize, get_coordinates,
+                     get_num_coordinates, clip_by_rect, box)
+from shapely.geometry import shape
 from geojson import FeatureCollection
 
+from app.models.objects.flood_area_polygon import FloodAreaPolygon
 from app.services.geometry_subdivision_service import (get_geometry_from_geojson,
                                                        get_geojson_from_geometry,
+                                                       get_geometry_from_mapping,
+                                                       get_mapping_from_polygon,
+                                                       get_geojson_size,
+                                                       recursive_geometry_subdivision,
+                                                       iterative_geometry_subdivision,
+                                                       subdivision_covers_geometry,
+                                                       budget_geometry_subdivision,
+                                                       clip_to_polygons,
+                                                       get_mapping_from_geometry,
+                                                       get_query_character_budget,
+                                                       SUBDIVISION_MODE_BUDGET,
+                                                       SUBDIVISION_MODE_THRESHOLD,
+                                                       prepare_geometry,
+                                                       prepare_feature_collection,
                                                        subdivide,
-                                                       subdivide_from_feature_collection)
+                                                       subdivide_from_feature_collection,
+                                                       subdivide_to_wkb,
+                                                       subdivide_in_executor,
+                                                       pack_geometries,
+                                                       get_geojson_bounds,
+                                                       batch_query_geometries,
+                                                       get_multi_geometry_query_size)
 
 from app.cosmos.cosmos_queries import COSMOS_QUERY_CHARACTER_LIMIT, match_areas_to_geometry_query
 
@@ -17,6 +43,31 @@ root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os
 THRESHOLD = 0.1
 
 
+def square(x: float, y: float, size: float = 1.0) -> dict:
+    return {"type": "Polygon",
+            "coordinates": [[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]]}
+
+
+def load_largest_parts(count: int = 3) -> list[Geometry]:
+    parts: list[Geometry] = []
+    for i in range(1, 6):
+        feature_collection: dict = json.loads(open(root_dir + f"/fixtures/test_feature_collection_{i}.json").read())
+        for feature in feature_collection["features"]:
+            parts.extend(get_geometry_from_mapping(feature["geometry"]))
+    return sorted(parts, key=lambda part: part.area, reverse=True)[:count]
+
+
+def same_polygons(polygons: list[Polygon], other_polygons: list[Polygon]) -> bool:
+    unmatched: list[Polygon] = [normalize(polygon) for polygon in other_polygons]
+    for polygon in polygons:
+        polygon = normalize(polygon)
+        matches = [other for other in unmatched if polygon.equals_exact(other, 1e-12)]
+        if len(matches) == 0:
+            return False
+        unmatched.remove(matches[0])
+    return len(unmatched) == 0
+
+
 class TestGeometrySubdivision(TestCase):
 
 
@@ -129,6 +180,256 @@ class TestGeometrySubdivision(TestCase):
             assert len(resultant_geom_as_string) + len(match_areas_to_geometry_query()) < COSMOS_QUERY_CHARACTER_LIMIT
 
 
+    def test_geometry_from_mapping_matches_geometry_from_geojson(self):
+        test_multipolygon = json.loads(open(root_dir + "/fixtures/test_multipolygon.json").read())
+        geometries_from_geojson: list[Geometry] = get_geometry_from_geojson(json.dumps(test_multipolygon))
+        geometries_from_mapping: list[Geometry] = get_geometry_from_mapping(test_multipolygon)
+        assert len(geometries_from_mapping) == len(geometries_from_geojson)
+        for geometry_from_mapping, geometry_from_geojson in zip(geometries_from_mapping, geometries_from_geojson):
+            assert geometry_from_mapping.equals_exact(geometry_from_geojson, 0)
+
+
+    def test_mapping_from_polygon_matches_geojson(self):
+        test_multipolygon = json.loads(open(root_dir + "/fixtures/test_multipolygon.json").read())
+        for geometry in get_geometry_from_mapping(test_multipolygon):
+            assert get_mapping_from_polygon(geometry) == json.loads(get_geojson_from_geometry(geometry))
+
+
+    def test_serialized_size_is_an_upper_bound(self):
+        for i in range(1, 6):
+            body: bytes = open(root_dir + f"/fixtures/test_feature_collection_{i}.json", "rb").read()
+            flood_area_polygon: FloodAreaPolygon = FloodAreaPolygon.from_body(body)
+            for feature in flood_area_polygon.get_geojson()["features"]:
+                assert flood_area_polygon.get_serialized_size() >= get_geojson_size(feature["geometry"])
+
+
+    def test_subdivision_with_serialized_size_matches_subdivision_without(self):
+        for i in range(1, 6):
+            body: bytes = open(root_dir + f"/fixtures/test_feature_collection_{i}.json", "rb").read()
+            flood_area_polygon: FloodAreaPolygon = FloodAreaPolygon.from_body(body)
+            geometries_with_size: list = subdivide_from_feature_collection(
+                flood_area_polygon.get_geojson(), THRESHOLD, flood_area_polygon.get_serialized_size())
+            geometries_without_size: list = subdivide_from_feature_collection(json.loads(body), THRESHOLD)
+            assert geometries_with_size == geometries_without_size
+
+    def test_iterative_subdivision_matches_recursive_subdivision(self):
+        for part in load_largest_parts():
+            for threshold in (THRESHOLD, THRESHOLD / 5):
+                recursive_polygons: list[Polygon] = recursive_geometry_subdivision(part, threshold)
+                iterative_polygons: list[Polygon] = iterative_geometry_subdivision(part, threshold)
+                assert len(iterative_polygons) > 1
+                assert same_polygons(recursive_polygons, iterative_polygons)
+
+
+    def test_iterative_subdivision_covers_geometry(self):
+        for part in load_largest_parts():
+            iterative_polygons: list[Polygon] = iterative_geometry_subdivision(part, THRESHOLD / 5)
+            for polygon in iterative_polygons:
+                assert isinstance(polygon, Polygon)
+                x1, y1, x2, y2 = polygon.bounds
+                assert max(x2 - x1, y2 - y1) <= THRESHOLD / 5
+            assert subdivision_covers_geometry(part, iterative_polygons)
+            assert not subdivision_covers_geometry(part, iterative_polygons[1:])
+
+
+    def test_subdivided_pieces_are_valid(self):
+        for i in range(1, 6):
+            feature_collection: dict = json.loads(open(root_dir + f"/fixtures/test_feature_collection_{i}.json").read())
+            for mode in (SUBDIVISION_MODE_THRESHOLD, SUBDIVISION_MODE_BUDGET):
+                for threshold in (THRESHOLD, THRESHOLD / 5):
+                    for geometry in subdivide_from_feature_collection(feature_collection, threshold, mode=mode):
+                        assert shape(geometry).is_valid
+        for part in load_largest_parts():
+            assert all(polygon.is_valid for polygon in iterative_geometry_subdivision(part, THRESHOLD / 5))
+            assert all(piece.is_valid for piece in budget_geometry_subdivision(part, 20000))
+
+
+    def test_invalid_clipped_piece_is_repaired(self):
+        # rectangle clipping turns this valid polygon into one whose ring crosses itself
+        polygon: Polygon = Polygon([(3, 1), (6, 6), (2, 6), (3, 0), (6, 3), (3, 1)])
+        assert polygon.is_valid
+        assert not clip_by_rect(polygon, 3, 1, 5, 2).is_valid
+        pieces: list[Geometry] = clip_to_polygons(polygon, 3, 1, 5, 2)
+        assert all(piece.is_valid for piece in pieces)
+        assert union_all(pieces).symmetric_difference(polygon.intersection(box(3, 1, 5, 2))).area < 1e-9
+        polygons: list[Polygon] = iterative_geometry_subdivision(polygon, 0.5)
+        assert all(piece.is_valid for piece in polygons)
+        assert subdivision_covers_geometry(polygon, polygons)
+
+
+    def test_small_geometry_is_not_subdivided(self):
+        test_polygon = json.loads(open(root_dir + "/fixtures/test_polygon.json").read())
+        polygon: Polygon = get_geometry_from_mapping(test_polygon)[0]
+        assert iterative_geometry_subdivision(polygon, 10) == [polygon]
+
+    def test_budget_subdivision_fits_budget(self):
+        feature_collection: dict = json.loads(open(root_dir + "/fixtures/test_feature_collection_1.json").read())
+        geometry: Geometry = shape(feature_collection["features"][0]["geometry"])
+        for character_budget in (100000, 20000):
+            pieces: list[Geometry] = budget_geometry_subdivision(geometry, character_budget)
+            assert len(pieces) > 1
+            for piece in pieces:
+                assert get_geojson_size(get_mapping_from_geometry(piece)) <= character_budget
+            assert subdivision_covers_geometry(geometry, pieces)
+
+
+    def test_budget_mode_produces_fewer_pieces_than_threshold_mode(self):
+        feature_collection: dict = json.loads(open(root_dir + "/fixtures/test_feature_collection_1.json").read())
+        budget_geometries: list = subdivide_from_feature_collection(feature_collection, THRESHOLD,
+                                                                    mode=SUBDIVISION_MODE_BUDGET)
+        threshold_geometries: list = subdivide_from_feature_collection(feature_collection, THRESHOLD,
+                                                                       mode=SUBDIVISION_MODE_THRESHOLD)
+        assert 1 < len(budget_geometries) < len(threshold_geometries)
+        for geometry in budget_geometries:
+            assert get_geojson_size(geometry) <= get_query_character_budget()
+
+    def test_prepared_geometry_covers_original(self):
+        for part in load_largest_parts():
+            for precision, tolerance in ((5, None), (None, 0.0001), (4, 0.0005)):
+                prepared: Geometry = prepare_geometry(part, precision, tolerance)
+                assert prepared.covers(part)
+                if tolerance is not None:
+                    assert get_num_coordinates(prepared) < get_num_coordinates(part)
+                if precision is not None:
+                    coordinates = get_coordinates(prepared) * 10 ** precision
+                    assert abs(coordinates - coordinates.round()).max() < 1e-6
+
+
+    def test_unprepared_geometry_is_unchanged(self):
+        part: Geometry = load_largest_parts(1)[0]
+        assert prepare_geometry(part, None, None) is part
+
+
+    def test_prepared_feature_collection_is_reported(self):
+        feature_collection: dict = json.loads(open(root_dir + "/fixtures/test_feature_collection_1.json").read())
+        prepared_feature_collection, report = prepare_feature_collection(feature_collection, 5, 0.0001)
+        prepared_geometry: dict = prepared_feature_collection["features"][0]["geometry"]
+        assert feature_collection["features"][0]["geometry"] is not prepared_geometry
+        assert report.vertices_after < report.vertices_before
+        assert report.bytes_after < report.bytes_before
+        assert report.bytes_before == get_geojson_size(feature_collection["features"][0]["geometry"])
+        assert report.largest_geometry_size == get_geojson_size(prepared_geometry)
+
+
+    def test_subdivision_to_wkb_matches_subdivision_from_feature_collection(self):
+        for mode in (SUBDIVISION_MODE_BUDGET, SUBDIVISION_MODE_THRESHOLD):
+            for i in range(1, 6):
+                flood_area_polygon: FloodAreaPolygon = FloodAreaPolygon.from_body(
+                    open(root_dir + f"/fixtures/test_feature_collection_{i}.json", "rb").read())
+                geometries: list = subdivide_from_feature_collection(
+                    flood_area_polygon.get_geojson(), THRESHOLD, flood_area_polygon.get_serialized_size(), mode)
+                pieces_wkb, report = subdivide_to_wkb(flood_area_polygon.get_geojson(), THRESHOLD,
+                                                      flood_area_polygon.get_serialized_size(), mode, False)
+                assert report is None
+                assert len(pieces_wkb) == len(geometries)
+                for piece, geometry in zip(from_wkb(pieces_wkb), geometries):
+                    assert piece.equals_exact(shape(geometry), 0)
+
+
+    def test_subdivision_in_executor_matches_subdivision_in_event_loop(self):
+        flood_area_polygon: FloodAreaPolygon = FloodAreaPolygon.from_body(
+            open(root_dir + "/fixtures/test_feature_collection_1.json", "rb").read())
+        geometries: list = subdivide_from_feature_collection(flood_area_polygon.get_geojson(), THRESHOLD,
+                                                             flood_area_polygon.get_serialized_size())
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            subdivided_geometries, report = asyncio.run(subdivide_in_executor(
+                flood_area_polygon.get_geojson(), THRESHOLD, flood_area_polygon.get_serialized_size(), executor))
+        assert report is None
+        assert subdivided_geometries == geometries
+
+
+    def test_subdivision_to_wkb_packs_geometries(self):
+        for i in range(1, 6):
+            flood_area_polygon: FloodAreaPolygon = FloodAreaPolygon.from_body(
+                open(root_dir + f"/fixtures/test_feature_collection_{i}.json", "rb").read())
+            geometries: list = pack_geometries(subdivide_from_feature_collection(
+                flood_area_polygon.get_geojson(), THRESHOLD, flood_area_polygon.get_serialized_size(),
+                SUBDIVISION_MODE_THRESHOLD))
+            pieces_wkb, _ = subdivide_to_wkb(flood_area_polygon.get_geojson(), THRESHOLD,
+                                             flood_area_polygon.get_serialized_size(), SUBDIVISION_MODE_THRESHOLD,
+                                             False, True)
+            assert len(pieces_wkb) == len(geometries)
+            for piece, geometry in zip(from_wkb(pieces_wkb), geometries):
+                assert piece.equals_exact(shape(geometry), 0)
+
+
+    def test_geometries_are_packed_in_the_executor(self):
+        feature_collection: FeatureCollection = FeatureCollection(
+            [{"type": "Feature", "geometry": square(2 * i, 0), "properties": {}} for i in range(10)])
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            # start the worker first, so that it packs with the real pack_geometries
+            executor.submit(int).result()
+            with patch("app.services.geometry_subdivision_service.pack_geometries",
+                       side_effect=AssertionError("packed in the event loop")):
+                geometries, _ = asyncio.run(subdivide_in_executor(feature_collection, THRESHOLD,
+                                                                  executor=executor, pack=True))
+        assert len(geometries) == 1
+        assert geometries[0]["type"] == "MultiPolygon"
+        assert shape(geometries[0]).is_valid
+
+
+    def test_small_geometries_are_packed_into_one_multipolygon(self):
+        squares: list[dict] = [square(2 * i, 0) for i in range(10)]
+        packed_geometries: list[dict] = pack_geometries(squares)
+        assert len(packed_geometries) == 1
+        assert packed_geometries[0]["type"] == "MultiPolygon"
+        assert shape(packed_geometries[0]).is_valid
+        assert shape(packed_geometries[0]).area == 10
+
+
+    def test_touching_geometries_are_not_packed_together(self):
+        packed_geometries: list[dict] = pack_geometries([square(0, 0), square(1, 0)])
+        assert packed_geometries == [square(0, 0), square(1, 0)]
+
+
+    def test_packed_geometries_fit_budget(self):
+        squares: list[dict] = [square(2 * i, 0) for i in range(10)]
+        character_budget: int = 3 * get_geojson_size(squares[0])
+        packed_geometries: list[dict] = pack_geometries(squares, character_budget)
+        assert 1 < len(packed_geometries) < len(squares)
+        assert all(get_geojson_size(geometry) <= character_budget for geometry in packed_geometries)
+        assert sum(shape(geometry).area for geometry in packed_geometries) == 10
+
+
+    def test_subdivided_geometries_are_packed_without_changing_their_union(self):
+        feature_collection: dict = json.loads(open(root_dir + "/fixtures/test_feature_collection_1.json").read())
+        geometries: list = subdivide_from_feature_collection(feature_collection, THRESHOLD,
+                                                             mode=SUBDIVISION_MODE_THRESHOLD)
+        packed_geometries: list = pack_geometries(geometries)
+        assert len(packed_geometries) < len(geometries)
+        assert all(get_geojson_size(geometry) <= get_query_character_budget() for geometry in packed_geometries)
+        assert all(shape(geometry).is_valid for geometry in packed_geometries)
+        assert subdivision_covers_geometry(union_all([shape(geometry) for geometry in geometries]),
+                                           [shape(geometry) for geometry in packed_geometries])
+
+
+    def test_geojson_bounds_match_geometry_bounds(self):
+        for i in range(1, 6):
+            feature_collection: dict = \
+                json.loads(open(root_dir + f"/fixtures/test_feature_collection_{i}.json").read())
+            for feature in feature_collection["features"]:
+                assert get_geojson_bounds(feature["geometry"]) == shape(feature["geometry"]).bounds
+
+
+
+    def test_query_geometries_are_batched_under_the_query_character_limit(self):
+        feature_collection: dict = json.loads(open(root_dir + "/fixtures/test_feature_collection_1.json").read())
+        geometries: list = subdivide_from_feature_collection(feature_collection, THRESHOLD,
+                                                             mode=SUBDIVISION_MODE_THRESHOLD)
+        batches: list[list[int]] = batch_query_geometries(geometries)
+        assert [index for batch in batches for index in batch] == list(range(len(geometries)))
+        assert len(batches) < len(geometries)
+        for batch in batches:
+            assert len(batch) == 1 or get_multi_geometry_query_size(len(batch)) + \
+                   sum(get_geojson_size(geometries[index]) for index in batch) < COSMOS_QUERY_CHARACTER_LIMIT
+        assert batch_query_geometries([square(i, 0) for i in range(5)], max_geometries=2) == [[0, 1], [2, 3], [4]]
+
+
+    def test_budget_is_set_by_the_multi_geometry_queries(self):
+        # a geometry at the budget still fits, on its own, in every query postcode matching sends it in
+        assert get_multi_geometry_query_size(1) + get_query_character_budget() < COSMOS_QUERY_CHARACTER_LIMIT
+        assert get_multi_geometry_query_size(1) + get_query_character_budget() + 1 == COSMOS_QUERY_CHARACTER_LIMIT
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.async_case import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from cosmos_stand_in import CosmosStandIn, box, get_grid_snapshot
+from shapely.geometry import shape
+
+from app.cache.shard_map_cache import ShardMapCache
+from app.connections.cosmosdb_client import get_cosmos_client_manager
+from app.cosmos.cosmos_query_limiter import CosmosQueryLimiter
+from app.services import postcodes_in_flood_range_service
+from app.services.local_postcode_matching_service import (PostcodeBoundaryIndex,
+                                                          load_postcode_boundary_snapshot,
+                                                          collect_postcodes_in_flood_range)
+from app.services.postcodes_in_flood_range_service import (collect_postcodes_in_flood_range
+                                                           as collect_postcodes_in_flood_range_from_cosmos)
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+FIXTURES = [f"test_feature_collection_{i}.json" for i in range(1, 6)]
+
+
+def get_stand_in(snapshot: dict[str, list[dict]]) -> CosmosStandIn:
+    stand_in: CosmosStandIn = CosmosStandIn()
+    stand_in.add_snapshot(snapshot)
+    return stand_in
+
+
+def get_postcode_ids(flood_postcodes: dict) -> list[list[str]]:
+    return [sorted(postcode["postcode"] for postcode in postcodes) for postcodes in flood_postcodes["floodPostcodes"]]
+
+
+class LocalPostcodeMatchingTests(IsolatedAsyncioTestCase):
+
+
+    async def asyncSetUp(self):
+        patch.object(postcodes_in_flood_range_service, "get_cosmos_query_limiter",
+                     return_value=CosmosQueryLimiter()).start()
+        self.addCleanup(patch.stopall)
+
+
+    async def test_local_matching_matches_cosmos_matching(self):
+        for fixture in FIXTURES:
+            feature_collection: dict = json.loads(open(root_dir + "/fixtures/" + fixture).read())
+            geometries: list[dict] = [feature["geometry"] for feature in feature_collection["features"]]
+            x1, y1, x2, y2 = zip(*[shape(geometry).bounds for geometry in geometries])
+            snapshot: dict[str, list[dict]] = get_grid_snapshot((min(x1), min(y1), max(x2), max(y2)))
+            with patch.object(get_cosmos_client_manager(), "get_client", return_value=get_stand_in(snapshot)), \
+                    patch.object(postcodes_in_flood_range_service, "get_shard_map_cache",
+                                 return_value=ShardMapCache()):
+                cosmos_postcodes = await collect_postcodes_in_flood_range_from_cosmos(fixture, geometries)
+            local_postcodes = await collect_postcodes_in_flood_range(fixture, geometries,
+                                                                     index=PostcodeBoundaryIndex.from_snapshot(snapshot))
+            assert local_postcodes["id"] == fixture
+            assert sum(len(postcodes) for postcodes in local_postcodes["floodPostcodes"]) > 0
+            assert get_postcode_ids(local_postcodes) == get_postcode_ids(cosmos_postcodes)
+
+
+    async def test_snapshot_is_loaded_from_file(self):
+        snapshot: dict[str, list[dict]] = get_grid_snapshot((0, 0, 16, 16))
+        with tempfile.TemporaryDirectory() as directory:
+            path: str = os.path.join(directory, "snapshot.json")
+            with open(path, "w") as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+            index: PostcodeBoundaryIndex = load_postcode_boundary_snapshot(path)
+        assert len(index.postcodes) == 4096
+        flood_postcodes = await collect_postcodes_in_flood_range("flood", [box(0.1, 0.1, 0.2, 0.2),
+                                                                           box(0.15, 0.1, 0.3, 0.2)], index=index)
+        assert get_postcode_ids(flood_postcodes) == [["AA1 1AA"], ["AA1 2AA"]]
+        assert flood_postcodes["floodPostcodes"][0][0]["geometries"] == [0, 1]
+
+
+if __name__ == "__main__":
+    unittest.main()
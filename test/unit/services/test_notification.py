@@ -11,7 +11,7 @@ from app.dbschema.schema import Subscriber, Postcode
 from app.models.objects.flood_notification import FloodNotification
 from app.models.objects.floods_with_postcodes import FloodWithPostcodes
 from app.models.pydantic_models.flood_warning import FloodWarning
-from app.services.subscriber_service import get_all_subscribers_by_postcodes
+from app.services.subscriber_service import get_all_subscribers_by_postcodes, get_subscribed_postcodes
 
 root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
 
@@ -83,6 +83,11 @@ class NotificationTests(unittest.TestCase):
         Base.metadata.drop_all(mailing_list_engine)
 
 
+    def test_get_subscribed_postcodes(self):
+        assert get_subscribed_postcodes(session) == {"LA89LF", "DL84RR", "LA96HG", "LA88JJ", "LA128NS",
+                                                     "LA229EA", "LA229DG", "LA220DY"}
+
+
     @patch("app.services.notification_service.notify_subscribers")
     def test_gather_subscribers_matches_mock_return_value(self, mock_gather_method):
         test_subscriber = Subscriber(email="testemail@testmail.com")
@@ -0,0 +1,276 @@
+import asyncio
+import time
+from functools import partial
+import unittest
+from unittest.async_case import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from azure.cosmos.exceptions import CosmosHttpResponseError
+from cosmos_stand_in import CosmosStandIn
+
+from app.cache.shard_map_cache import ShardMapCache
+from app.connections.cosmosdb_client import get_cosmos_client_manager
+from app.cosmos.cosmos_query_limiter import CosmosQueryLimiter
+from app.env_vars import (area_container_suffix, district_container_suffix, full_postcode_container_suffix,
+                          postcode_database_suffix)
+from app.services import postcodes_in_flood_range_service
+from app.services.geometry_subdivision_service import batch_query_geometries
+from app.services.postcodes_in_flood_range_service import (async_match_postcodes_to_flood_geometry,
+                                                           stream_postcodes_matching_flood_geometry,
+                                                           stream_postcodes_matching_flood_geometries,
+                                                           collect_postcodes_in_flood_range,
+                                                           PostcodeMatchStats,
+                                                           DistrictPartitioning,
+                                                           get_district_partitioning)
+
+LATENCY = 0.05
+
+
+def square(x: float, y: float, size: float = 1.0) -> dict:
+    return {"type": "Polygon",
+            "coordinates": [[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]]}
+
+
+def get_stand_in(latency: float = LATENCY, districts_partitioned_by_area: bool = True) -> CosmosStandIn:
+    """
+    Two areas side by side, each of four districts in a row, each of two postcodes.
+    """
+    stand_in: CosmosStandIn = CosmosStandIn(latency)
+    for area_index, area_code in enumerate(["AB", "CD"]):
+        stand_in.add_area(area_code, square(area_index * 8, 0, 8))
+        for district_index in range(4):
+            district: str = f"{area_code}{district_index + 1}"
+            x: float = area_index * 8 + district_index * 2
+            stand_in.add_district(area_code, district, square(x, 0, 2),
+                                  None if districts_partitioned_by_area else district)
+            stand_in.add_postcode(area_code, district, f"{district} 1AA", square(x + 0.25, 0.25, 0.5))
+            stand_in.add_postcode(area_code, district, f"{district} 1AB", square(x + 1.25, 0.25, 0.5))
+    return stand_in
+
+
+class PostcodesInFloodRangeTests(IsolatedAsyncioTestCase):
+
+
+    async def asyncSetUp(self):
+        self.stand_in = get_stand_in()
+        manager = get_cosmos_client_manager()
+        self.client_patch = patch.object(manager, "get_client", return_value=self.stand_in)
+        self.shard_map_patch = patch.object(postcodes_in_flood_range_service, "get_shard_map_cache",
+                                            return_value=ShardMapCache())
+        self.limiter = CosmosQueryLimiter(64, 32)
+        self.limiter_patch = patch.object(postcodes_in_flood_range_service, "get_cosmos_query_limiter",
+                                          side_effect=lambda: self.limiter)
+        for patcher in (self.client_patch, self.shard_map_patch, self.limiter_patch):
+            patcher.start()
+        self.addCleanup(patch.stopall)
+        self.partitioning: DistrictPartitioning = get_district_partitioning()
+        self.partitioning.reset()
+        self.addCleanup(self.partitioning.reset)
+
+
+    async def test_postcodes_matching_flood_are_found(self):
+        postcodes = await async_match_postcodes_to_flood_geometry(square(3.5, 0, 6))
+        assert sorted(postcode["postcode"] for postcode in postcodes) == \
+               ["AB2 1AB", "AB3 1AA", "AB3 1AB", "AB4 1AA", "AB4 1AB", "CD1 1AA", "CD1 1AB"]
+
+
+    async def test_districts_are_queried_concurrently(self):
+        start: float = time.perf_counter()
+        postcodes = await async_match_postcodes_to_flood_geometry(square(0, 0, 16))
+        elapsed: float = time.perf_counter() - start
+        assert len(postcodes) == 16
+        # the shard map, the area extents, the areas, the districts and then every postcode query at once
+        assert elapsed < 8 * LATENCY
+        assert self.stand_in.stats.max_in_flight == 8
+
+
+    async def test_queries_in_flight_are_bounded(self):
+        self.limiter = CosmosQueryLimiter(3, {"areas": 1, "districts": 1, "postcodes": 2})
+        postcodes = await async_match_postcodes_to_flood_geometry(square(0, 0, 16))
+        assert len(postcodes) == 16
+        assert self.stand_in.stats.max_in_flight <= 3
+
+
+    async def test_postcodes_are_streamed_as_each_district_is_matched(self):
+        self.limiter = CosmosQueryLimiter(64, {"areas": 32, "districts": 32, "postcodes": 1})
+        arrivals: list[float] = []
+        start: float = time.perf_counter()
+        async for postcodes in stream_postcodes_matching_flood_geometry(square(0, 0, 16)):
+            assert len(postcodes) == 2
+            arrivals.append(time.perf_counter() - start)
+        assert len(arrivals) == 8
+        assert arrivals[0] < arrivals[-1] - 5 * LATENCY
+
+
+    async def test_failed_query_cancels_the_rest(self):
+        async def failing_query(*args, **kwargs):
+            await asyncio.sleep(LATENCY)
+            raise ValueError("query failed")
+            yield
+
+        container = self.stand_in.container("AB" + postcode_database_suffix, "AB" + district_container_suffix)
+        with patch.object(container, "query_items", side_effect=failing_query):
+            with self.assertRaises(ValueError):
+                await async_match_postcodes_to_flood_geometry(square(0, 0, 16))
+        await asyncio.sleep(2 * LATENCY)
+        assert self.stand_in.stats.in_flight == 0
+
+
+    async def test_failed_shard_lookup_cancels_the_queries_already_started(self):
+        self.match_each_geometry_separately()
+        shard_map: ShardMapCache = postcodes_in_flood_range_service.get_shard_map_cache()
+        get_intersecting_shards = shard_map.get_intersecting_shards
+        lookups: list = []
+
+        async def failing_second_lookup(client, bounds):
+            lookups.append(bounds)
+            if len(lookups) > 1:
+                raise ValueError("shard map unavailable")
+            return await get_intersecting_shards(client, bounds)
+
+        with patch.object(shard_map, "get_intersecting_shards", side_effect=failing_second_lookup):
+            with self.assertRaises(ValueError):
+                await collect_postcodes_in_flood_range("flood", [square(0, 0, 1), square(15, 0, 1)])
+        # the first geometry's queries were stopped before the error was raised, rather than left running
+        assert self.stand_in.stats.in_flight == 0
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+
+
+    async def test_each_geometry_is_collected_separately(self):
+        flood_postcodes = await collect_postcodes_in_flood_range("flood", [square(0, 0, 1), square(15, 0, 1)])
+        assert flood_postcodes["id"] == "flood"
+        assert [[postcode["postcode"] for postcode in postcodes] for postcodes in flood_postcodes["floodPostcodes"]] == \
+               [["AB1 1AA"], ["CD4 1AB"]]
+
+
+
+    def match_each_geometry_separately(self):
+        patch.object(postcodes_in_flood_range_service, "batch_query_geometries",
+                     side_effect=partial(batch_query_geometries, max_geometries=1)).start()
+
+
+    async def test_covered_district_is_not_queried_again_for_the_region(self):
+        self.match_each_geometry_separately()
+        stats: PostcodeMatchStats = PostcodeMatchStats()
+        # the first geometry covers AB1 entirely, the rest only cross into it
+        flood_postcodes = await collect_postcodes_in_flood_range(
+            "flood", [square(-1, -1, 4), square(0.5, 0.5, 0.5), square(1.4, 0.5, 0.4)], stats)
+        postcode_ids: list[str] = [postcode["postcode"] for postcodes in flood_postcodes["floodPostcodes"]
+                                   for postcode in postcodes]
+        assert sorted(postcode_ids) == ["AB1 1AA", "AB1 1AB", "AB2 1AA"]
+        assert stats.postcode_queries == 2
+        assert stats.postcode_queries_skipped == 2
+        assert self.stand_in.stats.queries_by_container["AB" + full_postcode_container_suffix] == 2
+
+
+    async def test_duplicate_postcodes_are_dropped_as_they_arrive(self):
+        self.match_each_geometry_separately()
+        stats: PostcodeMatchStats = PostcodeMatchStats()
+        # neither geometry covers AB1, but both cross both of its postcodes
+        flood_postcodes = await collect_postcodes_in_flood_range(
+            "flood", [square(0.5, 0.3, 1), square(0.5, 0.6, 1)], stats)
+        assert [[postcode["postcode"] for postcode in postcodes] for postcodes in flood_postcodes["floodPostcodes"]] == \
+               [["AB1 1AA", "AB1 1AB"], []]
+        assert stats.postcode_queries == 2
+        assert stats.duplicate_postcodes == 2
+        assert stats.postcodes_matched == 2
+
+
+
+    async def test_districts_without_a_subscriber_are_not_queried(self):
+        stats: PostcodeMatchStats = PostcodeMatchStats()
+        flood_postcodes = await collect_postcodes_in_flood_range("flood", [square(0.1, 0.1, 3.5)], stats, {"AB2"})
+        assert sorted(postcode["postcode"] for postcode in flood_postcodes["floodPostcodes"][0]) == \
+               ["AB2 1AA", "AB2 1AB"]
+        assert (stats.postcode_queries, stats.postcode_queries_pruned) == (1, 1)
+        assert stats.get_prune_rate() == 0.5
+        assert self.stand_in.stats.queries_by_container["AB" + full_postcode_container_suffix] == 1
+
+
+    async def test_only_identifiers_are_returned(self):
+        await async_match_postcodes_to_flood_geometry(square(0, 0, 1))
+        self.stand_in.stats.reset()
+        postcodes = await async_match_postcodes_to_flood_geometry(square(0, 0, 1))
+        assert postcodes == [{"postcode": "AB1 1AA", "geometries": [0]}]
+        # one area code, one district and one postcode, now that the shard map is cached
+        assert self.stand_in.stats.documents_returned == 3
+        assert self.stand_in.stats.bytes_returned < 200
+
+
+
+    async def test_district_queries_target_the_area_partition(self):
+        await async_match_postcodes_to_flood_geometry(square(0, 0, 16))
+        self.stand_in.stats.reset()
+        await async_match_postcodes_to_flood_geometry(square(0, 0, 16))
+        assert self.stand_in.stats.query_plans == 0
+        assert self.stand_in.stats.queries_by_container["AB" + district_container_suffix] == 1
+
+
+    async def test_districts_partitioned_another_way_fall_back_to_cross_partition_queries(self):
+        self.stand_in = get_stand_in(districts_partitioned_by_area=False)
+        self.client_patch.stop()
+        patch.object(get_cosmos_client_manager(), "get_client", return_value=self.stand_in).start()
+        postcodes = await async_match_postcodes_to_flood_geometry(square(0, 0, 3))
+        assert sorted(postcode["postcode"] for postcode in postcodes) == ["AB1 1AA", "AB1 1AB", "AB2 1AA"]
+        assert self.partitioning.cross_partition_areas == {"AB"}
+        self.stand_in.stats.reset()
+        await async_match_postcodes_to_flood_geometry(square(0, 0, 3))
+        # the targeted query is no longer tried first
+        assert self.stand_in.stats.queries_by_container["AB" + district_container_suffix] == 1
+        assert self.stand_in.stats.query_plans == 1
+
+
+
+    async def test_area_touched_at_its_edge_is_not_queried_across_partitions(self):
+        # the flood is inside area AB, but none of its districts
+        for _ in range(2):
+            assert await async_match_postcodes_to_flood_geometry(square(1, 5, 0.5)) == []
+        # two targeted queries, and only the first is followed by a check of the area's partition
+        assert self.stand_in.stats.queries_by_container["AB" + district_container_suffix] == 3
+        assert self.partitioning.targeted_areas == {"AB"}
+        assert self.partitioning.cross_partition_areas == set()
+
+
+    async def test_rejected_targeted_query_falls_back_to_a_cross_partition_query(self):
+        async def rejected_query(query, parameters=None, partition_key=None, **kwargs):
+            if partition_key is not None:
+                raise CosmosHttpResponseError(status_code=400, message="Partition key is not valid")
+            async for district in run_query(query, parameters or [], partition_key):
+                yield district
+
+        container = self.stand_in.container("AB" + postcode_database_suffix, "AB" + district_container_suffix)
+        run_query = container.run_query
+        with patch.object(container, "query_items", side_effect=rejected_query):
+            postcodes = await async_match_postcodes_to_flood_geometry(square(0, 0, 3))
+        assert sorted(postcode["postcode"] for postcode in postcodes) == ["AB1 1AA", "AB1 1AB", "AB2 1AA"]
+        assert self.partitioning.cross_partition_areas == {"AB"}
+
+
+    async def test_geometries_are_matched_together(self):
+        geometries: list[dict] = [square(0.5, 0.5, 0.5), square(2.5, 0.5, 0.5), square(0.6, 0.6, 0.1),
+                                  square(9.5, 0.5, 0.5)]
+        await collect_postcodes_in_flood_range("warm-up", [square(20, 20)])
+        self.stand_in.stats.reset()
+        flood_postcodes = await collect_postcodes_in_flood_range("flood", geometries)
+        # one query for each shard's areas, each area's districts and each district's postcodes (CD2 only touches
+        # the last geometry), rather than one for each geometry
+        assert self.stand_in.stats.queries_by_container == {
+            "AB" + area_container_suffix: 1, "CD" + area_container_suffix: 1,
+            "AB" + district_container_suffix: 1, "CD" + district_container_suffix: 1,
+            "AB" + full_postcode_container_suffix: 2, "CD" + full_postcode_container_suffix: 2}
+        assert [[(postcode["postcode"], postcode["geometries"]) for postcode in postcodes]
+                for postcodes in flood_postcodes["floodPostcodes"]] == \
+               [[("AB1 1AA", [0, 2])], [("AB2 1AA", [1])], [], [("CD1 1AB", [3])]]
+
+
+    async def test_each_row_is_tagged_with_the_geometries_it_matched(self):
+        postcodes: list[dict] = []
+        async for district_postcodes in stream_postcodes_matching_flood_geometries(
+                [square(0, 0, 1), square(1, 0, 1), square(0, 0, 2)]):
+            postcodes.extend(district_postcodes)
+        assert sorted((postcode["postcode"], postcode["geometries"]) for postcode in postcodes) == \
+               [("AB1 1AA", [0, 2]), ("AB1 1AB", [1, 2])]
+
+
+if __name__ == "__main__":
+    unittest.main()
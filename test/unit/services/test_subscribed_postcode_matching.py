@@ -0,0 +1,221 @@
+import json
+import os
+import unittest
+from unittest.async_case import IsolatedAsyncioTestCase
+from unittest.mock import patch, AsyncMock
+
+from cosmos_stand_in import CosmosStandIn, box, get_grid_snapshot
+from shapely.geometry import shape
+
+from app.cache import flood_updates_cache
+from app.cache.shard_map_cache import ShardMapCache
+from app.connections.cosmosdb_client import get_cosmos_client_manager
+from app.cosmos.cosmos_query_limiter import CosmosQueryLimiter
+from app.models.pydantic_models.latest_flood_update import LatestFloodUpdate
+from app.services import flood_update_service, postcodes_in_flood_range_service, subscribed_postcode_matching_service
+from app.services.postcodes_in_flood_range_service import (collect_postcodes_in_flood_range
+                                                           as collect_postcodes_in_flood_range_from_cosmos)
+from app.services.postcodes_in_flood_range_service import PostcodeMatchStats
+from app.services.subscribed_postcode_matching_service import (SubscribedPostcodeIndex,
+                                                               SubscribedDistricts,
+                                                               POSTCODE_MATCHING_BACKEND_SUBSCRIBED,
+                                                               collect_postcodes_in_flood_range,
+                                                               collect_postcodes_in_subscribed_districts,
+                                                               get_postcode_district,
+                                                               get_district_area)
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+FIXTURES = [f"test_feature_collection_{i}.json" for i in range(1, 6)]
+
+
+def get_postcode_ids(flood_postcodes: dict) -> set[str]:
+    return {postcode["postcode"] for postcodes in flood_postcodes["floodPostcodes"] for postcode in postcodes}
+
+
+class SubscribedPostcodeMatchingTests(IsolatedAsyncioTestCase):
+
+
+    async def asyncSetUp(self):
+        self.snapshot: dict[str, list[dict]] = get_grid_snapshot((0, 0, 16, 16))
+        self.stand_in: CosmosStandIn = CosmosStandIn()
+        self.stand_in.add_snapshot(self.snapshot)
+        self.subscribed_postcodes: set[str] = {"AA1 1AA", "AA1 2AA", "AA2 1AA", "AB1 1AA"}
+        patch.object(get_cosmos_client_manager(), "get_client", return_value=self.stand_in).start()
+        patch.object(postcodes_in_flood_range_service, "get_shard_map_cache", return_value=ShardMapCache()).start()
+        patch.object(postcodes_in_flood_range_service, "get_cosmos_query_limiter",
+                     return_value=CosmosQueryLimiter()).start()
+        patch.object(subscribed_postcode_matching_service, "get_session").start()
+        self.get_subscribed_postcodes = patch.object(subscribed_postcode_matching_service,
+                                                     "get_subscribed_postcodes",
+                                                     side_effect=lambda session: set(self.subscribed_postcodes)).start()
+        self.addCleanup(patch.stopall)
+
+
+    def test_postcode_district_and_area(self):
+        assert get_postcode_district("LA89LF") == "LA8"
+        assert get_postcode_district("LA12 8NS") == "LA12"
+        assert get_postcode_district("la12 8ns ") == "LA12"
+        assert get_district_area("LA12") == "LA"
+        assert get_district_area("12") is None
+
+
+    async def test_only_subscribed_postcodes_are_matched(self):
+        index: SubscribedPostcodeIndex = SubscribedPostcodeIndex()
+        flood_geometries: list[dict] = [box(0, 0, 16, 0.2), box(4.1, 0.1, 4.2, 0.2)]
+        flood_postcodes = await collect_postcodes_in_flood_range("flood", flood_geometries, index=index)
+        assert sorted(flood_postcodes["floodPostcodes"][0], key=lambda postcode: postcode["postcode"]) == \
+               [{"postcode": "AA1 1AA", "geometries": [0]}, {"postcode": "AA1 2AA", "geometries": [0]},
+                {"postcode": "AA2 1AA", "geometries": [0]}, {"postcode": "AB1 1AA", "geometries": [0, 1]}]
+        assert flood_postcodes["floodPostcodes"][1] == []
+
+
+    async def test_subscribed_matching_matches_cosmos_matching_of_subscribed_postcodes(self):
+        for fixture in FIXTURES:
+            feature_collection: dict = json.loads(open(root_dir + "/fixtures/" + fixture).read())
+            geometries: list[dict] = [feature["geometry"] for feature in feature_collection["features"]]
+            x1, y1, x2, y2 = zip(*[shape(geometry).bounds for geometry in geometries])
+            snapshot: dict[str, list[dict]] = get_grid_snapshot((min(x1), min(y1), max(x2), max(y2)))
+            stand_in: CosmosStandIn = CosmosStandIn()
+            stand_in.add_snapshot(snapshot)
+            self.subscribed_postcodes = {postcode["postcode"] for postcode in snapshot["postcodes"][::7]}
+            with patch.object(get_cosmos_client_manager(), "get_client", return_value=stand_in), \
+                    patch.object(postcodes_in_flood_range_service, "get_shard_map_cache",
+                                 return_value=ShardMapCache()):
+                cosmos_postcodes = await collect_postcodes_in_flood_range_from_cosmos(fixture, geometries)
+                subscribed_postcodes = await collect_postcodes_in_flood_range(fixture, geometries,
+                                                                              index=SubscribedPostcodeIndex())
+            expected: set[str] = get_postcode_ids(cosmos_postcodes) & self.subscribed_postcodes
+            assert len(expected) > 0
+            assert get_postcode_ids(subscribed_postcodes) == expected
+
+
+    async def test_only_newly_subscribed_postcodes_are_read(self):
+        index: SubscribedPostcodeIndex = SubscribedPostcodeIndex()
+        await index.refresh_if_stale()
+        # one query for each of the districts AA1, AA2 and AB1
+        assert self.stand_in.stats.queries == 3
+        assert set(index.geoms) == self.subscribed_postcodes
+        self.subscribed_postcodes = {"AA1 1AA", "AA1 3AA", "AB1 1AA", "AB1 2AA"}
+        index.invalidate()
+        await index.refresh_if_stale()
+        assert self.stand_in.stats.queries == 5
+        assert set(index.geoms) == self.subscribed_postcodes
+        assert (index.stats.refreshes, index.stats.added, index.stats.removed) == (2, 6, 2)
+        assert index.match_postcodes([box(0.3, 0.1, 0.4, 0.2)]) == []
+        await index.refresh_if_stale()
+        assert self.get_subscribed_postcodes.call_count == 2
+
+
+    async def test_postcodes_without_a_boundary_are_only_read_once(self):
+        self.subscribed_postcodes |= {"AA1 99ZZ", "ZZ9 9ZZ"}
+        index: SubscribedPostcodeIndex = SubscribedPostcodeIndex()
+        await index.refresh_if_stale()
+        assert index.stats.missing == 2
+        queries: int = self.stand_in.stats.queries
+        index.invalidate()
+        await index.refresh_if_stale()
+        assert self.stand_in.stats.queries == queries
+        assert set(index.geoms) == {"AA1 1AA", "AA1 2AA", "AA2 1AA", "AB1 1AA"}
+
+
+    async def test_failed_refresh_keeps_the_postcodes_already_read(self):
+        index: SubscribedPostcodeIndex = SubscribedPostcodeIndex()
+        await index.refresh_if_stale()
+        self.get_subscribed_postcodes.side_effect = ConnectionError("database is down")
+        index.invalidate()
+        await index.refresh_if_stale()
+        assert index.stats.failed_refreshes == 1
+        assert set(index.geoms) == self.subscribed_postcodes
+
+
+    async def test_every_postcode_is_matched_if_the_index_cannot_be_read(self):
+        self.get_subscribed_postcodes.side_effect = ConnectionError("database is down")
+        flood_postcodes = await collect_postcodes_in_flood_range("flood", [box(0, 0, 0.2, 0.2)],
+                                                                 index=SubscribedPostcodeIndex())
+        assert get_postcode_ids(flood_postcodes) == {"AA1 1AA"}
+        self.subscribed_postcodes = set()
+        self.get_subscribed_postcodes.side_effect = lambda session: set(self.subscribed_postcodes)
+        flood_postcodes = await collect_postcodes_in_flood_range("flood", [box(0, 0, 0.2, 0.2)],
+                                                                 index=SubscribedPostcodeIndex())
+        assert get_postcode_ids(flood_postcodes) == set()
+
+
+
+    async def test_subscribed_districts_are_counted_as_postcodes_come_and_go(self):
+        subscribed_districts: SubscribedDistricts = SubscribedDistricts()
+        await subscribed_districts.refresh_if_stale()
+        assert subscribed_districts.districts == {"AA1": 2, "AA2": 1, "AB1": 1}
+        self.subscribed_postcodes = {"AA1 2AA", "AB1 1AA", "AB1 2AA", "AC1 1AA"}
+        subscribed_districts.invalidate()
+        await subscribed_districts.refresh_if_stale()
+        assert subscribed_districts.districts == {"AA1": 1, "AB1": 2, "AC1": 1}
+        assert "AA2" not in subscribed_districts
+        assert (subscribed_districts.stats.added, subscribed_districts.stats.removed) == (6, 2)
+        assert self.stand_in.stats.queries == 0
+
+
+    async def test_failed_refresh_keeps_the_districts_already_read(self):
+        subscribed_districts: SubscribedDistricts = SubscribedDistricts()
+        await subscribed_districts.refresh_if_stale()
+        self.get_subscribed_postcodes.side_effect = ConnectionError("database is down")
+        subscribed_districts.invalidate()
+        await subscribed_districts.refresh_if_stale()
+        assert (subscribed_districts.stats.refreshes, subscribed_districts.stats.failed_refreshes) == (1, 1)
+        assert subscribed_districts.districts == {"AA1": 2, "AA2": 1, "AB1": 1}
+
+
+    async def test_only_subscribed_districts_are_queried_for_postcodes(self):
+        stats: PostcodeMatchStats = PostcodeMatchStats()
+        flood_postcodes = await collect_postcodes_in_subscribed_districts("flood", [box(0.1, 0.1, 2.9, 0.2)], stats,
+                                                                          SubscribedDistricts())
+        # the flood crosses districts AA1, AA2 and AA3, and nobody subscribes in AA3
+        assert get_postcode_ids(flood_postcodes) == {f"{district} {postcode}AA" for district in ("AA1", "AA2")
+                                                     for postcode in range(1, 5)}
+        assert (stats.postcode_queries, stats.postcode_queries_pruned) == (2, 1)
+        self.get_subscribed_postcodes.side_effect = ConnectionError("database is down")
+        flood_postcodes = await collect_postcodes_in_subscribed_districts("flood", [box(0.1, 0.1, 2.9, 0.2)],
+                                                                          subscribed_districts=SubscribedDistricts())
+        assert len(get_postcode_ids(flood_postcodes)) == 12
+
+
+
+    async def test_subscriber_since_the_last_run_is_notified_of_a_change_in_severity(self):
+        severities: dict[str, int] = {}
+        cached_postcodes: dict[str, set[str]] = {}
+        patch.object(flood_update_service, "POSTCODE_MATCHING_BACKEND", POSTCODE_MATCHING_BACKEND_SUBSCRIBED).start()
+        index: SubscribedPostcodeIndex = SubscribedPostcodeIndex()
+        patch.object(subscribed_postcode_matching_service, "get_subscribed_postcode_index", return_value=index).start()
+        patch.object(flood_update_service, "get_changed_floods", side_effect=lambda floods: floods).start()
+        patch.object(flood_update_service, "get_geojson_from_floods", new_callable=AsyncMock).start()
+        patch.object(flood_update_service, "get_flood_geometries", return_value=[box(0, 0, 0.2, 0.2)]).start()
+        patch.object(flood_update_service, "save_flood_snapshot").start()
+        patch.object(flood_update_service, "worker_queue").start()
+        patch.object(flood_updates_cache, "flood_severity_is_cached", side_effect=severities.__contains__).start()
+        patch.object(flood_updates_cache, "severity_has_changed",
+                     side_effect=lambda flood_area_id, level, severity: severities[flood_area_id] != level).start()
+        patch.object(flood_updates_cache, "get_flood_postcodes_set",
+                     side_effect=lambda flood_area_id: cached_postcodes.get(flood_area_id, set())).start()
+        patch.object(flood_update_service, "cache_flood_severity",
+                     side_effect=lambda flood_area_id, level, severity:
+                     severities.update({flood_area_id: level})).start()
+        patch.object(flood_update_service, "cache_flood_postcodes",
+                     side_effect=lambda flood_area_id, postcodes:
+                     cached_postcodes.update({flood_area_id: postcodes})).start()
+        feed: dict = json.loads(open(root_dir + "/fixtures/test_floods.json").read())
+        flood_item: dict = feed["items"][0]
+        self.subscribed_postcodes = {"AB1 1AA"}
+        first_run = await flood_update_service.process_flood_updates(
+            LatestFloodUpdate(**{**feed, "items": [flood_item]}))
+        assert [result.postcode_set for result in first_run] == [set()]
+        # somebody in the flood area subscribes, and then the flood's severity changes
+        self.subscribed_postcodes = {"AA1 1AA", "AB1 1AA"}
+        index.invalidate()
+        second_run = await flood_update_service.process_flood_updates(
+            LatestFloodUpdate(**{**feed, "items": [{**flood_item, "severityLevel": 2}]}))
+        assert [result.postcode_set for result in second_run] == [{"AA1 1AA"}]
+        assert severities == {flood_item["floodAreaID"]: 2}
+        assert cached_postcodes == {}
+
+
+if __name__ == "__main__":
+    unittest.main()